@@ -1,5 +1,8 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+
+#include "dtber.h"
 
 
 //ADC_rate = 25*f_symbol, 5 samples are averaged and then are seed to detector
@@ -16,7 +19,7 @@ static const int PHDIFF = 1415*3;
 //static int bdh[256];
 
 #define FLTS 101
-static int RRCflt[FLTS] = {45,29,12,-5,-24,-44,-64,-85,-104,-124,-141,-158,-172,-185,-194,-201,-204,-204,-200,-191,-179,-162,-141,-115,-85,-51,-12,29,75,124,176,231,287,345,404,463,522,580,637,691,744,793,838,880,917,948,975,996,1011,1020,1024,1020,1011,996,975,948,917,880,838,793,744,691,637,580,522,463,404,345,287,231,176,124,75,29,-12,-51,-85,-115,-141,-162,-179,-191,-200,-204,-204,-201,-194,-185,-172,-158,-141,-124,-104,-85,-64,-44,-24,-5,12,29,45};
+static const int RRCflt[FLTS] = {45,29,12,-5,-24,-44,-64,-85,-104,-124,-141,-158,-172,-185,-194,-201,-204,-204,-200,-191,-179,-162,-141,-115,-85,-51,-12,29,75,124,176,231,287,345,404,463,522,580,637,691,744,793,838,880,917,948,975,996,1011,1020,1024,1020,1011,996,975,948,917,880,838,793,744,691,637,580,522,463,404,345,287,231,176,124,75,29,-12,-51,-85,-115,-141,-162,-179,-191,-200,-204,-204,-201,-194,-185,-172,-158,-141,-124,-104,-85,-64,-44,-24,-5,12,29,45};
 static const int FLTGAIN = 22478;
 
 static unsigned int getbit(unsigned char *val, int vdiff)
@@ -101,15 +104,8 @@ static float calcdisc(int i, const int *ph, int dir)
 	return disc;
 }
 
-//decode bit sequence
-//Is/Qs - reference data sets for FFT
-//symlenload[i] - len for sym i	(i=0,1,2,3)
-//Is[0] ... Is[symlen[0]-1] - data for 0
-//Is[symlenload[0]] ... Is[symlenload[0]+symlenload[1]-1] - data for 1
-//....
-//maxlen - limit data to load
-
-int bercalc(const int *I, const int *Q, int size, int *numerr, int *numbit, int *Is, int *Qs, int *symlenload, int maxlen)
+//reference implementation filtering every sample, bercalc() returns the same results
+int bercalc_ref(const int *I, const int *Q, int size, int *numerr, int *numbit, int *Is, int *Qs, int *symlenload, int maxlen)
 {
 	*numbit = 0;
 	*numerr = 0;
@@ -237,4 +233,344 @@ int bercalc(const int *I, const int *Q, int size, int *numerr, int *numbit, int
 	return 1;
 }
 
+//Demodulator state of bercalc() and the BER stream. The detector reads the filtered phase difference only
+//around the symbol positions: 3 timing candidates of every BITPRD samples plus the discriminator depth.
+//So the FIR filter and getbit() are evaluated at the first use of a sample only, and the backward discriminator
+//sums are updated from the sum of the previous symbol instead of summing BITDEPTH samples again.
+#define DM_SAMPLE 1 //flt, dist and dibit of the sample are known
+#define DM_DISCB 2 //discb of the sample is known
+
+typedef struct {
+	int size;
+	long long base; //number of samples before the first one since the symbol timing was acquired
+	int *ph; //phase, used as is at the edges not covered by the filter
+	int *phdiff; //phase difference over SAMPLEDIF samples
+	int *flt; //filtered phase difference
+	unsigned int *dist; //distance to the nearest ideal phase difference
+	unsigned char *dibit;
+	unsigned int *discb; //backward discriminator sums
+	unsigned char *state; //DM_* flags
+} demod_t;
+
+static void demod_free(demod_t *d)
+{
+	free(d->ph);
+	free(d->phdiff);
+	free(d->flt);
+	free(d->dist);
+	free(d->dibit);
+	free(d->discb);
+	free(d->state);
+}
+
+//compute phase and phase difference of all samples, return 0 or -1 if memory allocation fails
+static int demod_init(demod_t *d, const int *I, const int *Q, int size, long long base)
+{
+	d->size = size;
+	d->base = base;
+	d->ph = malloc(size*sizeof(int));
+	d->phdiff = malloc(size*sizeof(int));
+	d->flt = malloc(size*sizeof(int));
+	d->dist = malloc(size*sizeof(unsigned int));
+	d->dibit = malloc(size);
+	d->discb = malloc(size*sizeof(unsigned int));
+	d->state = calloc(size, 1);
+	if (!d->ph || !d->phdiff || !d->flt || !d->dist || !d->dibit || !d->discb || !d->state) {
+		demod_free(d);
+		return -1;
+	}
+
+	for (int i=0; i<size; i++) {
+		d->ph[i] = atancord(I[i], Q[i]);
+	}
+
+	for (int i=0; i<SAMPLEDIF && i<size; i++) d->phdiff[i] = 0;
+
+	for (int i=SAMPLEDIF; i<size; i++) {
+		d->phdiff[i] = -d->ph[i] + d->ph[i-SAMPLEDIF];
+		if (d->phdiff[i] >  2*65536) d->phdiff[i] -= 4*65536;
+		if (d->phdiff[i] < -2*65536) d->phdiff[i] += 4*65536;
+	}
+	return 0;
+}
+
+static unsigned int dm_dist(demod_t *d, int i)
+{
+	if (i < 0 || i >= d->size) return 0;
+	if (!(d->state[i] & DM_SAMPLE)) {
+		int v;
+		if (i < FLTS/2 || i >= d->size-FLTS/2)
+			v = d->ph[i];
+		else {
+			const int *pd = d->phdiff + i - FLTS/2;
+			v = 0;
+			for(int j=0; j<FLTS; j++) v += pd[j] * RRCflt[j];
+			v /= FLTGAIN;
+		}
+		d->flt[i] = v;
+		d->dist[i] = getbit(d->dibit+i, v);
+		d->state[i] |= DM_SAMPLE;
+	}
+	return d->dist[i];
+}
+
+static unsigned char dm_dibit(demod_t *d, int i)
+{
+	dm_dist(d, i);
+	return d->dibit[i];
+}
 
+//same as calcdisc() of the reference, the sums of integer distances are exact in float there
+static unsigned int dm_disc(demod_t *d, int i, int dir)
+{
+	unsigned int disc = 0;
+	if (dir) {
+		for(int j=0; j<BITDEPTH; j++) disc += dm_dist(d, i+j*BITPRD);
+		return disc;
+	}
+	if (d->state[i] & DM_DISCB) return d->discb[i];
+
+	int prev = i-BITPRD;
+	if (prev-(BITDEPTH-1)*BITPRD >= 0 && (d->state[prev] & DM_DISCB))
+		disc = d->discb[prev] + dm_dist(d, i) - dm_dist(d, i-BITDEPTH*BITPRD);
+	else
+		for(int j=0; j<BITDEPTH; j++) disc += dm_dist(d, i-j*BITPRD);
+	d->discb[i] = disc;
+	d->state[i] |= DM_DISCB;
+	return disc;
+}
+
+//Symbol detector state, carried between the captures by the BER stream
+typedef struct {
+	int bitseq; //last received dibits, the expected bits of the test sequence are derived from them
+	int bct; //number of received bits while not more than 12, the bits are checked after the first 12
+	long long numerr, numbit;
+	int cursym, curlen, curpos; //current run of constant symbols
+	int symlen[4], sympos[4]; //the longest runs of the symbols
+} detector_t;
+
+static void detector_add(detector_t *det, unsigned char dibit, int pos)
+{
+	//update symbols intervals
+	if (dibit != det->cursym){
+		if (det->curlen > det->symlen[det->cursym]){
+			det->symlen[det->cursym] = det->curlen;
+			det->sympos[det->cursym] = det->curpos;
+		}
+		det->curlen = 1;
+		det->cursym = dibit;
+		det->curpos = pos;
+	}
+	else det->curlen++;
+
+	if (det->bct <= 12) det->bct += 2;
+
+	if (det->bct > 12){
+		det->numbit += 2;
+
+		if((dibit>>1) != (((det->bitseq>>8)^(det->bitseq>>4))&1)) det->numerr++;
+		if((dibit & 1) != (((det->bitseq>>7)^(det->bitseq>>3))&1)) det->numerr++;
+	}
+	det->bitseq = ((det->bitseq<<2)+(dibit&3)) & 0x3FF;
+}
+
+//find the symbol timing offset and the first symbol, return position of the next symbol
+static int acquire(demod_t *d, detector_t *det)
+{
+	unsigned int disc, bdisc = 0;
+	int ofs = 0;
+
+	for(int i=0; i<BITPRD; i++) {
+		disc = dm_disc(d, FLTS/2+i, 1);
+		if(i == 0 || disc < bdisc) {
+			bdisc = disc;
+			ofs = i;
+		}
+	}
+
+	unsigned char dibit = dm_dibit(d, FLTS/2+ofs);
+	det->bitseq = dibit&3;
+	det->bct = 2;
+	det->cursym = dibit;
+	det->curlen = 1;
+	det->curpos = FLTS/2 + ofs;
+	for(int i=0; i<4; i++) det->symlen[i] = 0;
+
+	return FLTS/2+ofs+BITPRD;
+}
+
+//detect symbols from position i while the filter covers the samples, return position of the next symbol
+static int detect(demod_t *d, int i, detector_t *det)
+{
+	unsigned int disc[3];
+	unsigned char dibit;
+	int dir;
+
+	while (i < d->size-FLTS/2-1) {
+		dir = d->base + i < (BITDEPTH+1)*BITPRD;
+		disc[0] = dm_disc(d, i, dir);
+		disc[1] = dm_disc(d, i+1, dir);
+		disc[2] = dm_disc(d, i-1, dir);
+
+		if (disc[1] < disc[0] && disc[1] < disc[2]) {
+			dibit = dm_dibit(d, i+1);
+			i += (BITPRD+1);
+		} else if (disc[2] < disc[0] && disc[2] < disc[1]) {
+			dibit = dm_dibit(d, i-1);
+			i += (BITPRD-1);
+		} else {
+			dibit = dm_dibit(d, i);
+			i += BITPRD;
+		}
+
+		detector_add(det, dibit, i-BITPRD);
+	}
+	return i;
+}
+
+//an error of a received dibit spoils the expected bits of the following dibits as well
+static long long correct_numerr(long long numerr, long long numbit)
+{
+	if(numerr<numbit/3) return numerr/3;
+	else if(numerr<2*numbit/3) return numerr/2;
+	return numerr;
+}
+
+//decode bit sequence
+//Is/Qs - reference data sets for FFT
+//symlenload[i] - len for sym i	(i=0,1,2,3)
+//Is[0] ... Is[symlen[0]-1] - data for 0
+//Is[symlenload[0]] ... Is[symlenload[0]+symlenload[1]-1] - data for 1
+//....
+//maxlen - limit data to load
+
+int bercalc(const int *I, const int *Q, int size, int *numerr, int *numbit, int *Is, int *Qs, int *symlenload, int maxlen)
+{
+	*numbit = 0;
+	*numerr = 0;
+	if (size < SAMPLEDIF+FLTS+5+BITDEPTH*25)
+		return 0;
+
+	demod_t d;
+	detector_t det = {0};
+	if (demod_init(&d, I, Q, size, 0) < 0)
+		return 0;
+
+	detect(&d, acquire(&d, &det), &det);
+	demod_free(&d);
+
+	*numbit = det.numbit;
+	*numerr = correct_numerr(det.numerr, det.numbit);
+
+	//load symbols intervals
+	int index = 0, actlen;
+	for(int i=0; i<4; i++){
+		symlenload[i] = det.symlen[i]*BITPRD;
+		actlen=0;
+		for(int j=det.sympos[i]; j<det.sympos[i]+symlenload[i]; j++){
+			if(j>=0 && j<size && index<maxlen) {
+				Is[index] = I[j];
+				Qs[index] = Q[j];
+				index++;
+				actlen++;
+			}
+		}
+		symlenload[i] = actlen;
+	}
+
+	return 1;
+}
+
+//BER accumulated over successive captures. Samples from the position of the next symbol back by the
+//filter and discriminator depth are kept, so that a contiguous capture continues the demodulation of
+//the previous one as if both were a single capture.
+#define BS_KEEP (FLTS+SAMPLEDIF+(BITDEPTH+1)*BITPRD) //samples kept before the next symbol
+#define BS_ACQMIN (2*(BITDEPTH+1)*BITPRD+FLTS) //samples needed to acquire the symbol timing
+
+struct berstream {
+	int *I, *Q; //kept samples
+	int size;
+	int next; //position of the next symbol in the kept samples
+	long long base; //number of samples before the kept ones since the symbol timing was acquired
+	int acquired;
+	detector_t det;
+};
+
+berstream *berstream_open(void)
+{
+	return calloc(1, sizeof(berstream));
+}
+
+void berstream_close(berstream *s)
+{
+	if (!s) return;
+	free(s->I);
+	free(s->Q);
+	free(s);
+}
+
+void berstream_reset(berstream *s)
+{
+	free(s->I);
+	free(s->Q);
+	memset(s, 0, sizeof(berstream));
+}
+
+int berstream_add(berstream *s, const int *I, const int *Q, int size, int contiguous)
+{
+	if (!contiguous) {
+		//a gap: the kept samples, the symbol timing and the test sequence register are useless
+		s->size = 0;
+		s->acquired = 0;
+		s->base = 0;
+	}
+
+	int n = s->size + size;
+	int *BI = malloc(n*sizeof(int)), *BQ = malloc(n*sizeof(int));
+	if (!BI || !BQ) {
+		free(BI);
+		free(BQ);
+		return -1;
+	}
+	if (s->size > 0) {
+		memcpy(BI, s->I, s->size*sizeof(int));
+		memcpy(BQ, s->Q, s->size*sizeof(int));
+	}
+	memcpy(BI+s->size, I, size*sizeof(int));
+	memcpy(BQ+s->size, Q, size*sizeof(int));
+	free(s->I);
+	free(s->Q);
+	s->I = BI;
+	s->Q = BQ;
+	s->size = n;
+
+	if (!s->acquired && n < BS_ACQMIN)
+		return 0; //wait for more samples
+
+	demod_t d;
+	if (demod_init(&d, BI, BQ, n, s->base) < 0)
+		return -1;
+
+	long long numbit = s->det.numbit;
+	int i = s->acquired ? s->next : acquire(&d, &s->det);
+	s->acquired = 1;
+	i = detect(&d, i, &s->det);
+	demod_free(&d);
+
+	//keep the samples needed to continue
+	int start = i > BS_KEEP ? i - BS_KEEP : 0;
+	if (start > n) start = n;
+	memmove(s->I, s->I+start, (n-start)*sizeof(int));
+	memmove(s->Q, s->Q+start, (n-start)*sizeof(int));
+	s->size = n - start;
+	s->next = i - start;
+	s->base += start;
+
+	return (int)(s->det.numbit - numbit);
+}
+
+void berstream_result(const berstream *s, long long *numerr, long long *numbit)
+{
+	*numbit = s->det.numbit;
+	*numerr = correct_numerr(s->det.numerr, s->det.numbit);
+}
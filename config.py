@@ -2,6 +2,7 @@ import json
 from tasks import DTScenario
 import tasks
 import dtglobals as dtg
+import dtfft
 from os import getenv
 from singleton import Singleton
 from traceback import print_exc
@@ -46,6 +47,9 @@ class DTConfiguration(metaclass=Singleton):
             dtg.LANG = self.config['language']
         else:
             dtg.LANG = 'ru'
+
+        # FFT backend: dict with keys backend ('scipy', 'pyfftw', 'numpy', 'auto'), workers, wisdom, planner
+        dtfft.configure(self.config.get('fft'))
         print(f'Configuration loaded from {filename} with {nscenarios} scenarios')
 
         return True
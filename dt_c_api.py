@@ -1,34 +1,92 @@
-from ctypes import cdll, c_double, c_uint, c_int, byref
+from ctypes import cdll, c_double, c_uint, c_int, c_float, c_size_t, c_char, c_char_p, c_void_p, c_longlong, \
+    POINTER, byref
 # from ctypes.util import find_library # does not work with LD_LIBRARY_PATH
-from numpy import array
-from os import getenv
+from numpy import ascontiguousarray, zeros, full, broadcast_to, concatenate, cumsum, arange, nan, float64, int32, uint32
+from numpy.ctypeslib import ndpointer
+from os import getenv, close, cpu_count
+from threading import local, Lock
+from concurrent.futures import ThreadPoolExecutor
+from serial import SerialException
 
-_libdmr = cdll.LoadLibrary(getenv("HOME") + "/dmr/lib/libdmr.so")
+try:
+    _libdmr = cdll.LoadLibrary(getenv("HOME") + "/dmr/lib/libdmr.so")
+except OSError as exc:
+    # spectrum analysis falls back to the NumPy implementation, see the end of the module
+    print(f'dt_c_api: {exc}, NumPy analysis engine is used')
+    _libdmr = None
+
+# NumPy arrays are passed to the library without copying, they must be C-contiguous of the declared type
+_double_array = ndpointer(dtype=float64, ndim=1, flags='C_CONTIGUOUS')
+_double_out_array = ndpointer(dtype=float64, ndim=1, flags=('C_CONTIGUOUS', 'WRITEABLE'))
+_int_array = ndpointer(dtype=int32, ndim=1, flags='C_CONTIGUOUS')
+_int_out_array = ndpointer(dtype=int32, ndim=1, flags=('C_CONTIGUOUS', 'WRITEABLE'))
+_c_double_p = POINTER(c_double)
+_c_int_p = POINTER(c_int)
+
+if _libdmr is not None:
+    _libdmr.getpllreg.argtypes = [c_uint, c_int, c_int, c_int, c_int, c_int,
+                                  ndpointer(dtype=uint32, ndim=1, shape=(6,), flags=('C_CONTIGUOUS', 'WRITEABLE'))]
+    _libdmr.getpllreg.restype = c_int
+    _libdmr.peak_search.argtypes = [_double_array, c_int, c_int, c_int, _c_double_p, _c_double_p]
+    _libdmr.peak_search.restype = c_int
+    _libdmr.get_inl_fm.argtypes = [_double_array, c_int, c_double, _c_double_p, _c_double_p]
+    _libdmr.get_inl_fm.restype = c_int
+    _libdmr.get_inl.argtypes = [_double_array, c_int, c_double, _c_double_p]
+    _libdmr.get_inl.restype = c_int
+    _libdmr.bercalc.argtypes = [_int_array, _int_array, c_int, _c_int_p, _c_int_p,
+                                _int_out_array, _int_out_array, _int_out_array, c_int]
+    _libdmr.bercalc.restype = c_int
+    _libdmr.berstream_open.restype = c_void_p
+    _libdmr.berstream_close.argtypes = [c_void_p]
+    _libdmr.berstream_reset.argtypes = [c_void_p]
+    _libdmr.berstream_add.argtypes = [c_void_p, _int_array, _int_array, c_int, c_int]
+    _libdmr.berstream_add.restype = c_int
+    _libdmr.berstream_result.argtypes = [c_void_p, POINTER(c_longlong), POINTER(c_longlong)]
+    _libdmr.peak_search_batch.argtypes = [_double_array, _int_array, _int_array, c_int, _int_array, _int_array, c_int,
+                                          _double_out_array, _double_out_array, _int_out_array]
+    _libdmr.peak_search_batch.restype = c_int
+    _libdmr.get_inl_fm_batch.argtypes = [_double_array, _int_array, _int_array, c_int, _double_array,
+                                         _double_out_array, _double_out_array, _int_out_array]
+    _libdmr.get_inl_fm_batch.restype = c_int
+    _libdmr.get_inl_batch.argtypes = [_double_array, _int_array, _int_array, c_int, _double_array,
+                                      _double_out_array, _int_out_array]
+    _libdmr.get_inl_batch.restype = c_int
+    _libdmr.openserial.argtypes = [c_char_p]
+    _libdmr.flushserial.argtypes = [c_int]
+    _libdmr.writepacket.argtypes = [c_int, c_char_p, c_size_t, c_float]
+    _libdmr.readpacket.argtypes = [c_int, c_float, c_char_p, c_size_t, c_int]
+
+
+def _require(function: str):
+    """ Raise OSError if libdmr is not loaded """
+    if _libdmr is None:
+        raise OSError(f'{function}: libdmr is not available')
+
+
+def _as_doubles(amp):
+    """ Return the sequence as contiguous array of doubles, NumPy arrays of this type are not copied """
+    return ascontiguousarray(amp, dtype=float64)
 
 
 def get_pll_regs(freq: int):
     """ Return PLL register values for a given frequency setting
     """
-    # init ctypes uint array with nulls
-    regs = (c_uint*6)(*[0]*6)
-    rc = _libdmr.getpllreg(c_uint(freq),
-                           c_int(1), c_int(1), c_int(0), c_int(0), c_int(0),
-                           regs)
+    _require('get_pll_regs')
+    regs = zeros(6, dtype=uint32)
+    rc = _libdmr.getpllreg(freq, 1, 1, 0, 0, 0, regs)
     if rc == 0:
         return None
 
-    return list(regs)
+    return regs.tolist()
 
 
 def get_peak(amp, start: int, end: int, strict: bool = True):
     """ Return peak power and weghted mean frequency for a given FFT spectrum
     """
-    c_amp = (c_double*len(amp))(*amp)
     c_pwr = c_double(0)
     c_fpeak = c_double(0)
-    rc = _libdmr.peak_search(c_amp, c_int(start), c_int(end), c_int(strict),
-                             byref(c_pwr), byref(c_fpeak))
-    if rc == c_int(0):
+    rc = _libdmr.peak_search(_as_doubles(amp), start, end, int(strict), byref(c_pwr), byref(c_fpeak))
+    if rc == 0:
         return None, None
 
     return c_pwr.value, c_fpeak.value
@@ -38,12 +96,11 @@ def get_inl_fm(amp, fm):
     """ Return INL and modulation index for a given FFT spectrum of FM modulated signal
         and nominal modulating frequency
     """
-    c_amp = (c_double*len(amp))(*amp)
+    amp = _as_doubles(amp)
     c_inl = c_double(0)
     c_h = c_double(0)
-    rc = _libdmr.get_inl_fm(c_amp, c_int(len(amp)), c_double(fm),
-                            byref(c_inl), byref(c_h))
-    if rc == c_int(0):
+    rc = _libdmr.get_inl_fm(amp, amp.size, fm, byref(c_inl), byref(c_h))
+    if rc == 0:
         return None, None
     return c_inl.value, c_h.value
 
@@ -51,28 +108,261 @@ def get_inl_fm(amp, fm):
 def get_inl(amp, f):
     """ Return INL (THDR) for a given FFT spectrum and nominal main harmonic frequency
     """
-    c_amp = (c_double*len(amp))(*amp)
+    amp = _as_doubles(amp)
     c_inl = c_double(0)
-    rc = _libdmr.get_inl(c_amp, c_int(len(amp)), c_double(f),
-                         byref(c_inl))
-    if rc == c_int(0):
+    rc = _libdmr.get_inl(amp, amp.size, f, byref(c_inl))
+    if rc == 0:
         return None
     return c_inl.value
 
 
+def _pack_spectra(spectra):
+    """ Return one buffer with all spectra, offsets and lengths of the spectra in it.
+        Rows of a 2D array are not copied if it is a contiguous array of doubles.
+    """
+    if getattr(spectra, 'ndim', None) == 2:
+        amp = _as_doubles(spectra)
+        n, m = amp.shape
+        return amp.reshape(-1), arange(0, n*m, m, dtype=int32), full(n, m, dtype=int32)
+    spectra = [_as_doubles(amp).reshape(-1) for amp in spectra]
+    lengths = ascontiguousarray([amp.size for amp in spectra], dtype=int32)
+    offsets = zeros(len(spectra), dtype=int32)
+    cumsum(lengths[:-1], out=offsets[1:])
+    amp = concatenate(spectra) if len(spectra) > 0 else zeros(0)
+    return amp, offsets, lengths
+
+
+def _per_spectrum(values, n, dtype):
+    """ Broadcast a scalar or a sequence of values to a contiguous array of n values """
+    return ascontiguousarray(broadcast_to(ascontiguousarray(values, dtype=dtype), (n,)))
+
+
+def get_peaks(spectra, start, end, strict: bool = True):
+    """ Batched get_peak() for many spectra in one call.
+        spectra    - 2D array with a spectrum per row or a sequence of 1D spectra of any lengths
+        start, end - bin ranges of the peak search, scalars or sequences with a value per spectrum
+        Return arrays of peak powers and weighted mean frequencies, NaN for the spectra without a good peak.
+    """
+    amp, offsets, lengths = _pack_spectra(spectra)
+    n = lengths.size
+    pwr, fpeak, ok = zeros(n), zeros(n), zeros(n, dtype=int32)
+    _libdmr.peak_search_batch(amp, offsets, lengths, n, _per_spectrum(start, n, int32), _per_spectrum(end, n, int32),
+                              int(strict), pwr, fpeak, ok)
+    pwr[ok == 0] = nan
+    fpeak[ok == 0] = nan
+    return pwr, fpeak
+
+
+def get_inls_fm(spectra, fm):
+    """ Batched get_inl_fm(): return arrays of INL and modulation index, NaN for failed spectra.
+        fm - nominal modulating frequency [bins], scalar or sequence with a value per spectrum
+    """
+    amp, offsets, lengths = _pack_spectra(spectra)
+    n = lengths.size
+    inl, h, ok = zeros(n), zeros(n), zeros(n, dtype=int32)
+    _libdmr.get_inl_fm_batch(amp, offsets, lengths, n, _per_spectrum(fm, n, float64), inl, h, ok)
+    inl[ok == 0] = nan
+    h[ok == 0] = nan
+    return inl, h
+
+
+def get_inls(spectra, f):
+    """ Batched get_inl(): return array of INL, NaN for failed spectra.
+        f - nominal main harmonic frequency [bins], scalar or sequence with a value per spectrum
+    """
+    amp, offsets, lengths = _pack_spectra(spectra)
+    n = lengths.size
+    inl, ok = zeros(n), zeros(n, dtype=int32)
+    _libdmr.get_inl_batch(amp, offsets, lengths, n, _per_spectrum(f, n, float64), inl, ok)
+    inl[ok == 0] = nan
+    return inl
+
+
+_scratch = local()  # per-thread buffers, berbuffers - output arrays (Iref, Qref, symlenref) of get_ber() by maxlen
+
+
 def get_ber(iamp, qamp, maxlen):
-    """ Calculate number of total and erroneously decoded symbols, symbol intervals
+    """ Calculate number of total and erroneously decoded symbols, symbol intervals.
+        Returned arrays Iref, Qref and symlenref are reused by the next call with the same maxlen
+        in the same thread, copy them if they are to be kept.
     """
-    c_size = c_int(len(iamp))
-    c_iamp = (c_int*len(iamp))(*iamp)
-    c_qamp = (c_int*len(qamp))(*qamp)
-    c_iref = (c_int*maxlen)(*[0]*maxlen)
-    c_qref = (c_int*maxlen)(*[0]*maxlen)
-    c_symlenref = (c_int*4)(*[0]*4)
-    c_maxlen = c_int(maxlen)
+    iamp = ascontiguousarray(iamp, dtype=int32)
+    qamp = ascontiguousarray(qamp, dtype=int32)
+    if not hasattr(_scratch, 'berbuffers'):
+        _scratch.berbuffers = dict()
+    buffers = _scratch.berbuffers.get(maxlen)
+    if buffers is None:
+        buffers = _scratch.berbuffers[maxlen] = (zeros(maxlen, dtype=int32), zeros(maxlen, dtype=int32),
+                                                 zeros(4, dtype=int32))
+    Iref, Qref, symlenref = buffers
+    Iref.fill(0)
+    Qref.fill(0)
+    symlenref.fill(0)
     c_numerr = c_int(0)
     c_numbit = c_int(0)
-    rc = _libdmr.bercalc(c_iamp, c_qamp, c_size, byref(c_numerr), byref(c_numbit), c_iref, c_qref, c_symlenref, c_maxlen)
-    if rc == c_int(0):
-        return None, None
-    return c_numerr.value, c_numbit.value, array(c_iref, dtype=int), array(c_qref, dtype=int), array(c_symlenref, dtype=int)
+    rc = _libdmr.bercalc(iamp, qamp, min(iamp.size, qamp.size), byref(c_numerr), byref(c_numbit),
+                         Iref, Qref, symlenref, maxlen)
+    if rc == 0:
+        return None, None, None, None, None
+    return c_numerr.value, c_numbit.value, Iref, Qref, symlenref
+
+
+class DTBerStream:
+    """ Bit error rate of the DMR test sequence accumulated over successive captures by libdmr.
+        Captures following each other without a gap (contiguous=True) are demodulated as one signal:
+        the filter history, symbol timing and the register of the test sequence are carried over, so no
+        samples and bits are lost at the boundaries. After a gap the symbol timing is acquired anew and
+        the first 12 bits of the capture are not checked.
+    """
+
+    def __init__(self):
+        _require('DTBerStream')
+        self.handle = _libdmr.berstream_open()
+        if not self.handle:
+            raise MemoryError('DTBerStream: allocation failed')
+
+    def add(self, iamp, qamp, contiguous: bool = False):
+        """ Demodulate a capture of I and Q samples, return number of bits decoded from it """
+        iamp = ascontiguousarray(iamp, dtype=int32)
+        qamp = ascontiguousarray(qamp, dtype=int32)
+        nbit = _libdmr.berstream_add(self.handle, iamp, qamp, min(iamp.size, qamp.size), int(contiguous))
+        if nbit < 0:
+            raise MemoryError('DTBerStream: allocation failed')
+        return nbit
+
+    def result(self):
+        """ Return accumulated numbers of erroneous and total bits """
+        c_numerr = c_longlong(0)
+        c_numbit = c_longlong(0)
+        _libdmr.berstream_result(self.handle, byref(c_numerr), byref(c_numbit))
+        return c_numerr.value, c_numbit.value
+
+    @property
+    def ber(self):
+        """ Accumulated bit error rate or None if no bits are decoded yet """
+        numerr, numbit = self.result()
+        return numerr/numbit if numbit > 0 else None
+
+    def reset(self):
+        _libdmr.berstream_reset(self.handle)
+
+    def close(self):
+        if self.handle:
+            _libdmr.berstream_close(self.handle)
+            self.handle = None
+
+    def __del__(self):
+        if getattr(self, 'handle', None):
+            self.close()
+
+
+_pool = None
+_poolLock = Lock()
+
+
+def parallel_map(function, *iterables, workers: int = None):
+    """ Return list of function results for the items of iterables computed in a pool of threads.
+        libdmr is reentrant and ctypes releases GIL during the calls, so the analyses run on all cores.
+        The pool of cpu_count() threads is shared, workers limits the number of items analysed at once.
+    """
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=cpu_count() or 1, thread_name_prefix='libdmr')
+    if workers is None or workers >= (cpu_count() or 1):
+        return list(_pool.map(function, *iterables))
+    # chunks of workers items
+    results = []
+    items = list(zip(*iterables))
+    for start in range(0, len(items), workers):
+        results.extend(_pool.map(function, *zip(*items[start:start+workers])))
+    return results
+
+
+def _ber_copy(iamp, qamp, maxlen):
+    numerr, numbit, Iref, Qref, symlenref = get_ber(iamp, qamp, maxlen)
+    if numerr is None:
+        return numerr, numbit, Iref, Qref, symlenref
+    return numerr, numbit, Iref.copy(), Qref.copy(), symlenref.copy()
+
+
+def get_bers(iamps, qamps, maxlen, workers: int = None):
+    """ get_ber() for sequences of I and Q captures computed in parallel, see parallel_map().
+        Returned arrays are own copies of each result.
+    """
+    iamps, qamps = list(iamps), list(qamps)
+    return parallel_map(_ber_copy, iamps, qamps, [maxlen]*len(iamps), workers=workers)
+
+
+class DTNativePort:
+    """ Serial port of the device driven by serial.c routines of libdmr.
+        Implements the part of serial.Serial interface used by DTSerialCom.
+        Replies are read by readinto() directly into the caller buffer (bytearray, NumPy array, memoryview).
+    """
+
+    def __init__(self, device: str, timeout=3):
+        self.name = device
+        self.timeout = timeout
+        self.is_open = False
+        if _libdmr is None:
+            raise SerialException('Native serial port requires libdmr')
+        self.handle = _libdmr.openserial(device.encode())
+        if self.handle < 0:
+            raise SerialException(f'Can not open device {device}')
+        self.is_open = True
+
+    def write(self, data):
+        nw = _libdmr.writepacket(self.handle, bytes(data), len(data), c_float(self.timeout or 0))
+        if nw < 0:
+            raise SerialException(f'Write to {self.name} failed')
+        return nw
+
+    def readinto(self, buffer, timeout=None):
+        """ Read into the writable buffer until it is full or timeout (port timeout by default) expires.
+            Return number of bytes read.
+        """
+        size = memoryview(buffer).nbytes
+        if size == 0:
+            return 0
+        if timeout is None:
+            timeout = self.timeout or 0
+        elif timeout <= 0:
+            timeout = 1e-6  # only the data available, not positive timeout means no timeout in readpacket()
+        c_buffer = (c_char*size).from_buffer(buffer)
+        nr = _libdmr.readpacket(self.handle, c_float(timeout), c_buffer, size, 0)
+        if nr < 0:
+            raise SerialException(f'Read from {self.name} failed')
+        return nr
+
+    def read_until(self, expected=b'END', size=65536):
+        """ Read until END (the only terminator supported) or size bytes are received or timeout expires """
+        if expected != b'END':
+            raise ValueError('Only END terminator is supported')
+        buffer = bytearray(size)
+        nr = _libdmr.readpacket(self.handle, c_float(self.timeout or 0), (c_char*size).from_buffer(buffer), size, 1)
+        if nr < 0:
+            raise SerialException(f'Read from {self.name} failed')
+        return bytes(buffer[:nr])
+
+    def reset_input_buffer(self):
+        if _libdmr.flushserial(self.handle) < 0:
+            raise SerialException(f'Flush of {self.name} failed')
+
+    def reset_output_buffer(self):
+        pass  # both directions are flushed by reset_input_buffer()
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        if self.is_open:
+            close(self.handle)
+            self.is_open = False
+
+    def __del__(self):
+        self.close()
+
+
+if _libdmr is None:
+    from dt_np_api import get_peak, get_inl_fm, get_inl, get_peaks, get_inls_fm, get_inls, get_ber, \
+        DTBerStream  # noqa: F401,F811
@@ -0,0 +1,369 @@
+""" NumPy implementation of the analysis of libdmr: peak search and INL (inl.c), DMR demodulation and BER (ber.c).
+    dt_c_api uses these functions if libdmr is not available. Results of the spectrum analysis repeat the ones
+    of libdmr, the greedy peak growth is evaluated with cumulative power sums instead of the loops over bins.
+"""
+from sys import stderr
+import numpy as np
+from scipy.special import jv
+from scipy.signal import oaconvolve
+
+_EPS = 0.000001  # relative power increment to add a falling bin to the peak
+_EPSRAW = 0.01  # relative power increment to add any bin to the peak
+_FREQWH = 0.1  # relative half width of the harmonic windows
+
+# table of log(J2(h)/J1(h)) for modulation indexes h from 0.1 to 3.8
+_NH = 38
+_HMIN = 0.1
+_HMAX = 3.8
+_hstep = (_HMAX-_HMIN)/(_NH-1)
+_htable = np.cumsum(np.concatenate(([_HMIN], np.full(_NH-1, _hstep))))  # accumulated as in inl.c
+_lmitable = np.log(jv(2, _htable)/jv(1, _htable))
+
+
+def _accepted(pwr0, steps, descending):
+    """ Return number of the steps accepted one by one until the first rejected one.
+        pwr0 - peak power before the steps, steps - powers of the bins, descending - if bins are falling
+    """
+    totals = np.cumsum(np.concatenate(([pwr0], steps)))  # sequential sums as in the loop of inl.c
+    rel = (totals[1:]-totals[:-1])/totals[:-1]
+    rejected = ~((rel > _EPSRAW) | ((rel > _EPS) & descending))
+    return int(np.argmax(rejected)) if rejected.any() else steps.size, totals
+
+
+def _peak(amp, fmin: int, fmax: int, strict: bool):
+    """ Return peak power and weighted mean frequency found in bins fmin...fmax or None, None """
+    if fmin >= fmax:
+        return None, None
+    a = amp[fmin:fmax+1]
+    ip = int(np.argmax(a))
+    p = a*a
+    if p[ip] == 0:
+        return None, None
+
+    # the peak grows from the maximum bin to the right and to the left by turns: bin ip is counted twice
+    # in the running power as in inl.c; the sides are merged in the order of the checks
+    right, left = p[ip:], p[ip::-1]
+    rdesc = np.concatenate(([False], a[ip+1:] < a[ip:-1]))
+    ldesc = np.concatenate(([False], a[ip-1::-1] < a[ip:0:-1])) if ip > 0 else np.zeros(1, dtype=bool)
+    nr, nl = right.size, left.size
+    order = np.argsort(np.concatenate((2*np.arange(nr), 2*np.arange(nl)+1)), kind='stable')
+    steps = np.concatenate((right, left))[order]
+    desc = np.concatenate((rdesc, ldesc))[order]
+    isright = order < nr
+
+    nacc, totals = _accepted(p[ip], steps, desc)
+    nright = int(isright[:nacc].sum())
+    nleft = nacc - nright
+    if nacc < steps.size:
+        # one side stopped, the other side continues alone from the power reached
+        other = ~isright[nacc+1:] if isright[nacc] else isright[nacc+1:]
+        nmore, _ = _accepted(totals[nacc], steps[nacc+1:][other], desc[nacc+1:][other])
+        if isright[nacc]:
+            nleft += nmore
+        else:
+            nright += nmore
+
+    bp, bm = ip + nright, ip - nleft  # bins bm+1...bp-1 of the window make the peak
+    weights = p[bm+1:bp]
+    pwr = np.cumsum(weights)[-1]
+    fpeak = np.cumsum(weights*np.arange(fmin+bm+1, fmin+bp))[-1]/pwr
+
+    if strict and (nright == nr or nleft == nl):
+        return None, None
+
+    return float(pwr), float(fpeak)
+
+
+def _window(f: float, num: int):
+    return int(min(max(f*(1-_FREQWH), 0), num-1)), int(min(max(f*(1+_FREQWH), 0), num-1))
+
+
+def get_peak(amp, start: int, end: int, strict: bool = True):
+    """ Return peak power and weghted mean frequency for a given FFT spectrum
+    """
+    return _peak(np.asarray(amp, dtype=np.float64), start, end, strict)
+
+
+def get_inl_fm(amp, fm):
+    """ Return INL and modulation index for a given FFT spectrum of FM modulated signal
+        and nominal modulating frequency
+    """
+    amp = np.asarray(amp, dtype=np.float64)
+    num = amp.size
+
+    p1, fest = _peak(amp, *_window(fm, num), False)
+    if p1 is None:
+        print('Could not find the main frequency peak', file=stderr)
+        return None, None
+
+    p2, _ = _peak(amp, *_window(2*fest, num), False)
+    if p2 is None:
+        print('Could not find the second harmonic peak', file=stderr)
+        return None, None
+
+    g = np.log(p2/p1)/2
+    above = g < _lmitable
+    if not above.any():
+        print(f'Could not evaluate modulation index, too large harmonic fraction {np.sqrt(p2/p1):.3g}', file=stderr)
+        return None, None
+    ih = int(np.argmax(above))
+    ih2 = ih+1 if ih == 0 else ih-1
+    h = _HMIN + _hstep*(ih-(_lmitable[ih]-g)/(_lmitable[ih]-_lmitable[ih2]))
+
+    ptot = p1+p2
+    pref, jnref = (p2, jv(2, h)) if p2 > p1 else (p1, jv(1, h))
+    perror = 0
+    for i in range(3, 30):
+        pn, _ = _peak(amp, *_window(i*fest, num), True)
+        if pn is None:
+            break
+        pnr = pref*(jv(i, h)/jnref)**2
+        ptot += pnr
+        perror += abs(pn-pnr)
+
+    if perror == 0:
+        return None, None
+
+    return float(np.sqrt(perror/ptot)), float(h)
+
+
+def get_inl(amp, f):
+    """ Return INL (THDR) for a given FFT spectrum and nominal main harmonic frequency
+    """
+    amp = np.asarray(amp, dtype=np.float64)
+    num = amp.size
+
+    p1, fest = _peak(amp, *_window(f, num), False)
+    if p1 is None:
+        print('Could not find the main frequency peak', file=stderr)
+        return None
+
+    pd = 0
+    for i in range(2, 30):
+        pn, _ = _peak(amp, *_window(i*fest, num), True)
+        if pn is None or pn < 1e-15*pd:
+            break
+        pd += pn
+
+    return float(np.sqrt(pd/(pd+p1)))
+
+
+def _spectra(spectra):
+    if getattr(spectra, 'ndim', None) == 2:
+        return np.asarray(spectra, dtype=np.float64)
+    return [np.asarray(amp, dtype=np.float64).reshape(-1) for amp in spectra]
+
+
+def get_peaks(spectra, start, end, strict: bool = True):
+    """ get_peak() for many spectra, see dt_c_api.get_peaks() """
+    spectra = _spectra(spectra)
+    n = len(spectra)
+    start, end = np.broadcast_to(start, (n,)), np.broadcast_to(end, (n,))
+    pwr, fpeak = np.full(n, np.nan), np.full(n, np.nan)
+    for k, amp in enumerate(spectra):
+        if amp.size == 0:
+            continue
+        lo, hi = (int(min(max(v, 0), amp.size-1)) for v in (start[k], end[k]))
+        pk, fk = _peak(amp, lo, hi, strict)
+        if pk is not None:
+            pwr[k], fpeak[k] = pk, fk
+    return pwr, fpeak
+
+
+def get_inls_fm(spectra, fm):
+    """ get_inl_fm() for many spectra, see dt_c_api.get_inls_fm() """
+    spectra = _spectra(spectra)
+    n = len(spectra)
+    fm = np.broadcast_to(fm, (n,))
+    inl, h = np.full(n, np.nan), np.full(n, np.nan)
+    for k, amp in enumerate(spectra):
+        ik, hk = get_inl_fm(amp, fm[k])
+        if ik is not None:
+            inl[k], h[k] = ik, hk
+    return inl, h
+
+
+def get_inls(spectra, f):
+    """ get_inl() for many spectra, see dt_c_api.get_inls() """
+    spectra = _spectra(spectra)
+    n = len(spectra)
+    f = np.broadcast_to(f, (n,))
+    inl = np.full(n, np.nan)
+    for k, amp in enumerate(spectra):
+        ik = get_inl(amp, f[k])
+        if ik is not None:
+            inl[k] = ik
+    return inl
+
+
+# DMR demodulation, see ber.c: ADC rate is 25 samples per symbol, phase unit is pi/2/65536
+_BITPRD = 25
+_BITDEPTH = 10
+_SAMPLEDIF = 3
+_PHDIFF = 1415*3
+_RRCFLT = np.array([
+    45, 29, 12, -5, -24, -44, -64, -85, -104, -124, -141, -158, -172, -185, -194, -201, -204, -204, -200, -191, -179,
+    -162, -141, -115, -85, -51, -12, 29, 75, 124, 176, 231, 287, 345, 404, 463, 522, 580, 637, 691, 744, 793, 838, 880,
+    917, 948, 975, 996, 1011, 1020, 1024, 1020, 1011, 996, 975, 948, 917, 880, 838, 793, 744, 691, 637, 580, 522, 463,
+    404, 345, 287, 231, 176, 124, 75, 29, -12, -51, -85, -115, -141, -162, -179, -191, -200, -204, -204, -201, -194,
+    -185, -172, -158, -141, -124, -104, -85, -64, -44, -24, -5, 12, 29, 45], dtype=np.float64)
+_FLTS = _RRCFLT.size
+_FLTGAIN = 22478
+
+
+def _dibits(vdiff):
+    """ Return dibits and their distances to the nearest ideal phase differences as getbit() of ber.c """
+    levels = np.array([-3*_PHDIFF, -2*_PHDIFF, -_PHDIFF, 0, _PHDIFF, 2*_PHDIFF, 3*_PHDIFF])
+    k = np.searchsorted(levels, vdiff, side='right')  # vdiff >= levels[k-1]
+    dibit = np.array([3, 3, 2, 2, 0, 0, 1, 1], dtype=np.int8)[k]
+    ideal = np.array([-3, -3, -1, -1, 1, 1, 3, 3])[k]*_PHDIFF
+    return dibit, np.abs(vdiff - ideal)
+
+
+def _strided_sums(values, forward: bool):
+    """ Sums of BITDEPTH values spaced by BITPRD starting at every index: values[i] + values[i+-BITPRD] + ...
+        Out of range values count as 0.
+    """
+    n = values.size
+    depth = _BITDEPTH*_BITPRD
+    padded = np.zeros(n + 2*depth, dtype=np.int64)
+    padded[depth:depth+n] = values
+    acc = np.zeros_like(padded)
+    # cumulative sums along every residue class modulo BITPRD
+    for r in range(_BITPRD):
+        acc[r::_BITPRD] = np.cumsum(padded[r::_BITPRD])
+    if forward:
+        return acc[depth+depth-_BITPRD:depth+depth-_BITPRD+n] - acc[depth-_BITPRD:depth-_BITPRD+n]
+    return acc[depth:depth+n] - acc[:n]
+
+
+def get_ber(iamp, qamp, maxlen):
+    """ Calculate number of total and erroneously decoded symbols, symbol intervals as bercalc() of libdmr.
+        Phase is computed with arctan2 instead of CORDIC and RRC filtering is done with overlap-add FFT
+        convolution, symbol timing is recovered from the discriminator sums of all samples at once,
+        so the time is linear in the capture length.
+        Return numerr, numbit and arrays Iref, Qref of maxlen samples, symlenref (see dt_c_api.get_ber()).
+    """
+    iamp = np.asarray(iamp, dtype=np.int32)
+    qamp = np.asarray(qamp, dtype=np.int32)
+    size = min(iamp.size, qamp.size)
+    if size < _SAMPLEDIF + _FLTS + 5 + _BITDEPTH*_BITPRD:
+        return None, None, None, None, None
+    half = _FLTS//2
+
+    phase = np.rint(np.arctan2(qamp[:size], iamp[:size])*(2*65536/np.pi)).astype(np.int64) % (4*65536)
+    phdiff = np.zeros(size, dtype=np.int64)
+    phdiff[_SAMPLEDIF:] = phase[:-_SAMPLEDIF] - phase[_SAMPLEDIF:]
+    phdiff[phdiff > 2*65536] -= 4*65536
+    phdiff[phdiff < -2*65536] += 4*65536
+
+    # filtered phase difference, the edges not covered by the filter keep the phase as in ber.c
+    ph = phase.copy()
+    conv = np.rint(oaconvolve(phdiff, _RRCFLT, mode='valid')).astype(np.int64)  # exact integer sums
+    ph[half:size-half] = np.sign(conv)*(np.abs(conv)//_FLTGAIN)  # division truncated to zero as in C
+
+    dibit, dist = _dibits(ph)
+    discfwd = _strided_sums(dist, True)
+    discbwd = _strided_sums(dist, False)
+
+    # timing choice at every sample: the best of the samples i-1, i, i+1 by the discriminator
+    forward = np.arange(size) < (_BITDEPTH+1)*_BITPRD  # direction of the sums is set by the sample i
+    disc = np.where(forward, discfwd, discbwd)
+    dleft = np.where(forward, np.roll(discfwd, 1), np.roll(discbwd, 1))
+    dright = np.where(forward, np.roll(discfwd, -1), np.roll(discbwd, -1))
+    shift = np.where((dright < disc) & (dright < dleft), 1, np.where((dleft < disc) & (dleft < dright), -1, 0))
+
+    # walk the chain of symbol positions, the only per-symbol loop
+    ofs = int(np.argmin(discfwd[half:half+_BITPRD]))
+    positions = [half + ofs]
+    shiftlist = shift.tolist()
+    i = half + ofs + _BITPRD
+    while i < size-half-1:
+        pos = i + shiftlist[i]
+        positions.append(pos)
+        i = pos + _BITPRD
+    positions = np.array(positions)
+    dibits = dibit[positions].astype(np.int64)
+
+    # errors against the expected DMR test sequence: bits of a dibit are the XOR of the bits 2 and 4 dibits before
+    numbit = numerr = 0
+    if dibits.size > 6:
+        hi, lo = dibits >> 1, dibits & 1
+        numbit = 2*(dibits.size-6)
+        numerr = int(np.count_nonzero(hi[6:] != (lo[1:-5] ^ lo[3:-3])) +
+                     np.count_nonzero(lo[6:] != (hi[2:-4] ^ hi[4:-2])))
+    if numerr < numbit//3:
+        numerr //= 3
+    elif numerr < 2*numbit//3:
+        numerr //= 2
+
+    # the longest runs of every dibit ended by another dibit
+    change = np.flatnonzero(dibits[1:] != dibits[:-1]) + 1
+    starts = np.concatenate(([0], change[:-1]))
+    lengths = change - starts
+    symlen, sympos = np.zeros(4, dtype=np.int64), np.zeros(4, dtype=np.int64)
+    for d in range(4):
+        runs = np.flatnonzero(dibits[starts] == d)
+        if runs.size > 0:
+            best = runs[np.argmax(lengths[runs])]
+            symlen[d], sympos[d] = lengths[best], positions[starts[best]]
+
+    Iref, Qref = np.zeros(maxlen, dtype=np.int32), np.zeros(maxlen, dtype=np.int32)
+    symlenref = np.zeros(4, dtype=np.int32)
+    index = 0
+    for d in range(4):
+        lo, hi = max(sympos[d], 0), min(sympos[d] + symlen[d]*_BITPRD, size)
+        n = max(min(hi-lo, maxlen-index), 0)
+        Iref[index:index+n] = iamp[lo:lo+n]
+        Qref[index:index+n] = qamp[lo:lo+n]
+        symlenref[d] = n
+        index += n
+
+    return numerr, numbit, Iref, Qref, symlenref
+
+
+class DTBerStream:
+    """ Bit error rate accumulated over successive captures, see dt_c_api.DTBerStream.
+        Contiguous captures are joined until the next gap and analysed at once by get_ber()
+        when the gap is reached or the result is requested.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def add(self, iamp, qamp, contiguous: bool = False):
+        """ Add a capture of I and Q samples. Return number of bits decoded from the joined captures
+            before the gap, 0 for a contiguous capture.
+        """
+        numbit = self.__numbit
+        if not contiguous:
+            self.__flush()
+        size = min(len(iamp), len(qamp))
+        self.__pending.append((np.asarray(iamp[:size], dtype=np.int32), np.asarray(qamp[:size], dtype=np.int32)))
+        return self.__numbit - numbit
+
+    def __flush(self):
+        if self.__pending:
+            numerr, numbit, _, _, _ = get_ber(np.concatenate([i for i, _ in self.__pending]),
+                                              np.concatenate([q for _, q in self.__pending]), 0)
+            if numerr is not None:
+                self.__numerr += numerr
+                self.__numbit += numbit
+            self.__pending = []
+
+    def result(self):
+        """ Return accumulated numbers of erroneous and total bits """
+        self.__flush()
+        return self.__numerr, self.__numbit
+
+    @property
+    def ber(self):
+        numerr, numbit = self.result()
+        return numerr/numbit if numbit > 0 else None
+
+    def reset(self):
+        self.__pending = []
+        self.__numerr = self.__numbit = 0
+
+    def close(self):
+        self.reset()
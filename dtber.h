@@ -0,0 +1,34 @@
+#ifndef DTBER_H
+# define DTBER_H
+
+// Decode DMR test bit sequence from I, Q samples (25 samples per symbol) and count errors.
+// Return 0 if size is too small, 1 otherwise.
+// numerr, numbit - number of erroneous and total bits
+// Is, Qs - the longest intervals of constant symbols 0, 1, 2, 3 stored one after another, not more than maxlen samples
+// symlenload - lengths of the intervals in Is, Qs
+extern int bercalc(const int *I, const int *Q, int size, int *numerr, int *numbit, int *Is, int *Qs, int *symlenload, int maxlen);
+
+// Reference implementation of bercalc() filtering every sample
+extern int bercalc_ref(const int *I, const int *Q, int size, int *numerr, int *numbit, int *Is, int *Qs, int *symlenload, int maxlen);
+
+// BER accumulated over successive captures of the test sequence
+typedef struct berstream berstream;
+
+// Allocate an empty BER stream, NULL is returned on failure
+extern berstream *berstream_open(void);
+
+extern void berstream_close(berstream *s);
+
+// Clear the accumulated counts and the kept samples
+extern void berstream_reset(berstream *s);
+
+// Demodulate a capture of size I, Q samples. If contiguous is not 0, the capture continues the previous one
+// without a gap: the filter history, symbol timing and the register of the test sequence are carried over.
+// Otherwise the symbol timing is acquired anew. Samples of a short capture are kept until the timing is acquired.
+// Return number of bits decoded from the capture or -1 if memory allocation fails.
+extern int berstream_add(berstream *s, const int *I, const int *Q, int size, int contiguous);
+
+// Get the accumulated numbers of erroneous and total bits
+extern void berstream_result(const berstream *s, long long *numerr, long long *numbit);
+
+#endif
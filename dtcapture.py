@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+
+import os
+import time
+import struct
+import argparse
+from collections import deque
+
+import serial
+
+_MAGIC = b'DTCAPT01'
+_RECORD = struct.Struct('<ddII')  # time of the request, round trip time [s], request and reply lengths
+
+
+class DTCaptureWriter:
+    """
+    Append-only capture of the device communication.
+    File layout (little-endian): magic b'DTCAPT01', then records of
+        time of the request (epoch seconds, double), round trip time [s] (double),
+        request length, reply length (uint32 each), request packet bytes, raw reply bytes.
+    Every reply is stored as it was read from the port including ACK/END, MCU BUSY or nothing on timeout.
+    Records are flushed to the file one by one, so that a capture of a killed process is complete.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(_MAGIC)
+        # perf_counter() of the requests is converted to epoch seconds with this offset
+        self.__offset = time.time() - time.perf_counter()
+
+    def add(self, start: float, roundtrip: float, request, reply):
+        """Append a record. start is perf_counter() at the request."""
+        self.file.write(_RECORD.pack(start + self.__offset, roundtrip, len(request), len(reply)))
+        self.file.write(request)
+        self.file.write(reply)
+        self.file.flush()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __del__(self):
+        self.close()
+
+
+def read_capture(filename):
+    """Generator of tuples (time, roundtrip, request, reply) from a capture file"""
+    with open(filename, 'rb') as file:
+        if file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f'{filename} is not a capture file')
+        while True:
+            head = file.read(_RECORD.size)
+            if len(head) < _RECORD.size:  # end of file or truncated record of an interrupted capture
+                return
+            start, roundtrip, nrequest, nreply = _RECORD.unpack(head)
+            request = file.read(nrequest)
+            reply = file.read(nreply)
+            if len(reply) < nreply:
+                return
+            yield start, roundtrip, request, reply
+
+
+class DTReplayPort:
+    """
+    Stand-in for serial.Serial serving the replies of a capture file to DTSerialCom:
+        com = DTSerialCom(port=DTReplayPort('session.cap'))
+    Written packets must repeat the captured requests in order, otherwise serial.SerialException is raised.
+    Replies are available immediately or, if realtime is True, after the captured round trip time.
+    A captured timeout is replayed as no reply at once.
+    In fast replay DTSerialCom takes the time of its status polling deadlines from clock() and sleeps with
+    sleep() of the port: the clock runs by the captured times of the requests and replies, so that a captured
+    deadline (e.g. of PLL lock) expires after the same number of polls as in the capture.
+    """
+
+    def __init__(self, filename, timeout=3, realtime=False):
+        self.name = filename
+        self.timeout = timeout
+        self.realtime = realtime
+        self.fd = None
+        self.is_open = True
+        self.records = deque(read_capture(filename))
+        self.nrecords = len(self.records)
+        self.__replies = bytearray()
+        self.__clock = self.records[0][0] if len(self.records) > 0 else 0.  # captured time [s] of fast replay
+
+    @property
+    def position(self):
+        """Number of replayed records"""
+        return self.nrecords - len(self.records)
+
+    def write(self, data):
+        data = memoryview(bytes(data))
+        nw = len(data)
+        while len(data) > 0:  # pipelined packets of DTSerialCom.batch() come in one write
+            if len(self.records) == 0:
+                raise serial.SerialException(f'{self.name}: capture ended, request {bytes(data[:40])} not expected')
+            start, roundtrip, request, reply = self.records[0]
+            if data[:len(request)] != request:
+                raise serial.SerialException(f'{self.name}: request {bytes(data[:40])} does not match ' +
+                                             f'captured one {request[:40]} of record {self.position}')
+            self.records.popleft()
+            data = data[len(request):]
+            if self.realtime:
+                time.sleep(roundtrip)
+            self.__clock = max(self.__clock, start + roundtrip)
+            self.__replies += reply
+        return nw
+
+    def clock(self):
+        """Captured time of the last reply (advanced by sleep()) or perf_counter() in realtime replay"""
+        return time.perf_counter() if self.realtime else self.__clock
+
+    def sleep(self, seconds):
+        if self.realtime:
+            time.sleep(seconds)
+        else:
+            self.__clock += seconds
+
+    def readinto(self, mv, timeout=None):
+        n = min(len(mv), len(self.__replies))
+        mv[:n] = self.__replies[:n]
+        del self.__replies[:n]
+        return n
+
+    def read(self, size=1):
+        data = bytes(self.__replies[:size])
+        del self.__replies[:size]
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        end = self.__replies.find(expected)
+        n = len(self.__replies) if end < 0 else end + len(expected)
+        if size is not None:
+            n = min(n, size)
+        return self.read(n)
+
+    def reset_input_buffer(self):
+        self.__replies.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        self.is_open = False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print contents of a device communication capture.')
+    parser.add_argument('filename', type=str, help='capture file')
+    parser.add_argument('-a', '--all', action='store_true', help='print every record, not only the summary')
+    args = parser.parse_args()
+
+    summary = dict()
+    first = None
+    for start, roundtrip, request, reply in read_capture(args.filename):
+        first = start if first is None else first
+        command = request[1:request.find(b'\0', 1)].decode('utf-8', 'replace')
+        calls, nbout, nbin, total = summary.get(command, (0, 0, 0, 0.))
+        summary[command] = (calls+1, nbout+len(request), nbin+len(reply), total+roundtrip)
+        if args.all:
+            print(f'{start-first:10.4f} {roundtrip*1000:8.3f} ms {command:<14} {len(request):6d} B out ' +
+                  f'{len(reply):8d} B in: {reply[:16]}{"..." if len(reply) > 16 else ""}')
+
+    print(f'{os.path.getsize(args.filename)} bytes in {args.filename}')
+    for command, (calls, nbout, nbin, total) in summary.items():
+        print(f'{command:<16}{calls:8d} calls {nbout:10d} B out {nbin:12d} B in {total/calls*1000:10.3f} ms mean')
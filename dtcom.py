@@ -1,41 +1,484 @@
 from traceback import format_exception_only
+from collections import OrderedDict
 import serial
+import io
 import os
 import time
+import select
+import struct
 from glob import glob
 from numbers import Integral
-from numpy import frombuffer, uint16
+from numpy import frombuffer, asarray, uint16, geomspace, zeros, searchsorted, cumsum
 
-from singleton import Singleton
-from dtexcept import DTInternalError, DTComError
-# import dtglobals as dtg
-from dt_c_api import get_pll_regs
+from threading import Event
+from dtexcept import DTInternalError, DTComError, DTComTimeoutError, DTComBatchError, DTCancelledError
+from dtglobals import adcSampleFrequency
+from plltable import pll_regs
+from dt_c_api import DTNativePort
+from dtcapture import DTCaptureWriter, DTReplayPort
 
 _END = b'END'
 _lenEND = len(_END)
 _ACK = b'ACK'
 _lenACK = len(_ACK)
+_BUSY = b'MCU BUSY'
+_lenBUSY = len(_BUSY)
 
 
-class DTSerialCom(metaclass=Singleton):
+_headers = dict()  # cache of (command name, packet header b'\0[COMMAND]\0') by command
+_layouts = dict()  # cache of (struct.Struct, word masks) by tuple of output word sizes
+_wordtypes = {2: ('H', '<u2'), 4: ('I', '<u4')}
+_NUMPYMINWORDS = 32  # data sequences of this length and longer of uniform word size are packed with NumPy
+
+
+def _header(command):
+    """Return the command name as bytes and the null-terminated packet header for the command"""
+    try:
+        return _headers[command]
+    except (KeyError, TypeError):  # TypeError for unhashable bytearray
+        pass
+
+    if isinstance(command, str):
+        name = bytes(command, 'utf-8')
+    elif isinstance(command, (bytes, bytearray)):
+        name = bytes(command)
+    else:
+        raise DTInternalError('encode_packet()', f'Invalid type of command argument: {type(command)}')
+
+    header = (name, b'\0' + name + b'\0')
+    if isinstance(command, (str, bytes)):
+        _headers[command] = header
+    return header
+
+
+def _timeout_str(timeout):
+    """Return the timeout of a port or a call [s] for messages, None means no timeout"""
+    return 'no timeout' if timeout is None else f'timeout {timeout:.3g}s'
+
+
+def _layout(owordsize: tuple):
+    """Return struct.Struct packing LEN and data words of given sizes and masks of the data words"""
+    layout = _layouts.get(owordsize)
+    if layout is None:
+        if len(owordsize) == 0 or not set(owordsize) <= {2, 4}:
+            raise DTInternalError('encode_packet()', 'Output word size list must contain only 2 or 4.')
+        fmt = '<H' + ''.join(_wordtypes[size][0] for size in owordsize)
+        masks = tuple((1 << size*8)-1 for size in owordsize)
+        layout = _layouts[owordsize] = (struct.Struct(fmt), masks)
+    return layout
+
+
+def encode_packet(command, odata=None, owordsize=2):
+    """
+    Return the command name and the packet b'\0[COMMAND]\0[LEN][DATA]END\0' as bytes.
+    Arguments have the meaning of DTSerialCom.command() ones.
+    Packet headers are cached by command, struct layouts by the tuple of output word sizes.
+    """
+    global _END
+
+    source = 'encode_packet()'
+
+    name, header = _header(command)
+
+    if odata is None:
+        return name, header + b'\0\0' + _END + b'\0'
+    elif isinstance(odata, (bytes, bytearray)):
+        return name, header + bytes(odata) + _END + b'\0'
+    elif type(odata) is int or isinstance(odata, Integral):  # check exact type first as ABC check is slow
+        if owordsize not in (2, 4):
+            raise DTInternalError(source, 'Output word size must be 2 or 4')
+        odata = (odata,)
+    elif not hasattr(odata, '__getitem__') or not hasattr(odata, '__len__'):
+        raise DTInternalError(source, 'Sending data type is expected to be bytes, integer or iterable of integers')
+
+    lendata = len(odata)
+    if lendata == 0:
+        return name, header + b'\0\0' + _END + b'\0'
+
+    if type(owordsize) is int or isinstance(owordsize, Integral):
+        if owordsize not in (2, 4):
+            raise DTInternalError(source, 'Output word size must be 2 or 4.')
+        if lendata >= _NUMPYMINWORDS:
+            # pack long uniform sequences at once, casting to unsigned type masks the words
+            adata = asarray(odata)
+            if adata.dtype.kind in 'biu' and adata.ndim == 1:
+                length = (lendata*owordsize//2).to_bytes(2, byteorder='little')
+                return name, header + length + adata.astype(_wordtypes[owordsize][1]).tobytes() + _END + b'\0'
+            elif adata.dtype.kind != 'O':  # object arrays (e.g. huge integers) are packed by struct
+                raise DTInternalError(source, 'Some of output data words is not integer.')
+        owordsize = (owordsize,)*lendata
+    elif isinstance(owordsize, (list, tuple)):
+        lenwsize = len(owordsize)
+        if lenwsize == 0:
+            raise DTInternalError(source, 'Output word size list must not be empty and contain only 2 or 4.')
+        elif lenwsize < lendata:
+            owordsize = tuple(owordsize) + (owordsize[-1],)*(lendata-lenwsize)  # extend word sizes with the last value
+        else:
+            owordsize = tuple(owordsize[:lendata])
+    else:
+        raise DTInternalError(source, 'Output word size must be scalar or list of 2 and 4.')
+
+    st, masks = _layout(owordsize)
+    length = sum(owordsize)//2
+    try:
+        data = st.pack(length, *odata)
+    except struct.error:
+        # words out of range of their size are masked as the device expects the lower bytes only
+        if not all([isinstance(oword, Integral) for oword in odata]):
+            raise DTInternalError(source, f'Some of output data words is not integer: {odata}.')
+        data = st.pack(length, *[int(oword) & mask for oword, mask in zip(odata, masks)])
+
+    return name, header + data + _END + b'\0'
+
+
+class DTBufferPool:
+    """
+    Pool of reusable reply buffers. For every reply size a ring of nslots bytearrays is kept,
+    so a buffer handed out is overwritten after nslots more requests of the same size.
+    Buffers of at most maxsizes different sizes are kept, the least recently used size is dropped.
+    """
+
+    def __init__(self, nslots=4, maxsizes=8):
+        self.nslots = nslots
+        self.maxsizes = maxsizes
+        self.__rings = OrderedDict()  # size -> [next slot index, list of buffers]
+
+    def get(self, nbytes: int) -> bytearray:
+        ring = self.__rings.get(nbytes)
+        if ring is None:
+            ring = self.__rings[nbytes] = [0, []]
+            if len(self.__rings) > self.maxsizes:
+                self.__rings.popitem(last=False)
+        else:
+            self.__rings.move_to_end(nbytes)
+
+        islot, buffers = ring
+        if islot == len(buffers):
+            buffers.append(bytearray(nbytes))
+        ring[0] = (islot+1) % self.nslots
+        return buffers[islot]
+
+    def clear(self):
+        self.__rings.clear()
+
+
+class DTLatencyHistogram:
+    """
+    Histogram of latencies [s] in logarithmic bins between lowest and highest.
+    Values beyond the range are counted in the first and the last bins, expired waits (None) are counted separately.
+    """
+
+    def __init__(self, lowest=0.001, highest=2., nbins=33):
+        self.edges = geomspace(lowest, highest, nbins-1)
+        self.counts = zeros(nbins, dtype=int)
+        self.expired = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, latency):
+        if latency is None:
+            self.expired += 1
+            return
+        self.counts[searchsorted(self.edges, latency)] += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count > 0 else None
+
+    def quantile(self, q: float):
+        """Return upper edge of the bin containing q-quantile of latencies"""
+        count = self.count
+        if count == 0:
+            return None
+        ibin = int(searchsorted(cumsum(self.counts), q*count))
+        return min(float(self.edges[ibin]), self.max) if ibin < len(self.edges) else self.max
+
+    def __str__(self):
+        if self.count == 0:
+            return f'no values, {self.expired} expired'
+        return f'{self.count} values, mean {self.mean*1000:.1f} ms, median < {self.quantile(0.5)*1000:.1f} ms, ' +\
+            f'90% < {self.quantile(0.9)*1000:.1f} ms, max {self.max*1000:.1f} ms, {self.expired} expired'
+
+
+class DTComStats:
+    """
+    Counters of the device communication per command name: number of calls, bytes sent and received,
+    write time, time to the first reply byte, round trip time, timeouts and MCU BUSY replies.
+    Times are accumulated in seconds, means are calculated by snapshot().
+    """
+
+    FIELDS = ('calls', 'bytesOut', 'bytesIn', 'writeTime', 'firstByteTime', 'roundTrip', 'timeouts', 'busy')
+
+    def __init__(self):
+        self.__counters = dict()  # list of FIELDS values by command
+
+    def record(self, command: bytes, nbout: int, nbin: int, writetime: float, firstbyte: float, roundtrip: float,
+               timeout=False, busy=False):
+        """Account one command. firstbyte is the time from the start of the write to the first reply byte."""
+        counters = self.__counters.get(command)
+        if counters is None:
+            counters = self.__counters[command] = [0, 0, 0, 0., 0., 0., 0, 0]
+        counters[0] += 1
+        counters[1] += nbout
+        counters[2] += nbin
+        counters[3] += writetime
+        counters[4] += firstbyte
+        counters[5] += roundtrip
+        counters[6] += timeout
+        counters[7] += busy
+
+    def snapshot(self):
+        """
+        Return dict {command name: dict of counters} with FIELDS as keys plus mean times
+        meanWrite, meanFirstByte, meanRoundTrip [s] and reply transfer rate rateIn [bytes/s]
+        measured from the first to the last reply byte.
+        """
+        snapshot = dict()
+        for command, counters in self.__counters.items():
+            entry = dict(zip(self.FIELDS, counters))
+            calls = entry['calls']
+            entry['meanWrite'] = entry['writeTime']/calls
+            entry['meanFirstByte'] = entry['firstByteTime']/calls
+            entry['meanRoundTrip'] = entry['roundTrip']/calls
+            transfer = entry['roundTrip'] - entry['firstByteTime']
+            entry['rateIn'] = entry['bytesIn']/transfer if transfer > 0 else None
+            snapshot[command.decode('utf-8', 'replace')] = entry
+        return snapshot
+
+    def reset(self):
+        self.__counters.clear()
+
+    def __str__(self):
+        snapshot = self.snapshot()
+        if len(snapshot) == 0:
+            return 'No commands sent'
+        lines = [f'{"command":<16}{"calls":>8}{"out B":>10}{"in B":>12}{"write ms":>10}{"first ms":>10}'
+                 f'{"total ms":>10}{"in MB/s":>9}{"timeouts":>9}{"busy":>6}']
+        for command, e in sorted(snapshot.items(), key=lambda item: -item[1]['roundTrip']):
+            rate = f'{e["rateIn"]/1e6:9.3f}' if e['rateIn'] is not None else f'{"-":>9}'
+            lines.append(f'{command:<16}{e["calls"]:8d}{e["bytesOut"]:10d}{e["bytesIn"]:12d}'
+                         f'{e["meanWrite"]*1000:10.3f}{e["meanFirstByte"]*1000:10.3f}{e["meanRoundTrip"]*1000:10.3f}'
+                         f'{rate}{e["timeouts"]:9d}{e["busy"]:6d}')
+        return '\n'.join(lines)
+
+
+class DTCancelToken:
+    """
+    Flag cancelling device operations, set from another thread (e.g. on stop request).
+    DTSerialCom with the token in its cancel attribute checks it before every command and
+    blocking reads wake up on it through the descriptor of fileno().
     """
-    Class implementing communication between PC and DMR TEST device via [emulated] serial port
+
+    def __init__(self):
+        self.__event = Event()
+        self.__rfd, self.__wfd = os.pipe()
+        os.set_blocking(self.__rfd, False)
+
+    def set(self):
+        if not self.__event.is_set():
+            self.__event.set()
+            os.write(self.__wfd, b'x')
+
+    def clear(self):
+        self.__event.clear()
+        try:
+            while os.read(self.__rfd, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def is_set(self):
+        return self.__event.is_set()
+
+    def fileno(self):
+        """Descriptor readable while the token is set"""
+        return self.__rfd
+
+    def check(self, source=None):
+        """Raise DTCancelledError if the token is set"""
+        if self.__event.is_set():
+            raise DTCancelledError(source)
+
+    def sleep(self, seconds: float, source=None):
+        """Sleep for given time, raise DTCancelledError as soon as the token is set"""
+        if self.__event.wait(seconds):
+            raise DTCancelledError(source)
+
+    def __del__(self):
+        for fd in (self.__rfd, self.__wfd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+DEVICEPATTERN = '/dev/serial/by-id/usb-STMicroelectronics_STM32*'
+
+
+def list_devices():
+    """Return sorted list of real paths of the connected DMR TEST devices"""
+    return sorted(set(os.path.realpath(device) for device in glob(DEVICEPATTERN)))
+
+
+class DTDeviceRegistry(type):
     """
+    Metaclass keeping one instance of the class per device.
+    Calling the class with a device already opened returns its instance. If the device is not given,
+    the class attribute default_device is used or, if it is None, the first device of list_devices().
+    An instance created for a port object is registered under the real path of the port name.
+    """
+
+    def __call__(cls, timeout=3, device=None, port=None):
+        device = cls.port_device(port) if port is not None else cls.resolve_device(device)
+        instance = cls._instances.get(device)
+        if instance is None:
+            instance = cls._instances[device] = super().__call__(timeout, device, port)
+        return instance
+
+    def resolve_device(cls, device=None):
+        """Return real path of the device to be opened for the given one"""
+        if device is None:
+            device = cls.default_device
+        if device is None:
+            devices = list_devices()
+            if len(devices) == 0:
+                raise DTComError(f'No STM32 device found. Device is offline?')
+            device = devices[0]
+        return os.path.realpath(device)
+
+    def port_device(cls, port):
+        """Return the device an instance for the port object is registered under"""
+        name = getattr(port, 'name', None)
+        return os.path.realpath(name) if name else f'port@{id(port):x}'
+
+    def instance(cls, device=None):
+        """Return the instance opened for the device (path, port object or the instance itself) or None"""
+        if isinstance(device, cls):
+            return device if cls._instances.get(device.device) is device else None
+        if device is not None and not isinstance(device, (str, bytes, os.PathLike)):
+            return cls._instances.get(cls.port_device(device))
+        try:
+            device = cls.resolve_device(device)
+        except DTComError:
+            return None
+        return cls._instances.get(device)
+
+    def release(cls, device=None):
+        """Close the device and forget its instance, see instance() for the device argument"""
+        instance = cls.instance(device)
+        if instance is not None:
+            del cls._instances[instance.device]
+            instance.close()
+
+
+class DTSerialCom(metaclass=DTDeviceRegistry):
+    """
+    Class implementing communication between PC and DMR TEST device via [emulated] serial port.
+    There is one instance per device, see DTDeviceRegistry. Every DTProcess sets default_device to its device,
+    so that the tasks running in the process communicate with that device.
+    """
+
+    _instances = dict()  # instances by device
+    default_device = None  # device opened if none is given
 
     DEBUG = False
 
-    def __init__(self, timeout=3):
-        devlist = glob('/dev/serial/by-id/usb-STMicroelectronics_STM32*')
-        if len(devlist) == 0:
-            raise DTComError(f'No STM32 device found. Device is offline?')
+    PIPELINE = True  # send commands of batch() in one write
+
+    # Serial port implementation: 'pyserial' - serial.Serial, 'native' - dt_c_api.DTNativePort using libdmr
+    BACKEND = 'pyserial'
+
+    POOLMINWORDS = 1024  # replies of this length and longer are read into pooled buffers
+    POOLSLOTS = 4  # number of pooled buffers per reply size
+
+    # Back-off of STATUS polling in wait_status_bits() [s]
+    STATUSPOLLFIRST = 0.002
+    STATUSPOLLFACTOR = 2
+    STATUSPOLLMAX = 0.1
+
+    # Replies are awaited TIMEOUTMARGIN times the expected time but not longer than timeout. The expected time is
+    # TIMEOUTBASE plus the device delay of the command (GET PWR averaging, GET ADC DAT acquisition) plus
+    # the transfer time of the reply at transferRate, an average of the rates measured on replies of at least
+    # RATEMINBYTES bytes with the weight RATEWEIGHT of the last one.
+    ADAPTIVETIMEOUT = True
+    TIMEOUTBASE = 0.05  # [s]
+    TIMEOUTMARGIN = 3
+    TRANSFERRATE = 200e3  # initial transfer rate [bytes/s]
+    RATEMINBYTES = 4096
+    RATEWEIGHT = 0.25
+    PWRSAMPLETIME = 0.001  # upper estimate of the time of one GET PWR averaging sample [s]
+
+    # Reads from port objects without descriptor (DTNativePort, DTReplayPort) check the cancel token every CANCELPOLL s
+    CANCELPOLL = 0.02
+
+    # Shadow copy of the device state: a command of STATECOMMANDS repeating the last acknowledged one
+    # is not sent to the device. The shadow is dropped on reopening the port and on any communication error.
+    SHADOWING = True
+    STATECOMMANDS = frozenset((b'SET RF_PATH', b'SET MEASST', b'SET MOD', b'SET DEMOD', b'SET ATT', b'SET LF RANGE',
+                               b'SET LFDAC'))
+
+    def __init__(self, timeout=3, device=None, port=None):
+        """
+        Open the serial port of the device.
+        device - path to the device file (e.g. pseudo-terminal of DTDeviceEmulator).
+                 If None, the first STM32 device found is opened.
+        port   - already opened object with serial.Serial interface (e.g. DTReplayPort) used instead of the device
+        """
+        self.__ownport = port is None
+        if port is not None:
+            self.device = device
+            self.port = port
+        else:
+            self.__open(timeout, device)
+
+        # unbuffered file object on the port descriptor to read replies in place with readinto()
+        fd = getattr(self.port, 'fd', None)
+        self.__rawio = io.FileIO(fd, 'rb', closefd=False) if isinstance(fd, int) else None
+
+        if not hasattr(self, 'pool'):
+            self.pool = DTBufferPool(self.POOLSLOTS)
+
+        self.invalidate_shadow()  # device state is unknown after (re)opening
 
-        device = os.path.realpath(devlist[0])
+        if not hasattr(self, 'statusLatency'):
+            self.statusLatency = dict()  # DTLatencyHistogram of wait_status_bits() by status mask
+
+        if not hasattr(self, 'stats'):
+            self.stats = DTComStats()
+
+        if not hasattr(self, 'transferRate'):
+            self.transferRate = self.TRANSFERRATE  # learned reply transfer rate [bytes/s]
+
+        if not hasattr(self, 'capturer'):
+            self.capturer = None  # DTCaptureWriter of capture()
+
+        if not hasattr(self, 'cancel'):
+            self.cancel = None  # DTCancelToken interrupting commands
+
+        # clock [s] of the status polling deadlines, the captured time of DTReplayPort in replays
+        self.clock = getattr(self.port, 'clock', time.perf_counter)
+
+        # raw bytes and arrival time of the first byte of the last reply, set by __read_reply()
+        self.__reply, self.__tfirst = b'', None
+
+    def __open(self, timeout, device):
+        device = DTSerialCom.resolve_device(device)
+        self.device = device
 
         if self.DEBUG:
             print(f'DTSerialCom.__init__(): Open device {device}')
 
         try:
-            self.port = serial.Serial(device, timeout=timeout)
+            if self.BACKEND == 'native':
+                self.port = DTNativePort(device, timeout=timeout)
+            else:
+                self.port = serial.Serial(device, timeout=timeout)
         except serial.SerialException as exc:
             raise DTComError(f'Opening device {device} failed.') from exc
 
@@ -55,6 +498,8 @@ class DTSerialCom(metaclass=Singleton):
         Acknowledgement response: b'ACK'
         Device must reply: b'[LEN][DATA]END\0'
         Method returns the NumPy array of uint16 with received data if any.
+        Replies of nreply >= POOLMINWORDS words are returned as views of pooled buffers which are overwritten
+        after POOLSLOTS more replies of the same length. Copy the array if the data are to be kept longer.
 
         Parameters:
             command   - command name (ASCII)
@@ -65,117 +510,265 @@ class DTSerialCom(metaclass=Singleton):
             nreply    - number of data words in the reply. 0 - if no reply besides 'ACK' is expected.
                         If nreply<0, then read all data available.
         """
-        global _END, _lenEND, _ACK, _lenACK
-        DEBUG = DTSerialCom.DEBUG
+        command, packet = encode_packet(command, odata, owordsize)
 
-        source = 'DTSerialCom.command()'
+        if self.cancel is not None:
+            self.cancel.check('DTSerialCom.command()')
 
-        if isinstance(command, str):
-            command = bytes(command, 'utf-8')
-        elif isinstance(command, bytearray):
-            command = bytes(command)
-        elif isinstance(command, bytes):
-            pass
-        else:
-            raise DTInternalError(f'Invalid type of command argument: {type(command)}')
-
-        # COMMAND null-terminated
-        packet = b'\0' + command + b'\0'
-
-        if isinstance(odata, bytes) or isinstance(odata, bytearray):
-            packet += bytes(odata)
-        elif isinstance(odata, Integral):
-            if not isinstance(owordsize, Integral) or owordsize != 2 and owordsize != 4:
-                raise DTInternalError('Output word size must be 2 or 4')
-            imask = (1 << owordsize*8)-1  # mask output data integers to fit to the requested byte-size
-            # LEN in words
-            packet += (owordsize//2).to_bytes(2, byteorder='little')
-            # DATA as LE-bytes
-            packet += int(odata & imask).to_bytes(owordsize, byteorder='little', signed=False)
-        elif hasattr(odata, '__getitem__') and hasattr(odata, '__len__') and len(odata) > 0:
-            if not all([isinstance(oword, Integral) for oword in odata]):
-                raise DTInternalError(f'Some of output data words is not integer: {odata}.')
-            if isinstance(owordsize, Integral):
-                if owordsize != 2 and owordsize != 4:
-                    raise DTInternalError('Output word size must be 2 or 4.')
-                owordsize = [owordsize]*len(odata)
-            elif isinstance(owordsize, list) or isinstance(owordsize, tuple):
-                owordsize = list(owordsize)
-                lenwsize = len(owordsize)
-                lendata = len(odata)
-                if lenwsize == 0:
-                    raise DTInternalError('Output word size list must not be empty and contain only 2 or 4.')
-                elif set(owordsize+[2, 4]) != {2, 4}:
-                    raise DTInternalError('Output word size list must contain only 2 or 4.')
-                elif lenwsize < lendata:
-                    owordsize.extend([owordsize[-1]]*(lendata-lenwsize))  # extend word sizes with the last value
-                elif lenwsize > lendata:
-                    owordsize = owordsize[:lendata]
-            elif not isinstance(owordsize, list) and not isinstance(owordsize, tuple) and not isinstance(owordsize, Integral):
-                raise DTInternalError('Output word size must be scalar or list of 2 and 4.')
-
-            # LEN in words
-            packet += (sum(owordsize)//2).to_bytes(2, byteorder='little')
-            # DATA as LE-bytes
-            for oword, osize in zip(odata, owordsize):
-                packet += int(oword & ((1 << osize*8)-1)).to_bytes(osize, byteorder='little', signed=False)
-        elif odata is None or hasattr(odata, '__len__') and len(odata) == 0:
-            packet += b'\0\0'
-        else:
-            raise DTInternalError('Sending data type is expected to be bytes, integer or iterable of integers')
+        if self.__shadowed(self.shadow, command, packet, nreply):
+            if DTSerialCom.DEBUG:
+                print(f'DTSerialCom.command(): {command} is not sent, the device state is unchanged')
+            return None
+
+        start = time.perf_counter()
+        writetime = 0.
+        try:
+            self.__flush()
+            self.__write(command, packet)
+            writetime = time.perf_counter() - start
+            rdata = self.__read_reply(command, packet, nreply)
+        except (DTComError, DTCancelledError) as exc:
+            self.__account(command, packet, start, writetime, exc)
+            self.invalidate_shadow()
+            raise
+
+        self.__account(command, packet, start, writetime)
+        self.__update_shadow(self.shadow, command, packet)
+
+        return rdata
+
+    def batch(self, commands):
+        """
+        Send several commands to the device in one write and read their replies in order.
+        Returns the list of command() return values, one per command.
 
-        # null-terminated END
-        packet += _END + b'\0'
+        Parameters:
+            commands - sequence of tuples (command[, odata[, owordsize[, nreply]]]) with the meaning of
+                       command() arguments.
+
+        If some of the commands fail, DTComBatchError is raised. Its errors attribute lists (index, command, message)
+        for every failed command, the replies attribute keeps the return values of the successful ones (None for
+        the failed). Commands following a timed out one are reported as not executed.
+        If PIPELINE is False, the commands are sent one by one with the same error reporting.
+        DTCancelledError is raised as soon as the cancel token is set.
+        """
+        source = 'DTSerialCom.batch()'
+        cancel = self.cancel
+
+        requests = []
+        for cmdargs in commands:
+            if isinstance(cmdargs, (str, bytes, bytearray)):
+                cmdargs = (cmdargs,)
+            if len(cmdargs) == 0 or len(cmdargs) > 4:
+                raise DTInternalError(source, f'Invalid command specification: {cmdargs}')
+            command, odata, owordsize, nreply = tuple(cmdargs) + (None, 2, 0)[len(cmdargs)-1:]
+            command, packet = encode_packet(command, odata, owordsize)
+            requests.append((command, packet, nreply))
+
+        replies = [None]*len(requests)
+        errors = []
+
+        # drop commands not changing the device state, the shadow is updated as if the rest were acknowledged
+        shadow = dict(self.shadow)
+        tosend = []
+        for i, (command, packet, nreply) in enumerate(requests):
+            if not self.__shadowed(shadow, command, packet, nreply):
+                self.__update_shadow(shadow, command, packet)
+                tosend.append((i, command, packet, nreply))
+
+        if len(tosend) == 0:
+            return replies
+
+        if cancel is not None:
+            cancel.check(source)
 
-        # Flush all buffers before communication
+        try:
+            if self.PIPELINE:
+                # the write time is shared by the commands in proportion to their packet sizes
+                start = time.perf_counter()
+                self.__flush()
+                packets = b''.join(packet for _, _, packet, _ in tosend)
+                self.__write(b' + '.join(cmd for _, cmd, _, _ in tosend), packets)
+                writerate = (time.perf_counter() - start)/len(packets)
+
+            for k, (i, command, packet, nreply) in enumerate(tosend):
+                if not self.PIPELINE:
+                    start = time.perf_counter()
+                    writerate = 0.
+                try:
+                    if not self.PIPELINE:
+                        if cancel is not None:
+                            cancel.check(source)
+                        self.__flush()
+                        self.__write(command, packet)
+                        writerate = (time.perf_counter() - start)/len(packet)
+                    replies[i] = self.__read_reply(command, packet, nreply)
+                    self.__account(command, packet, start, writerate*len(packet))
+                except DTCancelledError as exc:
+                    self.__account(command, packet, start, writerate*len(packet), exc)
+                    raise
+                except DTComError as exc:
+                    self.__account(command, packet, start, writerate*len(packet), exc)
+                    errors.append((i, command, exc.message))
+                    if isinstance(exc, DTComTimeoutError):  # the device does not respond, do not wait for the rest
+                        errors.extend((j, cmd, 'not executed') for j, cmd, _, _ in tosend[k+1:])
+                        break
+        except (DTComError, DTCancelledError):
+            self.invalidate_shadow()
+            raise
+
+        if len(errors) > 0:
+            self.invalidate_shadow()
+            raise DTComBatchError(errors, replies)
+
+        self.shadow = shadow
+
+        return replies
+
+    def __account(self, command: bytes, packet: bytes, start: float, writetime: float, exc=None):
+        """Record the last command in stats and capture. Times are measured from start of the write."""
+        end = time.perf_counter()
+        tfirst = end if self.__tfirst is None else self.__tfirst
+        self.stats.record(command, len(packet), len(self.__reply), writetime, tfirst-start, end-start,
+                          isinstance(exc, DTComTimeoutError), exc is not None and exc.message.endswith('MCU BUSY'))
+        if self.capturer is not None:
+            self.capturer.add(start, end-start, packet, self.__reply)
+        self.__reply, self.__tfirst = b'', None
+
+    def capture(self, filename=None):
+        """
+        Append all following requests and raw replies to the capture file, see DTCaptureWriter.
+        The file can be replayed with DTReplayPort. Stop capturing if filename is None.
+        The shadow state (including PLL frequencies) is dropped on start, so that the capture begins with
+        all state commands sent and replays on a fresh instance.
+        """
+        if self.capturer is not None:
+            self.capturer.close()
+            self.capturer = None
+        if filename is not None:
+            self.invalidate_shadow()
+            self.capturer = DTCaptureWriter(filename)
+
+    def invalidate_shadow(self):
+        """Forget the device state, so that all following commands are sent"""
+        self.shadow = dict()
+
+    def __shadowed(self, shadow: dict, command: bytes, packet: bytes, nreply: int):
+        """Return True if the command repeats the last acknowledged state setting"""
+        return self.SHADOWING and nreply == 0 and command in self.STATECOMMANDS and shadow.get(command) == packet
+
+    def __update_shadow(self, shadow: dict, command: bytes, packet: bytes):
+        """Update the shadow state with an acknowledged command"""
+        if command in self.STATECOMMANDS:
+            if command == b'SET MEASST' and shadow.get(command) != packet:
+                shadow.clear()  # a new measurement state may reconfigure the device
+            shadow[command] = packet
+        elif command == b'LOAD PLL':
+            # PLL number is the first data word after the header and LEN
+            pllnum = int.from_bytes(packet[len(command)+4:len(command)+6], byteorder='little')
+            shadow.pop(('PLL', pllnum), None)
+
+    def __flush(self):
+        """Flush all buffers before communication"""
         try:
             self.port.reset_input_buffer()
             self.port.reset_output_buffer()
         except Exception as exc:
-            print(source+':', format_exception_only(type(exc), exc), '\nTrying to reopen device...')
-            self.__init__(self.timeout)
+            print('DTSerialCom.__flush():', format_exception_only(type(exc), exc), '\nTrying to reopen device...')
+            self.__init__(self.timeout, self.device, None if self.__ownport else self.port)
 
-        if DEBUG:
-            print(f'{source}: sending: \\x00' + command.decode('utf-8') + '\\x00', end='')
+    def __write(self, command: bytes, packet: bytes):
+        source = 'DTSerialCom.command()'
+
+        if DTSerialCom.DEBUG:
             sdata = ''
-            for b in packet[len(command)+2:-(_lenEND+1)]:
-                sdata += '\\x%02x' % b
-            print(sdata+_END.decode('utf-8')+'\\x00')
+            for b in packet:
+                sdata += chr(b) if 0x20 <= b < 0x7f else '\\x%02x' % b
+            print(f'{source}: sending {command}: {sdata}')
 
         try:
             nw = self.port.write(packet)
         except serial.SerialException as exc:
             raise DTComError('Write to serial port failed') from exc
 
-        if DEBUG:
+        if DTSerialCom.DEBUG:
             print(f'{source}: {nw} bytes written to port')
 
-        # Read reply from the device
-        try:
-            nbexpect = 0
-            if nreply >= 0:
-                # await 2*nreply bytes plus number of transmitted words (2 bytes) and END directive
-                nbexpect = 2*nreply+2+_lenACK+_lenEND
-                if DEBUG:
-                    print(f'{source}: reading {nbexpect} bytes')
-                response: bytes = self.port.read(nbexpect)
-            else:
-                if DEBUG:
-                    print(f'{source}: reading until {_END} arrives')
-                response: bytes = self.port.read_until(_END)
-        except serial.SerialException as exc:
-            raise DTComError('Read from serial port failed') from exc
+    def reply_timeout(self, command: bytes, packet: bytes, nreply: int):
+        """Return time [s] to wait for the reply of nreply words to the command packet, see ADAPTIVETIMEOUT"""
+        timeout = self.port.timeout
+        if not self.ADAPTIVETIMEOUT or timeout is None or nreply < 0:
+            return timeout
+
+        expected = self.TIMEOUTBASE + (2*nreply+2+_lenACK+_lenEND)/self.transferRate
+        if command == b'GET PWR' or command == b'GET ADC DAT':
+            # data words follow the header b'\0[COMMAND]\0' and LEN
+            words = packet[len(command)+4:-_lenEND-1]
+            if command == b'GET PWR' and len(words) >= 2:
+                expected += int.from_bytes(words[:2], byteorder='little')*self.PWRSAMPLETIME
+            elif command == b'GET ADC DAT' and len(words) >= 4:
+                expected += int.from_bytes(words[2:4], byteorder='little')/adcSampleFrequency
+
+        return min(timeout, self.TIMEOUTMARGIN*expected)
+
+    def __learn_rate(self, nbytes: int, elapsed: float):
+        if nbytes >= self.RATEMINBYTES and elapsed > 0:
+            self.transferRate += self.RATEWEIGHT*(nbytes/elapsed - self.transferRate)
+
+    def __read_reply(self, command: bytes, packet: bytes, nreply: int):
+        """
+        Read and check the reply to the command. Return NumPy array of uint16 with received data if any.
+        Replies of known length are read with readinto() directly into a buffer which the returned array refers to.
+        Replies of at least POOLMINWORDS words use buffers from the pool, see DTBufferPool.
+        The reply is awaited for reply_timeout().
+        """
+        global _END, _lenEND, _ACK, _lenACK
+        DEBUG = DTSerialCom.DEBUG
+
+        source = 'DTSerialCom.command()'
+
+        if nreply < 0:
+            return self.__read_reply_until_end(command)
+
+        # await 2*nreply bytes plus number of transmitted words (2 bytes) and END directive
+        nbexpect = 2*nreply+2+_lenACK+_lenEND
+        lenhead = _lenACK+2
+        if DEBUG:
+            print(f'{source}: reading {nbexpect} bytes')
+
+        # one leading pad byte puts the data words after ACK and LEN at an even address
+        buffer = self.pool.get(nbexpect+1) if nreply >= self.POOLMINWORDS else bytearray(nbexpect+1)
+        mv = memoryview(buffer)[1:]
+
+        timeout = self.reply_timeout(command, packet, nreply)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+
+        # Read ACK and LEN first to check the reply before the data arrive
+        nr = self.__readinto(mv[:lenhead], deadline)
+        self.__tfirst = time.perf_counter() if nr > 0 else None
+        if nr == lenhead and mv[:_lenACK] == _ACK:
+            length = int.from_bytes(mv[_lenACK:lenhead], byteorder='little', signed=False)
+            if length != nreply:
+                print(f'{source}: Warning: Length of the reply ({nreply}) in ' +
+                      f'words differs from length read ({length})')
+            nr += self.__readinto(mv[nr:], deadline)
+            if nr == nbexpect:
+                self.__learn_rate(nr-lenhead, time.perf_counter()-self.__tfirst)
+        elif nr == lenhead and _BUSY.startswith(bytes(mv[:lenhead])):
+            nr += self.__readinto(mv[nr:_lenBUSY], deadline)  # do not wait for the rest of the reply
+        response = mv[:nr]
+        self.__reply = response
 
         if DEBUG:
-            nr = len(response)
             nhead = min(nr, 100)
             ntail = min(5, max(0, nr-100))
-            cutresp = response[:nhead] + (b"..." if ntail > 0 else b"") + (response[-ntail:] if ntail > 0 else b"")
+            cutresp = bytes(response[:nhead]) + (b"..." if ntail > 0 else b"") + \
+                (bytes(response[-ntail:]) if ntail > 0 else b"")
             print(f'{source}: received: {cutresp}')
 
-        if response == b'':
-            raise DTComError(f'On {command}: Empty answer or timeout {self.port.timeout}s expired.')
-        elif response == b'MCU BUSY':
+        if nr == 0:
+            raise DTComTimeoutError(f'On {command}: Empty answer ({_timeout_str(timeout)}).')
+        elif response == _BUSY:
             raise DTComError(f'On {command}: MCU BUSY')
 
         errmsgs = []
@@ -183,8 +776,10 @@ class DTSerialCom(metaclass=Singleton):
             errmsgs.append('ACK was not received')
         if response[-_lenEND:] != _END:
             errmsgs.append('END was not received')
-        if nreply > 0 and len(response) != nbexpect:
-            errmsgs.append(f'Number of bytes in the reply ({len(response)}) does not match' +
+        if nr < nbexpect and timeout is not None and time.perf_counter() >= deadline:
+            errmsgs.append(f'{_timeout_str(timeout)} expired')
+        if nreply > 0 and nr != nbexpect:
+            errmsgs.append(f'Number of bytes in the reply ({nr}) does not match' +
                            f' expected one ({nbexpect}). Can not read out data.')
         if len(errmsgs) > 0:
             raise DTComError(f'On {command}: ' + '; '.join(errmsgs))
@@ -192,7 +787,95 @@ class DTSerialCom(metaclass=Singleton):
         if nreply == 0:
             return None
 
-        rdata = None
+        rdata = frombuffer(buffer, dtype=uint16, count=nreply, offset=1+lenhead)
+
+        if DEBUG:
+            print(f'{source}: read {rdata.size} words: {rdata}')
+
+        return rdata
+
+    def __readinto(self, mv: memoryview, deadline=None):
+        """
+        Read from the port into the memoryview until it is full or the deadline (perf_counter() value) passes.
+        Return number of bytes read. Raise DTCancelledError if the cancel token is set meanwhile.
+        """
+        cancel = self.cancel
+        try:
+            if self.__rawio is None:
+                return self.__readinto_port(mv, deadline)
+
+            waitfor = [self.__rawio] if cancel is None else [self.__rawio, cancel]
+            nr, size = 0, len(mv)
+            while nr < size:
+                n = self.__rawio.readinto(mv[nr:])
+                if n:
+                    nr += n
+                    continue
+                wait = None if deadline is None else deadline - time.perf_counter()
+                if wait is not None and wait <= 0:
+                    break
+                ready, _, _ = select.select(waitfor, [], [], wait)
+                if cancel is not None and cancel.is_set():
+                    raise DTCancelledError('DTSerialCom.command()')
+                if not ready:
+                    break
+            return nr
+        except (OSError, serial.SerialException) as exc:
+            raise DTComError('Read from serial port failed') from exc
+
+    def __readinto_port(self, mv: memoryview, deadline=None):
+        """Read with readinto() of the port object in slices of CANCELPOLL seconds if the cancel token is set"""
+        if isinstance(self.port, serial.Serial):
+            return self.port.readinto(mv)
+
+        cancel = self.cancel
+        if cancel is None:
+            # other ports (DTNativePort, DTReplayPort) take the timeout of the call
+            return self.port.readinto(mv, None if deadline is None else max(0., deadline - time.perf_counter()))
+
+        nr, size = 0, len(mv)
+        while nr < size:
+            cancel.check('DTSerialCom.command()')
+            wait = self.CANCELPOLL if deadline is None else max(0., min(self.CANCELPOLL, deadline - time.perf_counter()))
+            start = time.perf_counter()
+            n = self.port.readinto(mv[nr:], wait)
+            nr += n
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if n == 0 and time.perf_counter() - start < wait:  # port returned without waiting, no more data
+                break
+        return nr
+
+    def __read_reply_until_end(self, command: bytes):
+        """Read the reply of unknown length until END arrives"""
+        global _END, _lenEND, _ACK, _lenACK
+        DEBUG = DTSerialCom.DEBUG
+
+        source = 'DTSerialCom.command()'
+
+        if DEBUG:
+            print(f'{source}: reading until {_END} arrives')
+        try:
+            response: bytes = self.port.read_until(_END)
+        except serial.SerialException as exc:
+            raise DTComError('Read from serial port failed') from exc
+        self.__reply = response
+
+        if DEBUG:
+            print(f'{source}: received: {response[:100]}')
+
+        if response == b'':
+            raise DTComTimeoutError(f'On {command}: Empty answer ({_timeout_str(self.port.timeout)}).')
+        elif response == _BUSY:
+            raise DTComError(f'On {command}: MCU BUSY')
+
+        errmsgs = []
+        if response[:_lenACK] != _ACK:
+            errmsgs.append('ACK was not received')
+        if response[-_lenEND:] != _END:
+            errmsgs.append('END was not received')
+        if len(errmsgs) > 0:
+            raise DTComError(f'On {command}: ' + '; '.join(errmsgs))
 
         response = response[_lenACK:-_lenEND]  # omit ACK & END
         actualLength = (len(response)-2)//2  # actual response data length in 2-byte words
@@ -208,31 +891,96 @@ class DTSerialCom(metaclass=Singleton):
 
         return rdata
 
-    def wait_status(self, mask: int, timeout=2):
-        start = time.time()
-        while 1:
+    def wait_status(self, mask: int, timeout=2, start=None):
+        """
+        Poll STATUS until any bit of mask is set or timeout [s] expires (0 - wait forever).
+        Return tuple (True if a bit is set, last status word).
+        start - clock() of the action the bits are awaited for (default is now)
+        """
+        isset, status, _latencies = self.wait_status_bits({mask: timeout}, start)
+        return (isset, status)
+
+    def wait_status_bits(self, deadlines: dict, start=None):
+        """
+        Poll STATUS until each mask of the deadlines dict {mask: timeout} has any of its bits set
+        or its timeout [s] (0 - no limit) expires.
+        Polls are sent with adaptive back-off: the first one immediately, the period then grows
+        from STATUSPOLLFIRST by STATUSPOLLFACTOR up to STATUSPOLLMAX. Latencies of the masks are recorded
+        in the statusLatency dict of DTLatencyHistogram-s.
+        Return tuple (True if all masks are set, last status word, dict {mask: latency [s] or None if expired}).
+        """
+        if start is None:
+            start = self.clock()
+        pending = dict(deadlines)
+        latencies = dict.fromkeys(deadlines)
+        period = self.STATUSPOLLFIRST
+        status = None
+
+        while True:
             resp = self.command('STATUS', nreply=1)
-            if len(resp) > 0 and resp[0] & mask > 0:
-                return (True, resp[0])
-            if timeout != 0 and time.time()-start > timeout:
-                return (False, resp[0] if len(resp) > 0 else None)
-            time.sleep(0.1)
+            now = self.clock()
+            status = resp[0] if len(resp) > 0 else None
+
+            for mask, timeout in list(pending.items()):
+                if status is not None and status & mask > 0:
+                    latencies[mask] = now - start
+                elif timeout == 0 or now - start <= timeout:
+                    continue
+                del pending[mask]
+                hist = self.statusLatency.get(mask)
+                if hist is None:
+                    hist = self.statusLatency[mask] = DTLatencyHistogram()
+                hist.add(latencies[mask])
+
+            if len(pending) == 0:
+                break
+
+            # do not sleep beyond the nearest deadline
+            nearest = min((start + timeout - now for timeout in pending.values() if timeout != 0), default=period)
+            if isinstance(self.port, DTReplayPort):  # the replay port advances its clock instead
+                self.port.sleep(max(0, min(period, nearest)))
+            elif self.cancel is not None:
+                self.cancel.sleep(max(0, min(period, nearest)), 'DTSerialCom.wait_status_bits()')
+            else:
+                time.sleep(max(0, min(period, nearest)))
+            period = min(period*self.STATUSPOLLFACTOR, self.STATUSPOLLMAX)
+
+        if DTSerialCom.DEBUG:
+            print('DTSerialCom.wait_status_bits(): ' +
+                  ', '.join(f'0x{mask:x}: ' + ('expired' if lat is None else f'{lat*1000:.1f} ms')
+                            for mask, lat in latencies.items()))
+
+        return (all(lat is not None for lat in latencies.values()), status, latencies)
 
     def set_pll_freq(self, pllnum: int, frequency: int):
         if pllnum not in (1, 2):
             raise DTInternalError('DTSerialCom.set_pll_freq()', f'Illegal PLL_NUM value: {pllnum}')
-        if pllnum == 2:  # multiply demodulator frequency by 2
-            frequency *= 2
-        regs = get_pll_regs(frequency)
+        if self.SHADOWING and self.shadow.get(('PLL', pllnum)) == frequency:
+            # PLL holds the frequency already, check it is still locked
+            status = self.command('STATUS', nreply=1)
+            if len(status) > 0 and status[0] & (1 << (1+pllnum)) > 0:
+                if DTSerialCom.DEBUG:
+                    print(f'DTSerialCom.set_pll_freq({pllnum}, {frequency}): already set')
+                return True
+        regs = pll_regs(pllnum, frequency)  # demodulator PLL 2 is set to the doubled frequency
         if regs is None:
             return False
-        self.command('SET PLL', [1, 1])
-        self.command('LOAD PLL', [pllnum, *regs], owordsize=[2]+6*[4])
-        isset, _status = self.wait_status(1 << (1+pllnum), timeout=0.6)
+        start = self.clock()
+        self.batch([('SET PLL', [1, 1]),
+                    ('LOAD PLL', [pllnum, *regs], [2]+6*[4])])
+        isset, _status = self.wait_status(1 << (1+pllnum), timeout=0.6, start=start)
+        if isset:
+            self.shadow[('PLL', pllnum)] = frequency
         if DTSerialCom.DEBUG:
             print(f'DTSerialCom.set_pll_freq({pllnum}, {frequency}): ' + ('success' if isset else 'failed'))
         return isset
 
-    def __del__(self):
-        if hasattr(self, 'port') and self.port.isOpen:
+    def close(self):
+        """Stop capturing and close the port. Use DTSerialCom.release() to forget the instance as well."""
+        if getattr(self, 'capturer', None) is not None:
+            self.capture(None)
+        if hasattr(self, 'port') and self.port.is_open:
             self.port.close()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+
+import os
+import tty
+import time
+import select
+import argparse
+from threading import Thread, Event
+import numpy as np
+
+from dtglobals import adcSampleFrequency, adcCountRange
+
+_END = b'END'
+_ACK = b'ACK'
+
+
+class DTDeviceEmulator:
+    """
+    Software stand-in for the DMR TEST device sitting on a pseudo-terminal.
+    It speaks the same framing as DTSerialCom.command():
+        request:  b'\0[COMMAND]\0[LEN][DATA]END\0'
+        reply:    b'ACK[LEN][DATA]END' or b'MCU BUSY'
+    where [LEN] is the number of 2-byte words in [DATA].
+
+    Usage:
+        with DTDeviceEmulator() as emu:
+            com = DTSerialCom(device=emu.device)
+
+    Replies to STATUS, SET PLL/LOAD PLL, GET PWR and GET ADC DAT are modelled, all other commands are
+    acknowledged and their data words are stored in the state dict.
+    Latencies (in seconds) and reply payloads may be configured per command:
+        latency  - dict {command: seconds} added before replying (key None sets the default)
+        payloads - dict {command: callable(emulator, words) or sequence of words} overriding built-in replies
+    """
+
+    DEBUG = False
+
+    fref = 10000000  # PLL reference frequency [Hz]
+
+    def __init__(self, latency=None, payloads=None, lockdelay=0.005, power=(1090, 1090), pwrsampletime=0.0001,
+                 adcdata=None, tone=1000, amplitude=0.3, noise=0.001, carrier=None, bytespersec=None, seed=0):
+        """
+        Parameters:
+            latency       - dict {command: seconds} of reply latencies, key None sets the default one
+            payloads      - dict {command: callable(emulator, words) or sequence of words} of reply payloads
+            lockdelay     - delay of PLL lock after LOAD PLL [s]
+            power         - output and input power ADC counts returned by GET PWR
+            pwrsampletime - time of one GET PWR averaging sample [s]
+            adcdata       - callable(emulator, channel, N) returning N words or a sequence of words (cycled)
+                            served by GET ADC DAT. By default a noisy tone is generated.
+            tone          - frequency of the generated tone [Hz] if carrier is None
+            amplitude     - amplitude of the generated tone relative to the ADC range
+            noise         - RMS of the generated noise relative to the ADC range
+            carrier       - if set, the tone frequency is the offset of the carrier [Hz] from the demodulator
+                            PLL frequency, channel 2 returns the complex (I, Q) baseband
+            bytespersec   - if set, reply transfer rate is limited to this value
+            seed          - seed of the random generator
+        """
+        self.latency = {None: 0.0002}
+        if latency is not None:
+            self.latency.update(latency)
+        self.payloads = dict() if payloads is None else dict(payloads)
+        self.lockdelay = lockdelay
+        self.power = power
+        self.pwrsampletime = pwrsampletime
+        self.adcdata = adcdata
+        self.tone = tone
+        self.amplitude = amplitude
+        self.noise = noise
+        self.carrier = carrier
+        self.bytespersec = bytespersec
+        self.busy = False  # if True reply 'MCU BUSY' to every command
+        self.rng = np.random.default_rng(seed)
+
+        self.state = dict()  # last data words of the SET commands
+        self.pllregs = {1: None, 2: None}
+        self.lockTime = {1: None, 2: None}  # time when PLL gets locked
+        self.counts = dict()  # number of received commands
+        self.nbin = self.nbout = 0
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.device = os.ttyname(self.slave)
+        self.__stop = Event()
+        self.__thread = None
+        self.__inbuf = bytearray()
+
+    def start(self):
+        if self.__thread is None or not self.__thread.is_alive():
+            self.__stop.clear()
+            self.__thread = Thread(target=self.__serve, daemon=True)
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(1)
+            self.__thread = None
+
+    def close(self):
+        self.stop()
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def status(self):
+        """Return status word: bits 2 and 3 are locks of PLL 1 and 2"""
+        status = 0
+        now = time.perf_counter()
+        for pllnum in (1, 2):
+            if self.lockTime[pllnum] is not None and now >= self.lockTime[pllnum]:
+                status |= 1 << (1+pllnum)
+        return status
+
+    def pll_frequency(self, pllnum):
+        """Decode output frequency [Hz] of a PLL from loaded register values"""
+        regs = self.pllregs[pllnum]
+        if regs is None:
+            return None
+        INT, FRAC = (regs[0] >> 15) & 0xFFFF, (regs[0] >> 3) & 0xFFF
+        MOD = (regs[1] >> 3) & 0xFFF
+        R = (regs[2] >> 14) & 0x3FF
+        outdiv = 1 << ((regs[4] >> 20) & 0x7)
+        if MOD == 0 or R == 0:
+            return None
+        return self.fref * (INT + FRAC/MOD) / R / outdiv
+
+    def __serve(self):
+        while not self.__stop.is_set():
+            rl, _, _ = select.select([self.master], [], [], 0.05)
+            if not rl:
+                continue
+            try:
+                data = os.read(self.master, 65536)
+            except OSError:
+                break
+            self.nbin += len(data)
+            self.__inbuf += data
+            while True:
+                packet = self.__parse()
+                if packet is None:
+                    break
+                self.__reply(*packet)
+
+    def __parse(self):
+        """Extract one complete packet (command, data words as LE-bytes) from the input buffer"""
+        buf = self.__inbuf
+        # skip garbage before the leading null
+        start = buf.find(b'\0')
+        if start < 0:
+            buf.clear()
+            return None
+        del buf[:start]
+        cend = buf.find(b'\0', 1)
+        if cend < 0 or len(buf) < cend+3:
+            return None
+        nwords = int.from_bytes(buf[cend+1:cend+3], 'little')
+        dend = cend + 3 + 2*nwords
+        if len(buf) < dend + len(_END) + 1:
+            return None
+        command = bytes(buf[1:cend]).decode('utf-8', 'replace')
+        data = bytes(buf[cend+3:dend])
+        if buf[dend:dend+len(_END)+1] != _END + b'\0':
+            if self.DEBUG:
+                print(f'DTDeviceEmulator: malformed packet for {command}')
+            del buf[:cend]
+            return None
+        del buf[:dend+len(_END)+1]
+        return command, data
+
+    def __reply(self, command: str, data: bytes):
+        self.counts[command] = self.counts.get(command, 0) + 1
+        words = np.frombuffer(data, dtype='<u2')
+
+        if self.DEBUG:
+            print(f'DTDeviceEmulator: {command} {words}')
+
+        if self.busy:
+            self.__write(b'MCU BUSY')
+            return
+
+        delay = self.latency.get(command, self.latency[None])
+
+        if command in self.payloads:
+            payload = self.payloads[command]
+            reply = payload(self, words) if callable(payload) else payload
+        elif command == 'STATUS':
+            reply = [self.status()]
+        elif command == 'SET PLL':
+            reply = None
+        elif command == 'LOAD PLL':
+            pllnum = int(words[0]) if len(words) > 0 else 0
+            if pllnum in (1, 2) and len(data) == 2+6*4:
+                self.pllregs[pllnum] = np.frombuffer(data, dtype='<u4', offset=2).tolist()
+                self.lockTime[pllnum] = time.perf_counter() + delay + self.lockdelay
+            reply = None
+        elif command == 'GET PWR':
+            avenum = int(words[0]) if len(words) > 0 else 1
+            delay += avenum*self.pwrsampletime
+            reply = self.power
+        elif command == 'GET ADC DAT':
+            channel, N = (int(words[0]), int(words[1])) if len(words) > 1 else (1, 0)
+            delay += (N//2 if channel == 2 else N)/adcSampleFrequency  # I and Q are sampled simultaneously
+            reply = self.__adc_data(channel, N)
+        else:
+            self.state[command] = words.tolist()
+            reply = None
+
+        if delay > 0:
+            time.sleep(delay)
+
+        reply = np.asarray([] if reply is None else reply).astype('<u2')
+        self.__write(_ACK + len(reply).to_bytes(2, 'little') + reply.tobytes() + _END)
+
+    def __adc_data(self, channel, N):
+        if self.adcdata is not None:
+            if callable(self.adcdata):
+                return self.adcdata(self, channel, N)
+            return np.resize(np.asarray(self.adcdata), N)
+
+        fs = adcSampleFrequency
+        freq = self.tone
+        if self.carrier is not None:
+            pllfreq = self.pll_frequency(2)
+            freq = self.carrier - (pllfreq/2 if pllfreq is not None else 0)
+        mid = adcCountRange/2
+        amp = self.amplitude*mid
+        phase = self.rng.uniform(0, 2*np.pi)
+        if channel == 2:  # I and Q halves of the buffer
+            t = np.arange(N//2)/fs
+            It = amp*np.cos(2*np.pi*freq*t + phase)
+            Qt = amp*np.sin(2*np.pi*freq*t + phase)
+            signal = np.concatenate((It, Qt))
+        else:
+            t = np.arange(N)/fs
+            signal = amp*np.cos(2*np.pi*freq*t + phase)
+        signal += self.rng.normal(0, self.noise*mid, signal.size)
+        return np.clip(np.around(signal + mid), 0, adcCountRange-1)
+
+    def __write(self, reply: bytes):
+        if self.bytespersec:
+            chunk = max(64, int(self.bytespersec/1000))
+            for pos in range(0, len(reply), chunk):
+                os.write(self.master, reply[pos:pos+chunk])
+                time.sleep(chunk/self.bytespersec)
+        else:
+            mv = memoryview(reply)
+            while len(mv) > 0:
+                nw = os.write(self.master, mv)
+                mv = mv[nw:]
+        self.nbout += len(reply)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Emulate a DMR TEST device on a pseudo-terminal.')
+    parser.add_argument('-l', '--latency', metavar='SEC', type=float, default=0.0002,
+                        help='default reply latency in seconds')
+    parser.add_argument('-r', '--rate', metavar='B/S', type=float, default=None,
+                        help='limit reply transfer rate in bytes per second')
+    parser.add_argument('-c', '--carrier', metavar='HZ', type=float, default=None,
+                        help='carrier frequency of the emulated input signal')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='verbose print-out')
+    args = parser.parse_args()
+
+    DTDeviceEmulator.DEBUG = args.verbose
+
+    with DTDeviceEmulator(latency={None: args.latency}, carrier=args.carrier, bytespersec=args.rate) as emu:
+        print(f'Emulated device: {emu.device} (Ctrl+C to exit)')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print('Commands received:', emu.counts)
@@ -16,6 +16,24 @@ class DTComError(DTError):
         super().__init__(None, message)
 
 
+class DTComTimeoutError(DTComError):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class DTComBatchError(DTComError):
+    def __init__(self, errors, replies):
+        self.errors = errors  # list of (index, command, message) for failed commands
+        self.replies = replies  # replies of the commands, None for failed ones
+        super().__init__('; '.join(f'#{i} {message}' if message.startswith('On ') else f'#{i} On {command}: {message}'
+                                   for i, command, message in errors))
+
+
+class DTCancelledError(DTError):
+    def __init__(self, source=None):
+        super().__init__(source, 'Operation cancelled')
+
+
 class DTUIError(DTError):
     def __init__(self, source=None, message=None):
         super().__init__(source, message)
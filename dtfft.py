@@ -0,0 +1,260 @@
+""" Spectra of the ADC captures for the tasks. Normalised windows and FFT plans with their input buffers are
+    cached by (window type, N) and (backend, N) in bounded caches shared by all tasks of the process.
+
+    FFT backends:
+        scipy  - scipy.fft with the given number of workers
+        pyfftw - FFTW plans of pyFFTW, the planning wisdom is kept in a file across runs
+        numpy  - numpy.fft
+        auto   - the fastest of the above for each N, benchmarked by prewarm() at the process start
+    The backend is set by configure() from the 'fft' section of the configuration.
+"""
+import pickle
+from collections import OrderedDict
+from os import getenv
+from threading import Lock, local
+from time import perf_counter
+import numpy as np
+import scipy.fft
+from scipy.signal import windows
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+DEBUG = False
+
+CACHESIZE = 16  # number of windows and of FFT plans per thread kept
+BENCHREPEAT = 20  # number of transforms timed per backend by the benchmark
+
+BACKENDS = ('scipy', 'pyfftw', 'numpy')
+
+# current settings, see configure()
+backend = 'scipy'
+workers = 1
+wisdomFile = getenv('HOME') + '/dmr/fftw_wisdom'
+planner = 'FFTW_MEASURE'
+
+_windows = OrderedDict()  # (kind, N): window
+_choice = dict()  # N: backend selected by the benchmark
+_prewarmed = set()  # lengths planned with the configured pyFFTW planner effort, others are only estimated
+_lock = Lock()
+_scratch = local()  # plans - OrderedDict (backend, N, real): plan
+_wisdomChanged = False
+
+
+def _cache_get(cache: OrderedDict, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _cache_put(cache: OrderedDict, key, value):
+    cache[key] = value
+    while len(cache) > CACHESIZE:
+        cache.popitem(last=False)
+
+
+def available_backends():
+    return tuple(name for name in BACKENDS if name != 'pyfftw' or pyfftw is not None)
+
+
+def configure(config: dict = None):
+    """ Set FFT options from dict (the 'fft' section of the configuration), missing keys keep current values:
+            backend - 'scipy', 'pyfftw', 'numpy' or 'auto'
+            workers - number of threads of scipy and pyfftw transforms, -1 for all cores of scipy
+            wisdom  - file of pyFFTW wisdom, it is loaded at once and updated after new plans are made
+            planner - pyFFTW planner effort: 'FFTW_ESTIMATE', 'FFTW_MEASURE', 'FFTW_PATIENT'
+    """
+    global backend, workers, wisdomFile, planner
+    config = config or dict()
+    name = config.get('backend', backend)
+    if name != 'auto' and name not in available_backends():
+        print(f'dtfft: FFT backend {name} is not available, scipy is used')
+        name = 'scipy'
+    backend = name
+    workers = int(config.get('workers', workers))
+    wisdomFile = config.get('wisdom', wisdomFile)
+    planner = config.get('planner', planner)
+    with _lock:
+        _choice.clear()
+    _prewarmed.clear()
+    _scratch.__dict__.clear()
+    load_wisdom()
+
+
+def load_wisdom():
+    if pyfftw is None or not wisdomFile:
+        return
+    try:
+        with open(wisdomFile, 'rb') as file:
+            pyfftw.import_wisdom(pickle.load(file))
+    except FileNotFoundError:
+        pass
+    except Exception as exc:
+        print(f'dtfft: could not load FFTW wisdom from {wisdomFile}: {exc}')
+
+
+def save_wisdom():
+    """ Save pyFFTW wisdom if new plans are made since the last save """
+    global _wisdomChanged
+    if pyfftw is None or not wisdomFile or not _wisdomChanged:
+        return
+    try:
+        with open(wisdomFile, 'wb') as file:
+            pickle.dump(pyfftw.export_wisdom(), file)
+        _wisdomChanged = False
+    except OSError as exc:
+        print(f'dtfft: could not save FFTW wisdom to {wisdomFile}: {exc}')
+
+
+class _Plan:
+    """ Real (or complex if real is False) FFT of N points: fill input and call execute() to get the complex
+        spectrum. The spectrum of pyfftw plans is the internal output array overwritten by the next call.
+        Complex plans keep also buffers of the power spectrum and of the amplitude spectrum of I/Q pairs.
+    """
+
+    def __init__(self, name: str, N: int, effort: str = None, real: bool = True):
+        global _wisdomChanged
+        self.name = name
+        dtype = 'float64' if real else 'complex128'
+        if name == 'pyfftw':
+            self.input = pyfftw.empty_aligned(N, dtype=dtype)
+            build = pyfftw.builders.rfft if real else pyfftw.builders.fft
+            self.fftw = build(self.input, threads=max(workers, 1), planner_effort=effort or planner,
+                              overwrite_input=True, avoid_copy=True)
+            _wisdomChanged = True
+            self.execute = self.fftw
+        else:
+            self.input = np.empty(N, dtype=dtype)
+            if name == 'scipy':
+                fft = scipy.fft.rfft if real else scipy.fft.fft
+                self.execute = lambda: fft(self.input, workers=workers)
+            else:
+                fft = np.fft.rfft if real else np.fft.fft
+                self.execute = lambda: fft(self.input)
+        if not real:
+            self.power = np.empty(N)
+            self.output = np.empty(N//2+1)
+
+
+def _plan(N: int, real: bool = True):
+    name = backend
+    if name == 'auto':
+        name = _choice.get(N, 'scipy')
+    plans = getattr(_scratch, 'plans', None)
+    if plans is None:
+        plans = _scratch.plans = OrderedDict()
+    plan = _cache_get(plans, (name, N, real))
+    if plan is None:
+        # measuring the plans of occasional lengths would take longer than the transforms
+        plan = _Plan(name, N, None if N in _prewarmed else 'FFTW_ESTIMATE', real)
+        _cache_put(plans, (name, N, real), plan)
+    return plan
+
+
+def window(N: int, kind: str = 'blackman'):
+    """ Return read-only symmetric window of N points (scipy.signal.windows name) normalised to the unit
+        mean square, so that the window keeps the power of a broadband signal.
+    """
+    key = (kind, N)
+    with _lock:
+        win = _cache_get(_windows, key)
+    if win is None:
+        win = windows.get_window(kind, N, fftbins=False)
+        win /= np.sqrt(np.dot(win, win)/N)
+        win.flags.writeable = False
+        with _lock:
+            _cache_put(_windows, key, win)
+        if DEBUG:
+            print(f'dtfft: {kind} window of {N} points is computed')
+    return win
+
+
+def amplitude(x, kind: str = 'blackman'):
+    """ Return amplitude spectrum 2/N*|rfft(window*x)| of N real samples x, no window if kind is None """
+    N = len(x)
+    plan = _plan(N)
+    if kind is None:
+        plan.input[:] = x
+    else:
+        np.multiply(window(N, kind), x, out=plan.input)
+    af = np.abs(plan.execute())
+    af *= 2/N
+    return af
+
+
+def _execute_iq(x, y, kind: str):
+    N = len(x)
+    if len(y) != N:
+        raise ValueError(f'dtfft: I and Q lengths {N} and {len(y)} differ')
+    plan = _plan(N, False)
+    if kind is None:
+        plan.input.real = x
+        plan.input.imag = y
+    else:
+        win = window(N, kind)
+        np.multiply(win, x, out=plan.input.real)
+        np.multiply(win, y, out=plan.input.imag)
+    return plan, plan.execute()
+
+
+def spectrum_iq(x, y, kind: str = 'blackman'):
+    """ Return complex spectrum fft(window*(x + jy)) of N real samples x and y, no window if kind is None.
+        The returned array may be a buffer of the thread overwritten by the next call for the same N.
+    """
+    return _execute_iq(x, y, kind)[1]
+
+
+def amplitude_iq(x, y, kind: str = 'blackman'):
+    """ Return sqrt(amplitude(x, kind)**2 + amplitude(y, kind)**2) of N real samples x and y by one complex FFT.
+        The returned array is a buffer of the thread reused by the next call for the same N.
+
+        Spectra X and Y of x and y are parts of the spectrum Z of x + jy: X[k] = (Z[k] + Z*[N-k])/2,
+        Y[k] = (Z[k] - Z*[N-k])/2j, so that |X[k]|^2 + |Y[k]|^2 = (|Z[k]|^2 + |Z[N-k]|^2)/2.
+    """
+    N = len(x)
+    plan, zf = _execute_iq(x, y, kind)
+    power, af = plan.power, plan.output
+    np.abs(zf, out=power)
+    power *= power
+    M = af.size
+    af[0] = 2*power[0]
+    np.add(power[1:M], power[N-1:N-M:-1], out=af[1:])
+    np.sqrt(af, out=af)
+    af *= np.sqrt(2)/N
+    return af
+
+
+def benchmark(N: int):
+    """ Return dict {backend: mean time of a transform of N points} for the available backends """
+    times = dict()
+    for name in available_backends():
+        plan = _Plan(name, N)
+        plan.input[:] = np.random.default_rng(0).normal(size=N)
+        plan.execute()  # the first call may be slower
+        start = perf_counter()
+        for _ in range(BENCHREPEAT):
+            plan.input[0] = 0.  # overwrite_input of pyfftw plans
+            plan.execute()
+        times[name] = (perf_counter()-start)/BENCHREPEAT
+    return times
+
+
+def prewarm(sizes, kinds=('blackman',)):
+    """ Compute windows and plans for the lengths given, so that the first measurement does not wait.
+        With 'auto' backend the fastest one is selected for each length.
+    """
+    for N in sizes:
+        _prewarmed.add(N)
+        if backend == 'auto' and N not in _choice:
+            times = benchmark(N)
+            with _lock:
+                _choice[N] = min(times, key=times.get)
+            if DEBUG:
+                print(f'dtfft: N={N} ' + ', '.join(f'{name} {t*1e6:.0f} us' for name, t in times.items()) +
+                      f', {_choice[N]} is selected')
+        for kind in kinds:
+            amplitude(np.zeros(N), kind)
+            amplitude_iq(np.zeros(N), np.zeros(N), kind)
+    save_wisdom()
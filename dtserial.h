@@ -22,4 +22,18 @@ extern int writecommand(int fd, const char* command, const unsigned int* odata,
 // nreply - number of 2-byte words expected not exceeding the reply buffer size
 extern int readreply(int fd, float timeout, unsigned int *reply, unsigned int nreply);
 
+// Discard data received and not yet transmitted. Return 0 or -1 on failure.
+extern int flushserial(int fd);
+
+// Write a complete packet of n bytes waiting not longer than timeout seconds (not positive - no limit)
+// if the device is not ready.
+// Number of written bytes is returned or -1 on case of an error.
+extern int writepacket(int fd, const char* packet, size_t n, float timeout);
+
+// Read raw bytes of a reply into the caller buffer until nexpected bytes are read or timeout expired.
+// If untilend is not 0, stop after END is received.
+// Number of bytes read is returned or -1 on case of an error.
+// timeout - timeout in seconds, no timeout if not positive
+extern int readpacket(int fd, float timeout, char* buf, size_t nexpected, int untilend);
+
 #endif //DTSERIAL_H
\ No newline at end of file
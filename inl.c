@@ -80,8 +80,9 @@ int peak_search(const double *amp, int fmin, int fmax, int strict, double *ppwr,
 #define HMAX 3.8
 static const double hstep = (HMAX-HMIN)/(NH-1);
 static double lmitable[NH];
-static int mitabcalc = 0;
 
+//the table is filled once when the library is loaded, so that it is only read by concurrent calls
+__attribute__((constructor))
 static void calc_lmi_table()
 {
 	double h = HMIN;
@@ -104,11 +105,6 @@ int get_inl_fm(const double *amp, int num, double fm, double *pinl, double *ph)
 
 	double p1, p2, pn, ptot, perror=0, fest, tmp, h;
 
-	if (!mitabcalc) {
-		calc_lmi_table();
-		mitabcalc = 1;
-	}
-
 	*pinl = *ph = 0;
 
 	int fmin = (int)limit((fm*(1-freqwh)), 0, num-1);
@@ -217,3 +213,45 @@ int get_inl(const double *amp, int num, double fm, double *pinl)
 
 	return 1;
 }
+
+//Batched analysis of n spectra stored in one buffer: spectrum k has lengths[k] bins starting at amp[offsets[k]].
+//Results for spectrum k are stored at index k of the output arrays, ok[k] is the return code of the single call.
+//Return number of spectra analysed successfully.
+
+//fmin, fmax - spans in the bin indices of each spectrum
+int peak_search_batch(const double *amp, const int *offsets, const int *lengths, int n,
+                      const int *fmin, const int *fmax, int strict, double *ppwr, double *pfpeak, int *ok)
+{
+	int ngood = 0;
+	for(int k=0; k<n; k++) {
+		int lo = limit(fmin[k], 0, lengths[k]-1);
+		int hi = limit(fmax[k], 0, lengths[k]-1);
+		ok[k] = lengths[k] > 0 && peak_search(amp+offsets[k], lo, hi, strict, ppwr+k, pfpeak+k);
+		ngood += ok[k];
+	}
+	return ngood;
+}
+
+//fm - nominal modulating frequencies in bins of each spectrum
+int get_inl_fm_batch(const double *amp, const int *offsets, const int *lengths, int n,
+                     const double *fm, double *pinl, double *ph, int *ok)
+{
+	int ngood = 0;
+	for(int k=0; k<n; k++) {
+		ok[k] = get_inl_fm(amp+offsets[k], lengths[k], fm[k], pinl+k, ph+k);
+		ngood += ok[k];
+	}
+	return ngood;
+}
+
+//f - nominal main harmonic frequencies in bins of each spectrum
+int get_inl_batch(const double *amp, const int *offsets, const int *lengths, int n,
+                  const double *f, double *pinl, int *ok)
+{
+	int ngood = 0;
+	for(int k=0; k<n; k++) {
+		ok[k] = get_inl(amp+offsets[k], lengths[k], f[k], pinl+k);
+		ngood += ok[k];
+	}
+	return ngood;
+}
@@ -1,8 +1,15 @@
 import os, sys
+import argparse
 import tkinter as tk
 
 from widgets import DTApplication
 
 if __name__ == "__main__":
-    app = DTApplication()
+    parser = argparse.ArgumentParser(description='DMR TEST application.')
+    parser.add_argument('-d', '--device', action='append', default=None,
+                        help='tester device to use (may be repeated), all connected testers by default. ' +
+                             'Start one application per tester to test several radios at once.')
+    args = parser.parse_args()
+
+    app = DTApplication(args.device)
     app.run()
@@ -1,7 +1,6 @@
 #include <stdio.h>
 #include "dtpll.h"
 
-static double gooderr;
 typedef struct pll_set {
 	int R;
 	int MOD;
@@ -44,7 +43,8 @@ void GetAppr(double val, int  *pr, int *qr, int dmax){
 
 
 
-int comp_set (const pll_set *a, const pll_set *b){
+//sets with errors below gooderr are compared by MOD first
+int comp_set (const pll_set *a, const pll_set *b, double gooderr){
 	if((*a).err<gooderr && (*b).err<gooderr){
 		if((*a).MOD>(*b).MOD) return 1;
 		else if((*a).MOD<(*b).MOD) return 0;
@@ -70,10 +70,9 @@ double vcomin,
 double gooderrin
 ){
 	const int arrs=10;
-	gooderr=gooderrin;
 	pll_set sets[arrs];
 	
-	for(int i=0; i<arrs; i++) sets[i].err=3*gooderr;
+	for(int i=0; i<arrs; i++) sets[i].err=3*gooderrin;
 
 	pll_set locset, tls;
 
@@ -109,7 +108,7 @@ double gooderrin
 							
 							minpos=0;
 							for(int i=0; i<apoint; i++){
-								if(comp_set(&locset, &sets[i])) break;
+								if(comp_set(&locset, &sets[i], gooderrin)) break;
 								minpos++;
 							}
 							for(int i=minpos; i<apoint; i++){
@@ -144,7 +143,7 @@ double gooderrin
 
 							minpos=0;
 							for(int i=0; i<apoint; i++){
-								if(comp_set(&locset, &sets[i])) break;
+								if(comp_set(&locset, &sets[i], gooderrin)) break;
 								minpos++;
 							}
 							for(int i=minpos; i<apoint; i++){
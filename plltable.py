@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+import struct
+import argparse
+from functools import lru_cache
+from os import getenv
+from time import time
+import numpy as np
+
+from dt_c_api import get_pll_regs
+from dtglobals import kHz, MHz
+
+
+class DTPllTable:
+    """
+    Precomputed PLL register values for a frequency grid, memory-mapped from a binary file.
+    File layout (little-endian):
+        header: magic b'DTPLLTB1', fstart, fstep, count, R3, R5 (uint32 each), 4 pad bytes
+        count records of registers R0, R1, R2, R4 (uint32 each) for frequencies fstart + i*fstep
+    Registers R3 and R5 do not depend on frequency and are stored once in the header.
+    A record of zeros marks a frequency for which no PLL setting was found.
+    The file is opened at the first lookup.
+    """
+
+    MAGIC = b'DTPLLTB1'
+    HEADER = struct.Struct('<8s5I4x')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__records = None
+        self.__tried = False
+
+    def __load(self):
+        self.__tried = True
+        try:
+            with open(self.filename, 'rb') as file:
+                magic, self.fstart, self.fstep, self.count, self.R3, self.R5 = \
+                    self.HEADER.unpack(file.read(self.HEADER.size))
+            if magic != self.MAGIC:
+                print(f'DTPllTable: {self.filename} is not a PLL table')
+                return
+            self.__records = np.memmap(self.filename, dtype='<u4', mode='r', offset=self.HEADER.size,
+                                       shape=(self.count, 4))
+        except (OSError, ValueError, struct.error):
+            self.__records = None
+
+    def lookup(self, frequency: int):
+        """Return tuple of 6 register values for the frequency or None if it is not in the table"""
+        if self.__records is None:
+            if self.__tried:
+                return None
+            self.__load()
+            if self.__records is None:
+                return None
+
+        index, rest = divmod(frequency-self.fstart, self.fstep)
+        if rest != 0 or index < 0 or index >= self.count:
+            return None
+
+        R0, R1, R2, R4 = self.__records[index].tolist()
+        if R1 == 0:
+            return None
+
+        return (R0, R1, R2, self.R3, R4, self.R5)
+
+    @classmethod
+    def generate(cls, filename, pllnum: int, fstart: int, fstop: int, fstep: int):
+        """Compute register values for frequencies from fstart to fstop inclusive with fstep and write the table"""
+        count = (fstop-fstart)//fstep + 1
+        records = np.zeros((count, 4), dtype='<u4')
+        R3 = R5 = None
+        start = time()
+        for i in range(count):
+            regs = pll_search(pllnum, fstart + i*fstep)
+            if regs is None:
+                continue
+            if R3 is None:
+                R3, R5 = regs[3], regs[5]
+            elif (R3, R5) != (regs[3], regs[5]):
+                raise ValueError(f'Registers R3, R5 depend on frequency {fstart + i*fstep}')
+            records[i] = regs[0], regs[1], regs[2], regs[4]
+            if i % 100000 == 0 and i > 0:
+                print(f'{i}/{count} frequencies done in {time()-start:.1f} s', flush=True)
+
+        with open(filename, 'wb') as file:
+            file.write(cls.HEADER.pack(cls.MAGIC, fstart, fstep, count, R3 or 0, R5 or 0))
+            file.write(records.tobytes())
+
+        return count
+
+
+def table_filename(pllnum: int):
+    return getenv('HOME') + f'/dmr/lib/pll{pllnum}.tbl'
+
+
+_tables = {pllnum: DTPllTable(table_filename(pllnum)) for pllnum in (1, 2)}
+
+
+def pll_search(pllnum: int, frequency: int):
+    """Search PLL register values for the frequency with libdmr. Demodulator PLL 2 runs at the doubled frequency."""
+    regs = get_pll_regs(2*frequency if pllnum == 2 else frequency)
+    return None if regs is None else tuple(regs)
+
+
+@lru_cache(maxsize=1024)
+def pll_regs(pllnum: int, frequency: int):
+    """Return tuple of PLL register values for the frequency of the PLL from the precomputed table or
+       search them if the frequency is not in the table. Results are cached.
+    """
+    regs = _tables[pllnum].lookup(frequency)
+    if regs is None:
+        regs = pll_search(pllnum, frequency)
+    return regs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precompute PLL register tables for the carrier frequency range.')
+    parser.add_argument('-p', '--pll', metavar='N', type=int, nargs='+', default=[1, 2], choices=[1, 2],
+                        help='PLL numbers to compute tables for')
+    parser.add_argument('--fstart', metavar='HZ', type=int, default=138*MHz, help='first frequency')
+    parser.add_argument('--fstop', metavar='HZ', type=int, default=800*MHz, help='last frequency')
+    parser.add_argument('--fstep', metavar='HZ', type=int, default=1*kHz, help='frequency step')
+    parser.add_argument('-c', '--check', action='store_true', help='check existing tables against libdmr')
+    args = parser.parse_args()
+
+    for pllnum in args.pll:
+        filename = table_filename(pllnum)
+        if args.check:
+            rng = np.random.default_rng()
+            table = DTPllTable(filename)
+            freqs = args.fstart + args.fstep*rng.integers(0, (args.fstop-args.fstart)//args.fstep+1, 1000)
+            nbad = sum(table.lookup(int(f)) != pll_search(pllnum, int(f)) for f in freqs)
+            print(f'{filename}: {nbad} of {freqs.size} random frequencies differ from libdmr')
+        else:
+            print(f'Computing table for PLL {pllnum} to {filename}')
+            count = DTPllTable.generate(filename, pllnum, args.fstart, args.fstop, args.fstep)
+            print(f'{count} frequencies written')
@@ -1,21 +1,30 @@
 from time import time
-from multiprocessing import Process
+from queue import Queue
+from threading import Thread
+from multiprocessing import Process, Pipe
 from multiprocessing.connection import Connection
 from traceback import print_exc
 
 import tasks
+import dtfft
 from tasks import DTTask, DTCalibrateDcComp
-from dtcom import DTSerialCom
+from dtcom import DTSerialCom, DTCancelToken, list_devices
+from dtexcept import DTCancelledError
 
 
 class DTProcess(Process):
 
     DEBUG = False
 
-    """ Process for running DTTask-s in parallel to GUI """
-    def __init__(self, conn: Connection):
+    """ Process for running DTTask-s in parallel to GUI.
+        The tasks communicate with the device given (the first found by default).
+        Messages are received by a listener thread, so that 'stop' and 'terminate' cancel
+        the running task within one device command round trip.
+    """
+    def __init__(self, conn: Connection, device=None):
         super().__init__()
         self.conn = conn
+        self.device = device
         self.caltask = DTCalibrateDcComp()
         self.calibPeriod = 600  # 10 min
 
@@ -30,7 +39,18 @@ class DTProcess(Process):
 
     def run(self):
         """ Run loop and waiting for submitted tasks """
-        onoff = {True: 'ON', False: 'OFF'}
+        # tasks running in this process open DTSerialCom() for the device of the process
+        DTSerialCom.default_device = self.device
+
+        self.messages = Queue()  # messages received by the listener thread
+        self.cancel = DTCancelToken()  # set on stop request to interrupt the running task
+        Thread(target=self.__listen, daemon=True).start()
+
+        # windows and FFT of the configured capture lengths are ready before the first task
+        start = time()
+        dtfft.prewarm(tasks.dtFftLengths())
+        if self.DEBUG:
+            print(f'DTProcess: FFT of lengths {sorted(tasks.dtFftLengths())} prepared in {time()-start:.3f} s')
 
         # Calibration after the start
         #self.calibrate()
@@ -41,34 +61,90 @@ class DTProcess(Process):
             #    self.calibrate()
             #if not self.conn.poll(self.calibPeriod/10):
             #    continue
-            obj = self.conn.recv()
+            obj = self.messages.get()
             if isinstance(obj, DTTask):
                 self.__runTask(obj)
             elif obj == 'terminate':
                 if self.DEBUG:
                     print('DTProcess: Terminate command received')
                 break
-            elif isinstance(obj, str) and obj[:5] == 'debug':
-                self.DEBUG = obj[6] == '1'
-                tasks.DEBUG = obj[7] == '1'
-                DTSerialCom.DEBUG = obj[8] == '1'
-                print(f'DTProcess: DEBUG: PROCESS - {onoff[self.DEBUG]}, TASKS - {onoff[tasks.DEBUG]}, COMM - {onoff[DTSerialCom.DEBUG]}')
+            else:
+                self.__handleMessage(obj)
 
+        dtfft.save_wisdom()
         if self.DEBUG:
+            self.dumpStats()
             print(f'DTProcess: Process {self.pid} is finishing')
 
+    def __listen(self):
+        """ Receive messages to the queue. Stop requests set the cancel token at once. """
+        while True:
+            try:
+                obj = self.conn.recv()
+            except (EOFError, OSError):
+                obj = 'terminate'  # the other end is closed
+            if obj == 'stop' or obj == 'terminate':
+                self.cancel.set()
+            self.messages.put(obj)
+            if obj == 'terminate':
+                break
+
+    def __handleMessage(self, obj):
+        """ Handle control messages except 'stop' and 'terminate' """
+        onoff = {True: 'ON', False: 'OFF'}
+
+        if isinstance(obj, str) and obj[:5] == 'debug':
+            self.DEBUG = obj[6] == '1'
+            tasks.DEBUG = obj[7] == '1'
+            DTSerialCom.DEBUG = obj[8] == '1'
+            print(f'DTProcess: DEBUG: PROCESS - {onoff[self.DEBUG]}, TASKS - {onoff[tasks.DEBUG]}, COMM - {onoff[DTSerialCom.DEBUG]}')
+        elif isinstance(obj, str) and obj[:5] == 'stats':
+            self.dumpStats(reset=obj == 'stats reset')
+        elif isinstance(obj, str) and obj[:7] == 'capture':
+            self.capture(obj[8:] or None)
+        elif self.DEBUG:
+            print(f'DTProcess: Message "{obj}" ignored')
+
+    def __pollMessages(self):
+        """ Handle queued messages during a task. Return 'stop' or 'terminate' if received, otherwise None. """
+        while not self.messages.empty():
+            msg = self.messages.get()
+            if self.DEBUG:
+                print(f'DTProcess: received "{msg}"')
+            if msg == 'stop' or msg == 'terminate':
+                return msg
+            self.__handleMessage(msg)
+        return None
+
+    def dumpStats(self, reset=False):
+        """ Print the communication counters of DTSerialCom, reset them if requested """
+        com = DTSerialCom.instance(self.device)
+        if com is None:
+            print('DTProcess: No communication with the device yet')
+            return
+        print(f'DTProcess: Communication statistics\n{com.stats}')
+        if reset:
+            com.stats.reset()
+
+    def capture(self, filename=None):
+        """ Start capturing the device communication to the file or stop it if filename is None """
+        com = DTSerialCom.instance(self.device) or DTSerialCom(device=self.device)
+        com.capture(filename)
+        print(f'DTProcess: Capture to {filename} started' if filename else 'DTProcess: Capture stopped')
+
     def __runTask(self, task: DTTask):
         if self.DEBUG:
             print(f'DTProcess: Task {task.name["en"]} started')
 
         msg = None
+        self.cancel.clear()
+        task.cancel = self.cancel
 
         try:
             task.init_meas()
             self.__sendResults(task)
 
-            if self.conn.poll():
-                msg = self.conn.recv()
+            msg = self.__pollMessages()
 
             if task.failed or task.completed or msg == 'stop' or msg == 'terminate':
                 if self.DEBUG:
@@ -83,19 +159,25 @@ class DTProcess(Process):
                     self.__sendResults(task)
                     if task.failed:
                         break
-                    if self.conn.poll():
-                        msg = self.conn.recv()
-                        if self.DEBUG:
-                            print(f'DTProcess: received "{msg}"')
+                    msg = self.__pollMessages()
 
+        except DTCancelledError:
+            msg = self.__pollMessages()
+            if self.DEBUG:
+                print(f'DTProcess: Task cancelled on "{msg}"')
         except Exception as exc:
             print_exc()
             if not isinstance(exc, EOFError):
                 self.conn.send(exc)
 
+        task.cancel = None
+        if msg == 'terminate':
+            self.messages.put(msg)  # finish the event loop as well
+
         self.conn.send(f'stopped {task.id}')
         if self.DEBUG:
             print(f'DTProcess: Task "{task.name["en"]}" finished')
+            self.dumpStats()
 
     def __sendResults(self, task: DTTask):
         if self.DEBUG:
@@ -106,3 +188,23 @@ class DTProcess(Process):
         end = time()
         if self.DEBUG:
             print(f'DTProcess: Sending took {end-start:.3g} seconds')
+
+
+def start_device_processes(devices=None):
+    """ Start one DTProcess per device to test several radios in parallel.
+        devices - list of device paths, all connected devices by default (see list_devices()).
+        Return dict {device: (process, connection)}, where connection is the end of the pipe to send tasks to.
+    """
+    if devices is None:
+        devices = list_devices()
+
+    processes = dict()
+    for device in devices:
+        conn, childConn = Pipe()
+        process = DTProcess(childConn, device)
+        process.start()
+        childConn.close()  # the end of the child process, EOF is received by the parent if the child dies
+        processes[device] = (process, conn)
+        if DTProcess.DEBUG:
+            print(f'DTProcess {process.pid} started for device {device}')
+    return processes
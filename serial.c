@@ -67,7 +67,7 @@ static void print_bytes(const char *buf, size_t n)
 
 static const char* strpollflags(int revents)
 {
-    static char str[200];
+    static __thread char str[200];
     static const char* sflags[] = {"POLLIN", "POLLERR", "POLLHUP", "POLLNVAL", "POLLPRI"};
     static const int flags[] = {POLLIN, POLLERR, POLLHUP, POLLNVAL, POLLPRI};
 
@@ -98,7 +98,7 @@ int openserial(const char* devfn)
     }
 
     struct termios tiop;
-    if (ioctl(3, TCGETS, &tiop) < 0)  {
+    if (ioctl(fd, TCGETS, &tiop) < 0)  {
         close(fd);
         return -1;
     }
@@ -120,11 +120,10 @@ int openserial(const char* devfn)
         return -1;
     }
 
+    // modem lines are absent on pseudo-terminals, e.g. of the device emulator
     int iocmbits = TIOCM_DTR|TIOCM_RTS;
-    if (ioctl(fd, TIOCMBIS, &iocmbits) < 0) {
-        close(fd);
-        return -1;
-    }
+    if (ioctl(fd, TIOCMBIS, &iocmbits) < 0 && DTSERIALDEBUG)
+        perror("Setting DTR and RTS");
 
     return fd;
 }
@@ -308,3 +307,100 @@ int readreply(int fd, float timeout, unsigned int *reply, unsigned int nreply)
 
     return ireply;
 }
+
+static double monotonic_time(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + 1e-9*ts.tv_nsec;
+}
+
+int flushserial(int fd)
+{
+    if (ioctl(fd, TCFLSH, TCIOFLUSH) < 0) {
+        perror("Can not flush data");
+        return -1;
+    }
+    return 0;
+}
+
+int writepacket(int fd, const char* packet, size_t n, float timeout)
+{
+    size_t ntotb = 0;
+    double deadline = monotonic_time() + timeout;
+    struct pollfd pfd = {fd, POLLOUT, 0};
+
+    if (DTSERIALDEBUG) {
+        printf("Sending packet of %lu bytes: ", n);
+        print_bytes(packet, n);
+    }
+
+    while (ntotb < n) {
+        ssize_t nb = write(fd, packet+ntotb, n-ntotb);
+        if (nb > 0) {
+            ntotb += nb;
+            continue;
+        }
+        if (nb < 0 && errno != EAGAIN && errno != EINTR) {
+            perror("Writing packet");
+            return -1;
+        }
+        // not positive timeout means no timeout as in readpacket()
+        int toms = timeout > 0 ? (int)((deadline - monotonic_time())*1000) : -1;
+        if (timeout > 0 && toms <= 0)
+            break;
+        int rp = poll(&pfd, 1, toms);
+        if (rp < 0 && errno != EINTR) {
+            perror("Polling device for writing");
+            return -1;
+        } else if (rp == 0) { // timeout
+            break;
+        }
+    }
+
+    return ntotb;
+}
+
+int readpacket(int fd, float timeout, char* buf, size_t nexpected, int untilend)
+{
+    static const size_t lenend = sizeof(END)-1;
+
+    size_t ntotb = 0;
+    double deadline = monotonic_time() + timeout;
+    struct pollfd pfd = {fd, POLLIN, 0};
+
+    while (ntotb < nexpected) {
+        // read byte by byte until END not to consume the next reply
+        ssize_t nb = read(fd, buf+ntotb, untilend ? 1 : nexpected-ntotb);
+        if (nb > 0) {
+            ntotb += nb;
+            if (untilend && ntotb >= lenend && strncmp(buf+ntotb-lenend, END, lenend) == 0)
+                break;
+            continue;
+        }
+        if (nb < 0 && errno != EAGAIN && errno != EINTR) {
+            perror("Reading device");
+            return -1;
+        }
+        int toms = timeout > 0 ? (int)((deadline - monotonic_time())*1000) : -1;
+        if (timeout > 0 && toms <= 0)
+            break;
+        int rp = poll(&pfd, 1, toms);
+        if (rp < 0 && errno != EINTR) {
+            perror("Polling available data");
+            return -1;
+        } else if (rp == 0) { // timeout
+            break;
+        } else if (rp > 0 && (pfd.revents & (POLLERR|POLLHUP|POLLNVAL)) && !(pfd.revents & POLLIN)) {
+            fprintf(stderr, "Device is not readable: %s\n", strpollflags(pfd.revents));
+            return -1;
+        }
+    }
+
+    if (DTSERIALDEBUG) {
+        printf("%lu bytes received: ", ntotb);
+        print_bytes(buf, min(ntotb, (size_t)100));
+    }
+
+    return ntotb;
+}
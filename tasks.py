@@ -1,14 +1,13 @@
 from os import getenv
 from time import time, sleep, perf_counter
 import numpy as np
-from scipy.fft import rfft
-from scipy.signal import blackman
 from numbers import Integral, Real
 from traceback import print_exc
 
 from dtcom import DTSerialCom
 from dtexcept import DTInternalError, DTComError
-from dt_c_api import get_peak, get_inl_fm, get_inl, get_ber
+from dtfft import amplitude, amplitude_iq, spectrum_iq
+from dt_c_api import get_peak, get_peaks, get_inl_fm, get_inl, get_ber, DTBerStream
 from dtglobals import Hz, kHz, MHz, adcSampleFrequency, symbolDevFrequency, lfAdcVoltRanges, hfAdcRange, adcCountRange
 import dtglobals as dtg  # for dtg.LANG
 
@@ -46,6 +45,8 @@ dtParameterDesc = {
                  'lowlim': 2.56, 'uplim': 12.288, 'values': sorted(lfAdcVoltRanges), 'dunit': 'V', 'format': '6.3f'},
     'demodgain': {'ru': 'Усил. демод.', 'en': 'Demod gain', 'type': Real, 'default': 20,
                   'lowlim': 0, 'uplim': 100, 'increment': 1, 'dunit': '1', 'format': '3.0f'},
+    'captures': {'ru': 'N захв. АЦП', 'en': 'N ADC capt.', 'type': Integral, 'default': 2,
+                 'lowlim': 1, 'uplim': 2, 'values': [1, 2], 'dunit': '1', 'format': '1.0f'},
     # result tolerance parameters
     'CARRIER abstol': {'ru': '\u2206 f_н', 'en': '\u2206 f_c', 'type': Integral, 'default': 350*Hz,
                        'lowlim': 1, 'uplim': 10*kHz, 'increment': 1, 'dunit': 'Hz',
@@ -71,6 +72,7 @@ dtResultDesc = {
     'FREQUENCY': {'ru': 'Частота НЧ', 'en': 'LF frequency', 'dunit': 'Hz', 'format': '5.0f'},
     'BITERR': {'ru': 'BER', 'en': 'BER', 'dunit': '%', 'format': '5.1f',
                'tolerances': ['BITERR uplim']},
+    'BITERRSUM': {'ru': 'BER \u03A3', 'en': 'BER \u03A3', 'dunit': '%', 'format': '7.3f'},
     'BITPOWERDIF': {'ru': '\u2206 P', 'en': '\u2206 P', 'dunit': '%', 'format': '5.1f'},
     'BITFREQDEV': {'ru': '\u2206 f', 'en': '\u2206 f', 'dunit': 'Hz', 'format': '5.1f'},
     'THRESHOLD POWER': {'ru': 'Порог. мощн.', 'en': 'Thr. power', 'dunit': 'dBm', 'format': '5.1f'},
@@ -126,6 +128,7 @@ class DTTask:
         self.completed = False  # if measure successfully completed
         self.single = False  # if task is single (only init_meas(), no measure() methon defined)
         self.com = None  # reference to DTSerialCom instance
+        self.cancel = None  # DTCancelToken set by DTProcess to interrupt the task
         self.start = self.time = 0  # time of measurements
         self.id = None  # ID of the task (set once in the main process)
 
@@ -137,7 +140,8 @@ class DTTask:
         self.start = self.time = 0
         if 'autotest' not in kwargs:  # do not establish communication with the device for autotest tasks
             try:
-                self.com = DTSerialCom()  # serial communication instance (initialised only once as DTSerialCom is singleton)
+                self.com = DTSerialCom()  # serial communication instance (one per device, opened only once)
+                self.com.cancel = self.cancel
             except DTComError as exc:
                 self.set_com_error(exc)
                 return self
@@ -159,6 +163,14 @@ class DTTask:
             self.results[res] = None
         return self
 
+    def pause(self, seconds: float):
+        """ Sleep for the given time. If the task is cancelled meanwhile, DTCancelledError is raised at once.
+        """
+        if self.cancel is not None:
+            self.cancel.sleep(seconds, self.__class__.__name__)
+        else:
+            sleep(seconds)
+
     def load_cal(self):
         """ Loading calibration of output power. Called from the main process where dtParameterDesc is kept up to date.
         """
@@ -418,6 +430,8 @@ class DTCalibrateDcComp(DTTask):
     """
     name = dict(ru='Калибровка смещения I&Q', en='Calibration of I&Q bias')
 
+    calibrationTime = 1  # [s] no status bit signals the end of calibration by the device, so wait for a fixed time
+
     def __init__(self):
         super().__init__()
         self.single = True
@@ -428,12 +442,12 @@ class DTCalibrateDcComp(DTTask):
             return self
 
         try:
-            self.com.command('SET RF_PATH', 0)
-            self.com.command('SET DEMOD', [1, 20])
-            self.com.command('SET MOD', 0)
-            self.com.command('SET MEASST', 1)
-            self.com.command('SET DCCOMP', 1)
-            sleep(1)  # Wait for calibration by the device
+            self.com.batch([('SET RF_PATH', 0),
+                            ('SET DEMOD', [1, 20]),
+                            ('SET MOD', 0),
+                            ('SET MEASST', 1),
+                            ('SET DCCOMP', 1)])
+            self.pause(self.calibrationTime)  # Wait for calibration by the device
             self.com.command('SET DCCOMP', 0)
 
             status = self.com.command('STATUS', nreply=1)[0]
@@ -482,11 +496,11 @@ class DTMeasurePower(DTTask):
         self.set_success()
         return self
 
-    def measurePower(self, avenum=5):
-        """Measure input and output powers [dBm]"""
-        if 'avenum' in self.parameters:
-            avenum = int(self.parameters['avenum'])
-        counts = self.com.command('GET PWR', avenum, nreply=2)
+    def measurePower(self, avenum=None):
+        """Measure input and output powers [dBm] averaging avenum samples, parameter avenum (or 5) by default"""
+        if avenum is None:
+            avenum = int(self.parameters.get('avenum', 5))
+        counts = self.com.command('GET PWR', avenum, nreply=2).tolist()  # uint16 counts overflow
         return [((c-self.atcPedestal) * self.adcCountTomV - self.voltageShift) * self.mVTodBm + self.powerShift for c in counts]
 
     def getDemodGain(self, inpwr):
@@ -511,10 +525,10 @@ class DTCalibrateOutputPower(DTMeasurePower):
             return self
 
         try:
-            self.com.command('SET RF_PATH', 1)
-            self.com.command('SET MOD', 1)
             attcode = int(2*self.parameters['att']+0.5)
-            self.com.command('SET ATT', attcode)
+            self.com.batch([('SET RF_PATH', 1),
+                            ('SET MOD', 1),
+                            ('SET ATT', attcode)])
             isset = self.com.set_pll_freq(1, int(self.parameters['frequency']))
             if not isset:
                 self.set_pll_error()
@@ -544,36 +558,53 @@ class DTCalibrateOutputPower(DTMeasurePower):
 class DTMeasureInput(DTMeasurePower):
     """
     Measuring input power and carrier frequency.
+    The carrier frequency is measured by one of the methods selected by parameter captures:
+        2 - two captures of I signal with the demodulator PLL set to the frequency and shifted by
+            nominalCarrierOffset, the sign of the carrier offset is resolved by the shift of the peak
+        1 - one capture of I and Q signals with the demodulator PLL shifted by nominalCarrierOffset, the signed
+            offset is the peak of the complex spectrum of I+jQ refined by Jacobsen's interpolation. The PLL is
+            shifted because a carrier at the PLL frequency would be removed with the DC component.
+            quadratureSign is checked only against the emulator, whose Q signal follows the same convention.
+    In repeated measurements (repeatedMode) the PLL frequency set last is captured first, so the order of
+    the two captures alternates and the PLL is retuned once per measurement. The input power and the
+    demodulator gain are kept from the last full power measurement while the input power measured with
+    driftAvenum samples differs from it by no more than powerDriftThreshold.
     """
     nominalCarrierOffset = 5*kHz  # auxillary offset of PLL frequency
     minSignalRMS = 0.001  # low limit of signal RMS [V]. If signal RMS is less than that report absence of carrier.
+    dcBins = 3  # half-width of the Blackman window main lobe [bins]
+    dcPowerRatio = 0.1  # peak power ratio of the captures taken as a carrier removed with the DC component
+    quadratureSign = 1  # sign of the frequency of I+jQ for the carrier above the demodulator PLL frequency
+    repeatedMode = True  # alternate the capture order and reuse the input power in repeated measurements
+    powerDriftThreshold = 1.  # [dB]
+    driftAvenum = 4  # number of samples averaged by GET PWR to check the input power drift
 
     name = dict(ru='Измерение аналогового входа', en='Measuring analogue input')
 
     def __init__(self):
-        super().__init__(('frequency', 'avenum', 'datanum'), ('INPOWER', 'CARRIER', 'FFT', 'ADC_I'))
+        super().__init__(('frequency', 'avenum', 'datanum', 'captures'), ('INPOWER', 'CARRIER', 'FFT', 'ADC_I'))
         self.buffer0 = None
         self.buffer = None
+        self.__refPower = None  # input power [dBm] of the last full measurement
+        self.__dmgain = None  # demodulator gain set for refPower
+        self.__pllOffset = 0  # offset of the PLL frequency set last by the previous measurement
 
     def init_meas(self, **kwargs):
         super().init_meas(**kwargs)
         self.buffer0 = None
         self.buffer = None
+        self.__refPower = self.__dmgain = None
+        self.__pllOffset = 0
         if self.failed:
             return self
 
         try:
-            self.com.command('SET MEASST', 1)
-            self.com.command('SET MOD', 0)
+            self.com.batch([('SET MEASST', 1),
+                            ('SET MOD', 0)])
         except DTComError as exc:
             self.set_com_error(exc)
             return self
 
-        # preparing Blackman window
-        N = int(self.parameters['datanum']) - 2
-        self.bwin = blackman(N)
-        self.bwin /= np.sqrt(sum(self.bwin**2)/N)
-
         self.inited = True
         return self
 
@@ -582,35 +613,48 @@ class DTMeasureInput(DTMeasurePower):
         DTTask.measure(self)
         try:
             self.com.command('SET RF_PATH', 1)
-            self.results['INPOWER'] = inpwr = self.measurePower()[1]
+            self.results['INPOWER'] = inpwr = self.__input_power()
 
-            dmgain = self.getDemodGain(inpwr)
+            dmgain = self.__dmgain
             if DEBUG:
                 print(f'DTMeasureInput: Input power {inpwr:.2f} dBm, set demodulator gain {dmgain:d}')
-            self.com.command('SET DEMOD', [1, dmgain])
-
-            self.com.command('SET RF_PATH', 0)
-            isset = self.com.set_pll_freq(2, int(self.parameters['frequency']))
-            if not isset:
-                self.set_pll_error()
-                return self
+            self.com.batch([('SET DEMOD', [1, dmgain]),
+                            ('SET RF_PATH', 0)])
 
             N = int(self.parameters['datanum'])
-            # reading ADC data 1st time
-            self.buffer0 = self.com.command('GET ADC DAT', [1, N], nreply=N)
-
-            isset = self.com.set_pll_freq(2, int(self.parameters['frequency'] + self.nominalCarrierOffset))
-            if not isset:
-                self.set_pll_error()
-                return self
+            if self.__captures() == 1:
+                isset = self.com.set_pll_freq(2, int(self.parameters['frequency'] + self.nominalCarrierOffset))
+                if not isset:
+                    self.set_pll_error()
+                    return self
 
-            # reading ADC data 2nd time
-            self.buffer = self.com.command('GET ADC DAT', [1, N], nreply=N)
+                # reading I and Q halves of ADC data
+                self.buffer0 = None
+                self.buffer = self.com.command('GET ADC DAT', [2, 2*N], nreply=2*N)
+            else:
+                offsets = (0, self.nominalCarrierOffset)
+                if self.repeatedMode and self.__pllOffset != 0:
+                    offsets = offsets[::-1]
+                buffers = dict()
+                for offset in offsets:
+                    isset = self.com.set_pll_freq(2, int(self.parameters['frequency'] + offset))
+                    if not isset:
+                        self.__pllOffset = 0
+                        self.set_pll_error()
+                        return self
+
+                    # reading ADC data for the PLL frequency with the offset
+                    buffers[offset] = self.com.command('GET ADC DAT', [1, N], nreply=N)
+                self.__pllOffset = offsets[-1]
+                self.buffer0, self.buffer = buffers[0], buffers[self.nominalCarrierOffset]
         except DTComError as exc:
             self.set_com_error(exc)
             return self
 
-        cfreq = self.__eval_carrier_freq()
+        if self.__captures() == 1:
+            cfreq = self.__eval_carrier_freq_iq()
+        else:
+            cfreq = self.__eval_carrier_freq()
         if self.failed:
             return self
 
@@ -635,26 +679,30 @@ class DTMeasureInput(DTMeasurePower):
         self.results['ADC_I'] = It0 - hfAdcRange
         It0 -= np.mean(It0)
         # FFT for nominal PLL frequency
-        a0 = 2/N*np.abs(rfft(self.bwin*It0))
+        a0 = amplitude(It0)
         self.results['FFT'] = 20*np.log10(a0/np.max(a0))  # dB
 
         # convert data to float64 and subtract DC component
         It = self.buffer[1:N+1] * (2 * hfAdcRange / adcCountRange)
         It -= np.mean(It)
         # FFT for PLL frequency with offset
-        aoff = 2/N*np.abs(rfft(self.bwin*It))
+        aoff = amplitude(It)
 
-        p0, f0 = get_peak(a0, 0, len(a0)-1)
-        poff, foff = get_peak(aoff, 0, len(aoff)-1)
+        p0, f0 = get_peak(a0, 0, len(a0)-1, strict=False)
+        poff, foff = get_peak(aoff, 0, len(aoff)-1, strict=False)
 
         if DEBUG:
-            print(f'Unshited carrier: signal RMS {It0.std():7.3g} V, amplitude of main harmonics {np.sqrt(p0):7.3g} V' +
-                  f', peak-peak {np.max(It0)-np.min(It0):7.3g} V')
+            print(f'Unshited carrier: signal RMS {It0.std():7.3g} V' +
+                  f', amplitude of main harmonics {np.sqrt(p0 or 0.):7.3g} V, peak-peak {np.max(It0)-np.min(It0):7.3g} V')
             print(f'{self.nominalCarrierOffset/kHz}-kHz shifted carrier: signal RMS {It.std():7.3g} V' +
-                  f', amplitude of main harmonics {np.sqrt(poff):7.3g} V, peak-peak {np.max(It)-np.min(It):7.3g} V')
-
-        if It0.std() < self.minSignalRMS or It.std() < self.minSignalRMS or\
-           p0 is None or p0 == 0 or poff is None or poff == 0:
+                  f', amplitude of main harmonics {np.sqrt(poff or 0.):7.3g} V, peak-peak {np.max(It)-np.min(It):7.3g} V')
+
+        # a carrier at the PLL frequency of one capture is removed with the DC component, but the other one has it
+        if It0.std() < self.minSignalRMS or not p0:
+            p0, f0 = 0., 0.
+        if It.std() < self.minSignalRMS or not poff:
+            poff, foff = 0., 0.
+        if p0 == 0 and poff == 0:
             self.set_message('Сигнал несущей не обнаружен' if dtg.LANG == 'ru' else 'No carrier signal')
             return None
 
@@ -663,6 +711,14 @@ class DTMeasureInput(DTMeasurePower):
         F = self.parameters['frequency']
         dF = self.nominalCarrierOffset
 
+        # The peak of a carrier within a few bins of the PLL frequency is distorted by its image or removed
+        # with the DC component. The other capture alone gives the offset then, its sign is known.
+        dcWidth = self.dcBins/N*adcSampleFrequency
+        if f0 < dcWidth or p0 < self.dcPowerRatio*poff:
+            return F + dF - foff
+        if foff < dcWidth or poff < self.dcPowerRatio*p0:
+            return F + f0
+
         if f0 < foff >= dF:
             return F - 0.5*(f0+foff-dF)
         elif f0 <= dF > foff:
@@ -674,6 +730,70 @@ class DTMeasureInput(DTMeasurePower):
                              else 'Error in evaluating carrier frequency')
             return None
 
+    def __captures(self):
+        return int(self.parameters.get('captures', dtParameterDesc['captures']['default']))
+
+    def __input_power(self):
+        """ Return input power [dBm] and set the demodulator gain for it. In repeated measurements the last
+            measured power is returned if the power measured with driftAvenum samples has not drifted from it.
+        """
+        if self.repeatedMode and self.__refPower is not None:
+            inpwr = self.measurePower(self.driftAvenum)[1]
+            if abs(inpwr - self.__refPower) <= self.powerDriftThreshold:
+                return self.__refPower
+            if DEBUG:
+                print(f'DTMeasureInput: Input power drifted by {inpwr - self.__refPower:.2f} dB')
+
+        self.__refPower = self.measurePower()[1]
+        self.__dmgain = self.getDemodGain(self.__refPower)
+        return self.__refPower
+
+    def __eval_carrier_freq_iq(self):
+        global hfAdcRange, adcCountRange, adcSampleFrequency
+        if self.buffer is None or self.buffer.size != 2*self.parameters['datanum']:
+            self.set_eval_error('Ошибка размера буффера' if dtg.LANG == 'ru'
+                                else 'Inconsistent data buffer size')
+            return None
+
+        N = int(self.parameters['datanum']) - 2
+
+        # convert data to volts and subtract DC component, omit first and last points of the halves
+        It = self.buffer[1:N+1] * (2 * hfAdcRange / adcCountRange)
+        self.results['ADC_I'] = It - hfAdcRange
+        It -= np.mean(It)
+        Qt = self.buffer[N+3:2*N+3] * (2 * hfAdcRange / adcCountRange)
+        Qt -= np.mean(Qt)
+
+        a0 = amplitude(It)
+        self.results['FFT'] = 20*np.log10(a0/np.max(a0))  # dB
+
+        if DEBUG:
+            print(f'DTMeasureInput: I-signal RMS {It.std():7.3g} V, Q-signal RMS {Qt.std():7.3g} V')
+
+        if It.std() < self.minSignalRMS or Qt.std() < self.minSignalRMS:
+            self.set_message('Сигнал несущей не обнаружен' if dtg.LANG == 'ru' else 'No carrier signal')
+            return None
+
+        # complex spectrum without window, the interpolation below is derived for the rectangular one
+        zf = spectrum_iq(It, Qt, None)
+        k = int(np.argmax(np.abs(zf)))
+        zm, z0, zp = zf[k-1], zf[k], zf[(k+1) % N]
+        denom = 2*z0 - zm - zp
+        if denom == 0:
+            self.set_message('Ошибка в вычислении несущей частоты' if dtg.LANG == 'ru'
+                             else 'Error in evaluating carrier frequency')
+            return None
+        # Jacobsen's estimator with Candan's bias correction
+        delta = np.tan(np.pi/N)/(np.pi/N) * ((zm - zp)/denom).real
+        if k > N//2:
+            k -= N
+        foff = self.quadratureSign*(k + delta)/N*adcSampleFrequency  # Hz
+
+        if DEBUG:
+            print(f'DTMeasureInput: peak at bin {k}{delta:+.3f}, carrier offset {foff:.1f} Hz from the shifted PLL')
+
+        return self.parameters['frequency'] + self.nominalCarrierOffset + foff
+
 
 class DTCalibrateDemodGain(DTMeasurePower):
     """
@@ -693,17 +813,12 @@ class DTCalibrateDemodGain(DTMeasurePower):
             return self
 
         try:
-            self.com.command('SET MEASST', 1)
-            self.com.command('SET MOD', 0)
+            self.com.batch([('SET MEASST', 1),
+                            ('SET MOD', 0)])
         except DTComError as exc:
             self.set_com_error(exc)
             return self
 
-        # preparing Blackman window
-        N = int(self.parameters['datanum']) - 2
-        self.bwin = blackman(N)
-        self.bwin /= np.sqrt(sum(self.bwin**2)/N)
-
         self.inited = True
         return self
 
@@ -716,9 +831,8 @@ class DTCalibrateDemodGain(DTMeasurePower):
             if DEBUG:
                 print(f'DTCalibrateDemodGain: Input power {self.results["INPOWER"]:.1f} dBm')
 
-            self.com.command('SET RF_PATH', 0)
-
-            self.com.command('SET DEMOD', [1, int(self.parameters['demodgain'])])
+            self.com.batch([('SET RF_PATH', 0),
+                            ('SET DEMOD', [1, int(self.parameters['demodgain'])])])
 
             isset = self.com.set_pll_freq(2, int(self.parameters['frequency']))
             if not isset:
@@ -747,12 +861,12 @@ class DTCalibrateDemodGain(DTMeasurePower):
         self.results['ADC_I'] = It0 - hfAdcRange
         It0 -= np.mean(It0)
         # FFT for nominal PLL frequency
-        af = 2/N*np.abs(rfft(self.bwin*It0))
+        af = amplitude(It0)
         af /= np.max(af)
         self.results['FFT'] = 20*np.log10(af)  # dB
 
         # find main harmonic power and frequency
-        p1, f1 = get_peak(af, 0, len(af)-1)
+        p1, f1 = get_peak(af, 0, len(af)-1, strict=False)
 
         if f1 is None:
             self.set_message('Сигнал несущей не обнаружен' if dtg.LANG == 'ru' else 'No carrier signal')
@@ -771,6 +885,8 @@ class DTMeasureNonlinearity(DTMeasurePower):
     name = dict(ru='Измерение КНИ', en='INL measurement')
 
     minSignalRMS = 0.001  # [V]
+    # I/Q spectrum: 'complex' - one complex FFT of I+jQ split into the I and Q parts, 'real' - two real FFTs
+    spectrumMode = 'complex'
 
     def __init__(self):
         super().__init__(('frequency', 'modamp', 'modfrequency', 'datanum'),
@@ -784,17 +900,12 @@ class DTMeasureNonlinearity(DTMeasurePower):
         macode = int(self.parameters['modamp']*0xFFFF)
         mfcode = int(self.parameters['modfrequency']/(120*kHz)*(1 << 16)+0.5)
 
-        # preparing Blackman window
-        N = int(self.parameters['datanum']) - 2
-        self.bwin = blackman(N)
-        self.bwin /= np.sqrt(sum(self.bwin**2)/N)
-
         if DEBUG:
             print(f'DTMeasureNonlinearity: LF amp. code {macode}, LF freq. code {mfcode}')
 
         try:
-            self.com.command('SET MOD', 0)
-            self.com.command('SET MEASST', 2)
+            self.com.batch([('SET MOD', 0),
+                            ('SET MEASST', 2)])
             isset = self.com.set_pll_freq(2, int(self.parameters['frequency']))
             if not isset:
                 self.set_pll_error()
@@ -817,10 +928,9 @@ class DTMeasureNonlinearity(DTMeasurePower):
             dmgain = self.getDemodGain(inpwr)
             if DEBUG:
                 print(f'DTMeasureNonlinearity: Input power {inpwr:.2f} dBm, set demodulator gain {dmgain:d}')
-            self.com.command('SET DEMOD', [1, dmgain])
-
             # reading ADC data
-            self.com.command('SET RF_PATH', 0)
+            self.com.batch([('SET DEMOD', [1, dmgain]),
+                            ('SET RF_PATH', 0)])
             datanum = int(self.parameters['datanum'])
             self.buffer = self.com.command('GET ADC DAT', [2, 2*datanum], nreply=2*datanum)
         except DTComError as exc:
@@ -850,7 +960,7 @@ class DTMeasureNonlinearity(DTMeasurePower):
         It = self.buffer[1:N+1] * (2 * hfAdcRange / adcCountRange)  # take first half of the buffer as the I input
         self.results['ADC_I'] = It - hfAdcRange
         It -= np.mean(It)
-        Qt = self.buffer[N+2:] * (2 * hfAdcRange / adcCountRange)  # take second half of the buffer as the Q input
+        Qt = self.buffer[N+3:2*N+3] * (2 * hfAdcRange / adcCountRange)  # take second half of the buffer as the Q input
         self.results['ADC_Q'] = Qt - hfAdcRange
         Qt -= np.mean(Qt)
 
@@ -862,9 +972,12 @@ class DTMeasureNonlinearity(DTMeasurePower):
             print(f'DTMeasureNonlinearity: I-signal RMS {It.std():7.3g} V, Q-signal RMS {Qt.std():7.3g} V')
 
         # Compute FFT (non-negative frequencies only)
-        If = 2/N*np.abs(rfft(self.bwin*It))
-        Qf = 2/N*np.abs(rfft(self.bwin*Qt))
-        Af = np.sqrt(If**2 + Qf**2)
+        if self.spectrumMode == 'complex':
+            Af = amplitude_iq(It, Qt)
+        else:
+            If = amplitude(It)
+            Qf = amplitude(Qt)
+            Af = np.sqrt(If**2 + Qf**2)
 
         self.results['FFT'] = 20*np.log10(Af/np.max(Af))  # dB
 
@@ -883,9 +996,11 @@ class DTDMRInput(DTTask):
     refFreq = np.array([symbolDevFrequency, 3*symbolDevFrequency]*2)
 
     def __init__(self):
-        super().__init__(('frequency',), ('BITERR', 'ADC_I', 'ADC_Q'))
+        super().__init__(('frequency',), ('BITERR', 'BITERRSUM', 'ADC_I', 'ADC_Q'))
 
         self.bufsize = 32768  # both for I and Q channels
+        self.berstream = None  # BER accumulated over the captures since init_meas(), created in the device process
+        self.bertotal = (0, 0)  # accumulated numbers of error and total bits before the last capture
 
     def init_meas(self, **kwargs):
         super().init_meas(**kwargs)
@@ -893,10 +1008,10 @@ class DTDMRInput(DTTask):
             return self
 
         try:
-            self.com.command('SET MEASST', 1)
-            self.com.command('SET RF_PATH', 0)
-            self.com.command('SET MOD', 0)
-            self.com.command('SET DEMOD', [1, 20])
+            self.com.batch([('SET MEASST', 1),
+                            ('SET RF_PATH', 0),
+                            ('SET MOD', 0),
+                            ('SET DEMOD', [1, 20])])
             isset = self.com.set_pll_freq(2, int(self.parameters['frequency']))
             if not isset:
                 self.set_pll_error()
@@ -905,6 +1020,11 @@ class DTDMRInput(DTTask):
             self.set_com_error(exc)
             return self
 
+        if self.berstream is None:
+            self.berstream = DTBerStream()
+        self.berstream.reset()
+        self.bertotal = (0, 0)
+
         self.inited = True
         return self
 
@@ -927,7 +1047,9 @@ class DTDMRInput(DTTask):
             self.set_eval_error()
             return self
 
-        self.results['BITERR'] = res  # bit errors, %
+        self.results['BITERR'] = res  # bit errors of the capture, %
+        numerr, numbit = self.bertotal
+        self.results['BITERRSUM'] = numerr/numbit  # bit errors of all captures since init_meas(), %
 
         self.set_success()
 
@@ -940,7 +1062,8 @@ class DTDMRInput(DTTask):
 
     def __dmr_analysis(self, debug=False):
         """ Do analysis of a random symbol sequence sent by the device.
-            Calculate BER.
+            Calculate BER of the capture. The bits are also accumulated over the captures since init_meas()
+            in self.bertotal. Captures are separated by gaps, so the symbol timing is acquired in each of them.
         """
         global hfAdcRange, adcCountRange
         if self.buffer is None or len(self.buffer) != self.bufsize:
@@ -957,17 +1080,24 @@ class DTDMRInput(DTTask):
         It = np.around(It-np.mean(It)).astype('int32')
         Qt = np.around(Qt-np.mean(Qt)).astype('int32')
 
-        # find the bit error rate and constant symbol intervals
-        maxlen = 20*200  # max length of returned Iref, Qref
-        numerr, numbit, Iref, Qref, symlenref = get_ber(It, Qt, maxlen)
+        # accumulate the bit error rate
+        if self.berstream is None:
+            self.berstream = DTBerStream()
+        self.berstream.add(It, Qt)
+        numerr, numbit = self.berstream.result()
+        prevnumerr, prevnumbit = self.bertotal
 
-        if numerr is None or numbit is None:
+        if numbit == prevnumbit:
             self.set_eval_error(f'Too small data length - {len(self.buffer)}')
             return None
 
-        ber = numerr/numbit
+        self.bertotal = (numerr, numbit)
 
-        return ber
+        if DEBUG:
+            print(f'Capture bits: {numbit-prevnumbit}, error bits: {numerr-prevnumerr}, ' +
+                  f'accumulated BER: {100*numerr/numbit:.2g}%')
+
+        return (numerr-prevnumerr)/(numbit-prevnumbit)
 
 
 class DTDMROutput(DTTask):
@@ -1022,15 +1152,10 @@ class DTMeasureSensitivity(DTTask):
         if self.failed:
             return self
 
-        N = int(self.parameters['datanum']) - 2
-        self.bwin = blackman(N)
-        self.bwin /= np.sqrt(sum(self.bwin**2)/N)
-
         try:
-            self.com.command('SET MEASST', 4)
-
             # set DAC to 80% of maximum amplitude and zero frequency
-            self.com.command('SET LFDAC', [52400, int(3000/120/kHz*65536)], owordsize=[2, 4])
+            self.com.batch([('SET MEASST', 4),
+                            ('SET LFDAC', [52400, int(3000/120/kHz*65536)], [2, 4])])
 
             isset = self.com.set_pll_freq(1, int(self.parameters['frequency'] + self.parameters['modfrequency']))
             if not isset:
@@ -1180,7 +1305,7 @@ class DTMeasureSensitivity(DTTask):
         It -= np.mean(It)
 
         # Compute FFT (non-negative frequencies only)
-        af = 2/N*np.abs(rfft(self.bwin*It))
+        af = amplitude(It)
 
         self.results['FFT'] = 20*np.log10(af/np.max(af))  # dB
 
@@ -1207,23 +1332,16 @@ class DTMeasureDAC(DTTask):
         if self.failed:
             return self
 
-        N = int(self.parameters['datanum']) - 2
-        self.bwin = blackman(N)
-        self.bwin /= np.sqrt(sum(self.bwin**2)/N)
-
         macode = int(self.parameters['modamp']*0xFFFF)
         mfcode = int(self.parameters['modfrequency']/(120*kHz)*(1 << 16)+0.5)
         self.bufsize = int(self.parameters['datanum'])
         self.adccode = int(np.argmin(np.abs(np.array(lfAdcVoltRanges)-self.parameters['adcrange'])))
 
         try:
-            self.com.command('SET MEASST', 4)
-
-            # set DAC to 80% of maximum amplitude and zero frequency
-            self.com.command('SET LFDAC', [macode, mfcode], owordsize=[2, 4])
-
-            # set LF ADC range
-            self.com.command("SET LF RANGE", self.adccode)
+            # set DAC amplitude and frequency, set LF ADC range
+            self.com.batch([('SET MEASST', 4),
+                            ('SET LFDAC', [macode, mfcode], [2, 4]),
+                            ('SET LF RANGE', self.adccode)])
         except DTComError as exc:
             self.set_com_error(exc)
             return self
@@ -1271,7 +1389,7 @@ class DTMeasureDAC(DTTask):
         It -= np.mean(It)
 
         # Compute FFT (non-negative frequencies only)
-        af = 2/N*np.abs(rfft(self.bwin*It))
+        af = amplitude(It)
 
         self.results['FFT'] = 20*np.log10(af/np.max(af))  # dB
 
@@ -1385,10 +1503,7 @@ class DTDMRInputModel(DTTask):
         maxlen = 20*200  # max length of returned Iref, Qref
         numerr, numbit, Iref, Qref, symlenref = get_ber(It, Qt, maxlen)
 
-        N = It.size
-        bwin = blackman(N)
-        bwin /= np.sqrt(sum(bwin**2)/N)
-        af = 2/N*np.abs(rfft(bwin*It))
+        af = amplitude(It)
 
         self.results['FFT'] = 20*np.log10(af/np.max(af))
 
@@ -1401,9 +1516,6 @@ class DTDMRInputModel(DTTask):
         if DEBUG:
             print(f'Total bits: {numbit}, error bits: {numerr}, BER: {100*ber:.1f}%')
 
-        pwr = np.zeros(4, float)
-        fpeak = np.zeros(4, float)
-
         If = [None]*4
         Qf = [None]*4
         Af = [None]*4
@@ -1413,18 +1525,18 @@ class DTDMRInputModel(DTTask):
         for i in range(4):
             iend += symlenref[i]
             symintervals.append((istart, iend))
-            # preparing Blackman window
-            bwin = blackman(symlenref[i])
-            bwin /= np.sqrt(sum(bwin**2)/symlenref[i])
             iref, qref = Iref[istart:iend], Qref[istart:iend]
-            If[i] = 2/symlenref[i]*np.abs(rfft(iref))
-            Qf[i] = 2/symlenref[i]*np.abs(rfft(qref))
+            If[i] = amplitude(iref, None)
+            Qf[i] = amplitude(qref, None)
             istart = iend
 
             Af[i] = np.sqrt(If[i]**2 + Qf[i]**2)
-            fmin, fmax = 0, 5
-            pwr[i], fpeak[i] = get_peak(Af[i], fmin, fmax)
-            fpeak[i] *= adcSampleFrequency/symlenref[i]  # convert to Hz
+
+        fmin, fmax = 0, 5
+        # the peak of a short symbol spectrum is wider than the search range, do not reject it
+        pwr, fpeak = get_peaks(Af, fmin, fmax, strict=False)
+        # convert to Hz, NaN for the symbols without a reference interval
+        fpeak *= np.divide(adcSampleFrequency, symlenref[:4], out=np.full(4, np.nan), where=symlenref[:4] > 0)
 
         fdev = np.abs(fpeak-self.refFreq)
         ampf = np.sqrt(pwr)
@@ -1528,6 +1640,16 @@ class DTScenario:
             del instance
 
 
+def dtFftLengths():
+    """Return set of the FFT lengths of the tasks for the default and the scenario values of datanum"""
+    lengths = {int(dtParameterDesc['datanum']['default']) - 2}
+    for scenario in (dtAllScenarios or dict()).values():
+        for task in scenario.tasks:
+            if task.parameters.get('datanum'):
+                lengths.add(int(task.parameters['datanum']) - 2)
+    return lengths
+
+
 def dtTaskInit():
     global dtTaskTypes, dtTaskTypeDict, dtAllScenarios
     dtTaskTypes = list()
@@ -0,0 +1,95 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "dtber.h"
+
+typedef int (*bercalc_t)(const int *, const int *, int, int *, int *, int *, int *, int *, int);
+
+static int *readdata(const char *fn, int *size)
+{
+	FILE *f = fopen(fn, "r");
+	if (!f) {
+		perror(fn);
+		return NULL;
+	}
+	int n = 0, cap = 65536, v;
+	int *data = malloc(cap*sizeof(int));
+	while (fscanf(f, "%d", &v) == 1) {
+		if (n == cap) data = realloc(data, (cap *= 2)*sizeof(int));
+		data[n++] = v;
+	}
+	fclose(f);
+	*size = n;
+	return data;
+}
+
+static double now()
+{
+	struct timespec ts;
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec + 1e-9*ts.tv_nsec;
+}
+
+//run the function repeatedly for at least 1 s, return samples per second
+static double bench(bercalc_t calc, const int *I, const int *Q, int size, int *numerr, int *numbit,
+                    int *Is, int *Qs, int *symlen, int maxlen)
+{
+	int ncalls = 0;
+	double start = now(), elapsed;
+	do {
+		calc(I, Q, size, numerr, numbit, Is, Qs, symlen, maxlen);
+		ncalls++;
+	} while ((elapsed = now()-start) < 1);
+	return (double)ncalls*size/elapsed;
+}
+
+int main(int argc, char *argv[])
+{
+	const char *ifn = argc > 2 ? argv[1] : "Idmr_long.txt";
+	const char *qfn = argc > 2 ? argv[2] : "Qdmr_long.txt";
+	int isize, qsize;
+	int *I = readdata(ifn, &isize), *Q = readdata(qfn, &qsize);
+	if (!I || !Q) {
+		printf("Usage: %s [Ifile Qfile]\n\n\tIfile, Qfile - I and Q samples, Idmr_long.txt and Qdmr_long.txt by default\n", argv[0]);
+		return 1;
+	}
+	int size = isize < qsize ? isize : qsize;
+	printf("%d samples read from %s and %s\n", size, ifn, qfn);
+
+	const int maxlen = 20*200;
+	int Is[2][maxlen], Qs[2][maxlen], symlen[2][4], numerr[2], numbit[2];
+	memset(Is, 0, sizeof(Is));
+	memset(Qs, 0, sizeof(Qs));
+	bercalc_t calcs[2] = {bercalc_ref, bercalc};
+	const char *names[2] = {"bercalc_ref", "bercalc"};
+	double rate[2];
+
+	for (int k=0; k<2; k++) {
+		rate[k] = bench(calcs[k], I, Q, size, numerr+k, numbit+k, Is[k], Qs[k], symlen[k], maxlen);
+		printf("%-12s %d/%d bits, symbols %d %d %d %d: %.3g samples/s\n", names[k], numerr[k], numbit[k],
+		       symlen[k][0], symlen[k][1], symlen[k][2], symlen[k][3], rate[k]);
+	}
+
+	int same = numerr[0] == numerr[1] && numbit[0] == numbit[1] && memcmp(symlen[0], symlen[1], sizeof(symlen[0])) == 0 &&
+	           memcmp(Is[0], Is[1], sizeof(Is[0])) == 0 && memcmp(Qs[0], Qs[1], sizeof(Qs[0])) == 0;
+	printf("Results are %s, speedup %.2f\n", same ? "identical" : "DIFFERENT", rate[1]/rate[0]);
+
+	//the same data split into contiguous captures must give the same counts
+	const int chunk = 4096;
+	long long serr, sbit;
+	berstream *s = berstream_open();
+	for (int k=0; k<size; k+=chunk)
+		berstream_add(s, I+k, Q+k, size-k < chunk ? size-k : chunk, k > 0);
+	berstream_result(s, &serr, &sbit);
+	berstream_close(s);
+	int samestream = serr == numerr[1] && sbit == numbit[1];
+	printf("berstream    %lld/%lld bits in captures of %d samples: %s\n", serr, sbit, chunk,
+	       samestream ? "identical" : "DIFFERENT");
+	same = same && samestream;
+
+	free(I);
+	free(Q);
+	return !same;
+}
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""
+Capture a measurement of DTMeasureInput on the device emulator started after a warm-up measurement (as with
+the capture command of DTProcess in the middle of a session) and replay the capture on a fresh DTSerialCom
+instance. The replayed results must repeat the captured ones and the whole capture must be consumed.
+The replay port is opened with a relative file name. Its instance must be released by that name, by the port
+object and by the instance itself, closing the port and leaving no instance in the DTSerialCom registry.
+"""
+
+import os
+import argparse
+import tempfile
+import numpy as np
+
+import tasks
+from dtemul import DTDeviceEmulator
+from dtcom import DTSerialCom
+from dtcapture import DTReplayPort
+from dtglobals import kHz, MHz
+
+
+def run_task(frequency):
+    task = tasks.DTMeasureInput()
+    task.init_meas(frequency=frequency)
+    if not task.failed:
+        task.measure()
+    if task.failed:
+        raise SystemExit(f'{type(task).__name__} failed: {task.message}')
+    return task.results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a capture started after a warm-up measurement.')
+    parser.add_argument('-f', '--frequency', type=float, default=150, help='nominal carrier frequency [MHz]')
+    args = parser.parse_args()
+
+    frequency = int(args.frequency*MHz)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'session.cap')
+
+        with DTDeviceEmulator(carrier=frequency+2*kHz, power=(1500, 1500)) as emu:
+            DTSerialCom.default_device = emu.device
+            com = DTSerialCom()
+            run_task(frequency)  # warm-up: device state and PLL frequencies are shadowed after it
+            com.capture(filename)
+            captured = run_task(frequency)
+            com.capture(None)
+            DTSerialCom.release()
+
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        port = DTReplayPort('session.cap')
+        DTSerialCom.default_device = DTSerialCom(port=port).device
+        replayed = run_task(frequency)
+        DTSerialCom.default_device = None
+
+        released = dict()
+        for by in ('name', 'port', 'instance'):
+            releaseport = port if by == 'name' else DTReplayPort('session.cap')
+            instance = DTSerialCom(port=releaseport)
+            DTSerialCom.release({'name': 'session.cap', 'port': releaseport, 'instance': instance}[by])
+            released[by] = DTSerialCom.instance(releaseport) is None and not releaseport.is_open
+        os.chdir(cwd)
+
+    print(f'{port.position} of {port.nrecords} captured records replayed')
+    print(f'{"result":<12}{"captured":>20}{"replayed":>20}')
+    same = port.position == port.nrecords
+    for name in captured:
+        same = same and np.array_equal(captured[name], replayed[name])
+        if np.ndim(captured[name]) == 0:
+            print(f'{name:<12}{captured[name]!s:>20}{replayed[name]!s:>20}')
+    print('Replay', 'repeats the capture' if same else 'DIFFERS from the capture')
+    for by, ok in released.items():
+        print(f'Release of the replay port by {by}:', 'done' if ok else 'FAILED')
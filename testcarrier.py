@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""
+Compare the carrier frequency measurements of DTMeasureInput on the device emulator: two captures of I signal
+with the shifted demodulator PLL (captures=2) and one capture of I and Q signals (captures=1), the former also
+without the alternating capture order and the reuse of the input power of repeated measurements (repeatedMode).
+Errors of the measured carrier frequency and times per measurement are printed for carrier offsets near 0 Hz
+(a well-tuned radio) and for random ones.
+"""
+
+import argparse
+import time
+import numpy as np
+
+import tasks
+import dtcom
+from dtemul import DTDeviceEmulator
+from dtglobals import kHz, MHz
+
+
+def run(emu, captures, repeated, offsets, frequency, datanum):
+    task = tasks.DTMeasureInput()
+    task.repeatedMode = repeated
+    task.init_meas(frequency=frequency, datanum=datanum, captures=captures)
+    if task.failed:
+        raise SystemExit(f'init_meas() failed: {task.message}')
+    errors = []
+    start = time.perf_counter()
+    for offset in offsets:
+        emu.carrier = frequency + offset
+        task.measure()
+        if task.failed or task.results['CARRIER'] is None:
+            errors.append(np.nan)
+        else:
+            errors.append(task.results['CARRIER'] - emu.carrier)
+    return np.array(errors), (time.perf_counter() - start)/len(offsets)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare carrier frequency measurements with one and two captures.')
+    parser.add_argument('-n', '--number', type=int, default=20, help='number of random offsets per noise level')
+    parser.add_argument('-N', '--datanum', type=int, default=16384, help='number of ADC samples')
+    parser.add_argument('-f', '--frequency', type=float, default=150, help='nominal carrier frequency [MHz]')
+    parser.add_argument('-r', '--range', type=float, default=40, help='maximal carrier offset [kHz]')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    frequency = int(args.frequency*MHz)
+    nearzero = np.array([0, 1, -1, 5, -5, 20, -20])  # [Hz]
+    offsets = np.concatenate((nearzero, rng.uniform(-args.range*kHz, args.range*kHz, args.number)))
+
+    print(f'{offsets.size} measurements with carrier offsets {", ".join(str(f) for f in nearzero)} Hz and ' +
+          f'{args.number} random ones within ±{args.range} kHz, {args.datanum} ADC samples')
+    print(f'{"noise":>8}{"captures":>10}{"repeated":>10}{"failed":>8}{"mean err, Hz":>14}{"RMS err, Hz":>13}' +
+          f'{"max err, Hz":>13}{"time, ms":>10}')
+    for noise in (0.001, 0.01, 0.1):
+        with DTDeviceEmulator(carrier=frequency, amplitude=0.3, noise=noise, power=(1500, 1500)) as emu:
+            dtcom.DTSerialCom.default_device = emu.device
+            for captures, repeated in ((2, False), (2, True), (1, True)):
+                errors, period = run(emu, captures, repeated, offsets, frequency, args.datanum)
+                good = errors[~np.isnan(errors)]
+                print(f'{noise:8.3f}{captures:10d}{repeated!s:>10}{errors.size-good.size:8d}' +
+                      (f'{good.mean():14.2f}{np.sqrt(np.mean(good**2)):13.2f}{np.max(np.abs(good)):13.2f}'
+                       if good.size > 0 else f'{"":40}') + f'{period*1000:10.1f}')
+            dtcom.DTSerialCom.release()
@@ -1,7 +1,7 @@
 from dtglobals import adcSampleFrequency
 from numpy import linspace, genfromtxt, sqrt, abs
 from scipy.fft import rfft, rfftfreq
-from scipy.signal import blackman
+from scipy.signal.windows import blackman
 
 import tasks
 import matplotlib.pyplot as plt
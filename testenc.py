@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+from numbers import Integral
+from numpy.random import default_rng
+import timeit
+
+from dtcom import encode_packet
+
+
+def legacy_encode(command, odata=None, owordsize=2):
+    """Packet encoder of DTSerialCom.command() before encode_packet() was introduced"""
+    if isinstance(command, str):
+        command = bytes(command, 'utf-8')
+
+    packet = b'\0' + command + b'\0'
+
+    if isinstance(odata, bytes) or isinstance(odata, bytearray):
+        packet += bytes(odata)
+    elif isinstance(odata, Integral):
+        imask = (1 << owordsize*8)-1
+        packet += (owordsize//2).to_bytes(2, byteorder='little')
+        packet += int(odata & imask).to_bytes(owordsize, byteorder='little', signed=False)
+    elif hasattr(odata, '__getitem__') and hasattr(odata, '__len__') and len(odata) > 0:
+        if not all([isinstance(oword, Integral) for oword in odata]):
+            raise ValueError(f'Some of output data words is not integer: {odata}.')
+        if isinstance(owordsize, Integral):
+            owordsize = [owordsize]*len(odata)
+        else:
+            owordsize = list(owordsize)
+            if len(owordsize) < len(odata):
+                owordsize.extend([owordsize[-1]]*(len(odata)-len(owordsize)))
+            elif len(owordsize) > len(odata):
+                owordsize = owordsize[:len(odata)]
+        packet += (sum(owordsize)//2).to_bytes(2, byteorder='little')
+        for oword, osize in zip(odata, owordsize):
+            packet += int(oword & ((1 << osize*8)-1)).to_bytes(osize, byteorder='little', signed=False)
+    else:
+        packet += b'\0\0'
+
+    packet += b'END' + b'\0'
+    return command, packet
+
+
+if __name__ == "__main__":
+    rng = default_rng(1)
+    regs = [int(r) for r in rng.integers(0, 1 << 32, 6)]
+    lut = [int(w) for w in rng.integers(-(1 << 15), 1 << 16, 1024)]
+
+    cases = {
+        'STATUS': ('STATUS', None, 2),
+        'SET MEASST': ('SET MEASST', 1, 2),
+        'SET DEMOD': ('SET DEMOD', [1, 20], 2),
+        'SET LFDAC': ('SET LFDAC', [52400, 1638], [2, 4]),
+        'LOAD PLL': ('LOAD PLL', [2, *regs], [2]+6*[4]),
+        'GET ADC DAT': ('GET ADC DAT', (2, 32768), 2),
+        '1024 words': ('SET LUT', lut, 2),
+    }
+
+    print('Checking encode_packet() against the legacy encoder')
+    for name, args in cases.items():
+        if encode_packet(*args) != legacy_encode(*args):
+            print(f'{name}: packets differ!')
+            exit(1)
+    print('All packets are identical\n')
+
+    print(f'{"Command":<14}{"legacy, us":>12}{"encode_packet, us":>20}{"speed-up":>10}')
+    for name, args in cases.items():
+        number = 500 if hasattr(args[1], "__len__") and len(args[1]) > 100 else 20000
+        tl = timeit.timeit(lambda: legacy_encode(*args), number=number)/number
+        tn = timeit.timeit(lambda: encode_packet(*args), number=number)/number
+        print(f'{name:<14}{tl*1e6:12.2f}{tn*1e6:20.2f}{tl/tn:10.1f}')
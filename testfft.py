@@ -8,7 +8,7 @@ except ImportError:
     pyfftw = None
 from numpy.random import default_rng
 from scipy.special import jn
-from scipy.signal import blackman
+from scipy.signal.windows import blackman
 from scipy.fft import rfft, rfftfreq
 from time import time
 import matplotlib.pyplot as plt
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+"""
+Compare pyserial and native (libdmr) backends of DTSerialCom on the device emulator:
+mean latency of short commands and transfer rate of bulk replies.
+"""
+
+import time
+import argparse
+import numpy as np
+
+from dtemul import DTDeviceEmulator
+from dtcom import DTSerialCom
+
+
+def bench(backend, emu, ncalls, nwords, nbulk):
+    DTSerialCom.BACKEND = backend
+    com = DTSerialCom(device=emu.device)
+
+    com.command('STATUS', nreply=1)  # warm up
+    start = time.perf_counter()
+    for _ in range(ncalls):
+        com.command('STATUS', nreply=1)
+    latency = (time.perf_counter()-start)/ncalls
+
+    reply = None
+    start = time.perf_counter()
+    for _ in range(nbulk):
+        reply = com.command('GET ADC DAT', [1, nwords], nreply=nwords)
+    elapsed = time.perf_counter()-start
+    rate = nbulk*(2*nwords+8)/elapsed
+
+    checksum = int(reply.sum())
+    DTSerialCom.release(emu.device)
+    return latency, rate, checksum
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark DTSerialCom backends with the device emulator.')
+    parser.add_argument('-n', '--ncalls', type=int, default=2000, help='number of STATUS commands')
+    parser.add_argument('-w', '--words', type=int, default=32768, help='number of words in bulk replies')
+    parser.add_argument('-b', '--bulk', type=int, default=50, help='number of bulk replies')
+    args = parser.parse_args()
+
+    data = np.arange(args.words) % 4096
+    # fixed ADC data without the acquisition delay of the emulator, only the reply latency is left
+    payloads = {'GET ADC DAT': lambda emu, words: data[:int(words[1])]}
+
+    with DTDeviceEmulator(latency={None: 0}, payloads=payloads) as emu:
+        print(f'{"backend":<10}{"latency, us":>14}{"bulk, MB/s":>14}')
+        checksums = set()
+        for backend in ('pyserial', 'native'):
+            latency, rate, checksum = bench(backend, emu, args.ncalls, args.words, args.bulk)
+            checksums.add(checksum)
+            print(f'{backend:<10}{latency*1e6:14.1f}{rate/1e6:14.2f}')
+        print('Replies are', 'identical' if len(checksums) == 1 else 'DIFFERENT')
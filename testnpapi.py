@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+"""
+Compare the NumPy analysis (dt_np_api) with libdmr (dt_c_api): results and execution times
+of peak search and INL on the spectra of the recorded DMR signal (Idmr.txt, Qdmr.txt) and of
+generated FM signals, of BER calculation on the recorded DMR signal, the noisy and the repeated one.
+"""
+
+import argparse
+import timeit
+import numpy as np
+from scipy.special import jn
+
+import dt_c_api
+import dt_np_api
+
+
+def spectrum(samples):
+    N = samples.size
+    bwin = np.blackman(N)
+    bwin /= np.sqrt(sum(bwin**2)/N)
+    return 2/N*np.abs(np.fft.rfft(bwin*(samples - samples.mean())))
+
+
+def fm_spectra(rng, nspectra, N, fm, h, noise):
+    t = np.arange(N)
+    spectra = []
+    for _ in range(nspectra):
+        at = sum(jn(n, h)/jn(1, h)*np.sin(2*np.pi*(n*fm*t/N + rng.random())) for n in range(1, 21))
+        spectra.append(spectrum(np.floor((at + rng.normal(0, noise, N))*2**20)))
+    return spectra
+
+
+def dc_spectra(rng, nspectra, N):
+    """Spectra of a real carrier within one bin of DC, as seen by DTMeasureInput for a well-tuned radio"""
+    t = np.arange(N)
+    return [spectrum(np.floor((np.cos(2*np.pi*f*t/N + rng.random()) + rng.normal(0, 0.001, N))*2**20))
+            for f in rng.uniform(0, 1, nspectra)]
+
+
+def dmr_spectra(rng, nspectra, N):
+    spectra = []
+    for name in ('Idmr.txt', 'Qdmr.txt'):
+        data = np.loadtxt(name)
+        for start in rng.integers(0, data.size-N, nspectra//2):
+            spectra.append(spectrum(data[start:start+N]))
+    return spectra
+
+
+def compare(name, cfun, npfun, calls):
+    """Print number of differing results, maximum relative difference of the results and execution times"""
+    ndiff, maxrel = 0, 0.
+    for args in calls:
+        cres = np.atleast_1d(np.array(cfun(*args), dtype=float))
+        npres = np.atleast_1d(np.array(npfun(*args), dtype=float))
+        if not np.array_equal(np.isnan(cres), np.isnan(npres)):
+            ndiff += 1
+            continue
+        good = ~np.isnan(cres)
+        if good.any():
+            rel = np.max(np.abs(cres[good]-npres[good])/np.maximum(np.abs(cres[good]), 1e-300))
+            maxrel = max(maxrel, rel)
+            ndiff += rel > 1e-9
+    tc = timeit.timeit(lambda: [cfun(*args) for args in calls], number=3)/3/len(calls)
+    tnp = timeit.timeit(lambda: [npfun(*args) for args in calls], number=3)/3/len(calls)
+    print(f'{name:<12}{len(calls):8d}{ndiff:8d}{maxrel:12.2e}{tc*1e6:12.1f}{tnp*1e6:12.1f}{tnp/tc:10.1f}')
+
+
+def none_to_nan(fun):
+    def wrapper(*args):
+        res = fun(*args)
+        return tuple(np.nan if r is None else r for r in res) if isinstance(res, tuple) else \
+            (np.nan if res is None else res)
+    return wrapper
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare NumPy and libdmr implementations of the spectrum analysis.')
+    parser.add_argument('-n', '--nspectra', type=int, default=100, help='number of spectra of each kind')
+    parser.add_argument('-N', '--samples', type=int, default=4096, help='number of samples per spectrum')
+    args = parser.parse_args()
+
+    if dt_c_api.get_peak is dt_np_api.get_peak:
+        raise SystemExit('libdmr is not available, nothing to compare with')
+
+    rng = np.random.default_rng(1)
+    N = args.samples
+    fm = 40.3  # modulating frequency [bins]
+    fmspectra = fm_spectra(rng, args.nspectra, N, fm, 1., 0.001)
+    dmrspectra = dmr_spectra(rng, args.nspectra, N)
+
+    print('DMR signal: ' + ', '.join(f'{name} {np.loadtxt(name).size} samples' for name in ('Idmr.txt', 'Qdmr.txt')))
+    print(f'{args.nspectra} spectra of each kind, {N} samples per spectrum')
+    print(f'{"function":<12}{"calls":>8}{"differ":>8}{"max rel":>12}{"C, us":>12}{"NumPy, us":>12}{"ratio":>10}')
+
+    dcspectra = dc_spectra(rng, args.nspectra, N)
+    calls = [(amp, lo, lo+hi, strict) for amp in fmspectra + dmrspectra
+             for lo, hi in ((int(0.9*fm), int(0.2*fm)), (0, 200), (100, 1000)) for strict in (False, True)]
+    calls += [(amp, 0, amp.size-1, strict) for amp in dcspectra for strict in (False, True)]
+    compare('get_peak', none_to_nan(dt_c_api.get_peak), none_to_nan(dt_np_api.get_peak), calls)
+    calls = [(amp, fm) for amp in fmspectra] + [(amp, f) for amp in dmrspectra for f in (20., 55.)]
+    compare('get_inl_fm', none_to_nan(dt_c_api.get_inl_fm), none_to_nan(dt_np_api.get_inl_fm), calls)
+    compare('get_inl', none_to_nan(dt_c_api.get_inl), none_to_nan(dt_np_api.get_inl), calls)
+    calls = [(np.array(fmspectra + dmrspectra), 0, 200)]
+    compare('get_peaks', dt_c_api.get_peaks, dt_np_api.get_peaks, calls)
+    calls = [(np.array(fmspectra), fm)]
+    compare('get_inls_fm', dt_c_api.get_inls_fm, dt_np_api.get_inls_fm, calls)
+    compare('get_inls', dt_c_api.get_inls, dt_np_api.get_inls, calls)
+
+    # full-spectrum searches of the tasks are not strict: a carrier at DC touches the edge of the range
+    for name, api in (('C', dt_c_api), ('NumPy', dt_np_api)):
+        nfound = sum(api.get_peak(amp, 0, amp.size-1, False)[0] is not None for amp in dcspectra)
+        print(f'{name}: peaks of carrier within 1 bin of DC found in {nfound} of {len(dcspectra)} spectra' +
+              ('' if nfound == len(dcspectra) else '  FAILED'))
+
+    print('\nBER of DMR signal')
+    print(f'{"data":<16}{"samples":>8}{"C numerr/numbit":>18}{"NumPy numerr/numbit":>22}{"C, ms":>10}{"NumPy, ms":>12}')
+    for name in ('dmr', 'dmr_long'):
+        It, Qt = np.loadtxt(f'I{name}.txt', dtype='int32'), np.loadtxt(f'Q{name}.txt', dtype='int32')
+        rms = It.std()
+        for label, I, Q in ((name, It, Qt),
+                            (name + ' noisy', (It + rng.normal(0, 0.3*rms, It.size)).astype('int32'),
+                             (Qt + rng.normal(0, 0.3*rms, Qt.size)).astype('int32')),
+                            (name + ' x10', np.tile(It, 10), np.tile(Qt, 10))):
+            cres, npres = dt_c_api.get_ber(I, Q, 4000), dt_np_api.get_ber(I, Q, 4000)
+            same = cres[:2] == npres[:2] and np.array_equal(cres[4], npres[4]) and np.array_equal(cres[2], npres[2])
+            tc = timeit.timeit(lambda: dt_c_api.get_ber(I, Q, 4000), number=3)/3
+            tnp = timeit.timeit(lambda: dt_np_api.get_ber(I, Q, 4000), number=3)/3
+            print(f'{label:<16}{I.size:8d}{cres[0]:>11d}/{cres[1]:<6d}{npres[0]:>15d}/{npres[1]:<6d}' +
+                  f'{tc*1e3:10.2f}{tnp*1e3:12.2f}' + ('' if same else '  results differ'))
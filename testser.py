@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 from dtcom import DTSerialCom
+from dtcapture import DTReplayPort
 import argparse
 
 parser = argparse.ArgumentParser(description='Communicate with a DMR TEST device.')
@@ -8,6 +9,14 @@ parser.add_argument('command', type=str,
                     help='command to send')
 parser.add_argument('data', metavar='dataword', type=int, nargs='*',
                     help='integer data words to send', default=[])
+parser.add_argument('-d', '--device', metavar='PATH', type=str, default=None,
+                    help='device file to open (e.g. pseudo-terminal of dtemul.py), default is the first STM32 device')
+parser.add_argument('--capture', metavar='FILE', type=str, default=None,
+                    help='append the request and reply to the capture file')
+parser.add_argument('--replay', metavar='FILE', type=str, default=None,
+                    help='serve the reply from the capture file instead of the device')
+parser.add_argument('-n', '--native', action='store_true',
+                    help='use serial routines of libdmr instead of pyserial')
 parser.add_argument('-v', '--verbose', action='store_true',
                     help='verbose print-out')
 parser.add_argument('-e', '--expect', metavar='N', type=int,
@@ -19,8 +28,15 @@ args = parser.parse_args()
 # print(args)
 
 DTSerialCom.DEBUG = args.verbose
+if args.native:
+    DTSerialCom.BACKEND = 'native'
 
-com = DTSerialCom()
+if args.replay is not None:
+    com = DTSerialCom(port=DTReplayPort(args.replay))
+else:
+    com = DTSerialCom(device=args.device)
+if args.capture is not None:
+    com.capture(args.capture)
 
 if args.command == 'LOAD PLL':
     if len(args.data) != 7:
@@ -11,9 +11,9 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import tkinter as tk
 import tkinter.messagebox as tkmsg
-from multiprocessing import Pipe
 
-from process import DTProcess
+from process import start_device_processes
+from dtcom import list_devices
 from config import DTConfiguration
 from tasks import DTScenario, DTTask, dtTaskInit, dtResultDesc
 from singleton import Singleton
@@ -51,17 +51,23 @@ def _scrollEntry(event: tk.Event):
 
 
 class DTApplication(tk.Tk, metaclass=Singleton):
-    """ DMR TEST Application with Tkinter
+    """ DMR TEST Application with Tkinter.
+        Every tester (all connected ones or the devices given) has its own DTProcess. Tasks are run on the
+        device chosen in the main menu. Several testers run at once with one application per tester.
     """
     DEBUG = False
 
     __tkOptionFilename = getenv('HOME') + '/dmr/dmrtest.tkstyle'
     __tkPidFilename = getenv('HOME') + '/dmr/dmrtest.pid'
 
-    def __init__(self):
+    def __init__(self, devices=None):
         global _scrollEntry
         super().__init__()
 
+        self.devices = devices  # testers to be used, all connected ones if None
+        self.taskProcesses = dict()  # device: (DTProcess, connection to send tasks to)
+        self.device = None  # device of the tasks run
+
         print(f'DTApplication created in the procees PID {getpid()}')
 
         # write pid of the main process to file
@@ -178,29 +184,53 @@ class DTApplication(tk.Tk, metaclass=Singleton):
         self.mainloop()
 
         print('Exiting DTApplication')
-        if self.taskProcess.is_alive():
-            self.taskConn.send('terminate')
-        self.taskConn.close()
-        self.childTaskConn.close()
-
-    def startTaskProcess(self):
-        """Method for starting a separate process for measurements
+        for process, conn in self.taskProcesses.values():
+            if process.is_alive():
+                conn.send('terminate')
+            conn.close()
+
+    @property
+    def taskProcess(self):
+        """DTProcess of the current device"""
+        return self.taskProcesses[self.device][0]
+
+    @property
+    def taskConn(self):
+        """Connection to DTProcess of the current device"""
+        return self.taskProcesses[self.device][1]
+
+    def selectDevice(self, device):
+        """Run next tasks on the device"""
+        self.device = device
+        self.title(f'{__appname__} {__version__}' + (f' - {device}' if len(self.taskProcesses) > 1 else ''))
+
+    def startTaskProcess(self, device=None):
+        """Method for starting a separate process for measurements on the device (the current one by default).
+           The first call starts processes for all devices.
         """
-        if not hasattr(self, 'taskConn') and not hasattr(self, 'childTaskConn'):
-            self.taskConn, self.childTaskConn = Pipe()
-        if hasattr(self, 'taskProcess'):
-            del self.taskProcess
-        self.taskProcess = DTProcess(self.childTaskConn)
-        self.taskProcess.start()
-        print(f'DTProcess spawned with pid {self.taskProcess.pid}')
-        # write pid of the task process to file
-        with open(self.__tkPidFilename, 'a') as f:
-            f.write(str(self.taskProcess.pid) + '\n')
+        if len(self.taskProcesses) == 0:
+            devices = list_devices() if self.devices is None else self.devices
+            devices = devices or [None]  # no tester found yet, the process opens the first one connected later
+        else:
+            devices = [self.device if device is None else device]
+            self.taskProcesses[devices[0]][1].close()
+        started = start_device_processes(devices)
+        self.taskProcesses.update(started)
+        if self.device not in self.taskProcesses:
+            self.selectDevice(devices[0])
+        for dev, (process, _) in started.items():
+            print(f'DTProcess spawned with pid {process.pid}' + (f' for device {dev}' if dev else ''))
+            # write pid of the task process to file
+            with open(self.__tkPidFilename, 'a') as f:
+                f.write(str(process.pid) + '\n')
         # setpriority(PRIO_PROCESS, self.taskProcess.pid, -20)
 
     def __startTaskProcessWithChecking(self):
-        if not hasattr(self, 'taskProcess') or not self.taskProcess.is_alive():
+        if len(self.taskProcesses) == 0:
             self.startTaskProcess()
+        for device, (process, _) in list(self.taskProcesses.items()):
+            if not process.is_alive():
+                self.startTaskProcess(device)
         self.after(10000, self.__startTaskProcessWithChecking)  # check every 10 sec that DTProcess is running
 
     def showMessage(self, message: str, master=None, delay=0, status='default'):
@@ -664,8 +694,13 @@ class DTMainMenuFrame(tk.Frame, metaclass=Singleton):
         print('DTApplication DEBUG ' + ('ON' if DTApplication.DEBUG else 'OFF'))
 
     def __setDebugProcess(self):
-        self.master.taskConn.send('debug ' + str(self.debugProcessVar.get()) +
-                                  str(self.debugTasksVar.get()) + str(self.debugCommVar.get()))
+        for _, conn in self.master.taskProcesses.values():
+            conn.send('debug ' + str(self.debugProcessVar.get()) +
+                      str(self.debugTasksVar.get()) + str(self.debugCommVar.get()))
+
+    def __chooseDevice(self, device):
+        self.master.selectDevice(device)
+        self.deviceText.set(f'Устройство {device}')
 
     def __createMenuFrame(self):
         self.menuFrame = tk.Frame(self, padx=10, pady=10)
@@ -683,6 +718,17 @@ class DTMainMenuFrame(tk.Frame, metaclass=Singleton):
         csmb.grid(row=irow, sticky=tk.W+tk.E)
         irow += 1
 
+        if len(self.master.taskProcesses) > 1:  # several testers, tasks are run on the chosen one
+            self.deviceText = tk.StringVar()
+            self.deviceText.set(f'Устройство {self.master.device}')
+            cdmb = tk.Menubutton(self.menuFrame, textvariable=self.deviceText)
+            cdmb.configure(relief=tk.RAISED, height=2, highlightthickness=2, takefocus=True)
+            cdmb['menu'] = cdmb.menu = DTChooseObjectMenu(cdmb, command=self.__chooseDevice,
+                                                          objects=self.master.taskProcesses.keys())
+            self.menuFrame.rowconfigure(irow, pad=20)
+            cdmb.grid(row=irow, sticky=tk.W+tk.E)
+            irow += 1
+
         cmmb = tk.Menubutton(self.menuFrame, text='Выбрать измерение')
         cmmb.configure(relief=tk.RAISED, height=2, highlightthickness=2, takefocus=True)
         cmmb['menu'] = cmmb.menu = DTChooseObjectMenu(cmmb, command=self.__chooseTask,